@@ -0,0 +1,93 @@
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Callable, Awaitable, Any, Iterable, Tuple
+
+from ffmpeg_cmd import LADDER, profile_step
+from telemetry import ProgressStats, SLOW_SPEED
+
+logger = logging.getLogger("SatoruGojo")
+
+# Speed (with -re) an encoder must hold before it is trusted with a better profile.
+STEADY_SPEED = 0.99
+# Progress history needed before any decision is made on a fresh encoder.
+MIN_OBSERVED = 10.0
+
+
+class AdaptiveLadder:
+    """Moves auto-mode chats along the profile ladder from measured encoder speed.
+
+    An encoder averaging below ``SLOW_SPEED`` for ``settle`` seconds is moved
+    one step down. One that held realtime for ``upgrade_after`` seconds moves
+    one step up, if ``has_room`` agrees and the ceiling allows it. An upgrade
+    that is followed by a downgrade doubles that chat's upgrade delay, so a
+    host at its limit does not flap between two profiles.
+    """
+
+    def __init__(self, candidates: Callable[[], Iterable[Tuple[int, str, float, ProgressStats]]],
+                 switch: Callable[[int, str], Awaitable[Any]],
+                 has_room: Callable[[int, str], bool],
+                 ceiling: str = "720p", floor: str = "audio",
+                 interval: float = 5.0, settle: float = 20.0, upgrade_after: float = 120.0):
+        self.candidates = candidates
+        self.switch = switch
+        self.has_room = has_room
+        self.ceiling = ceiling
+        self.floor = floor
+        self.interval = interval
+        self.settle = settle
+        self.upgrade_after = upgrade_after
+        self._upgrade_delay: Dict[int, float] = {}
+        self._upgraded_at: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.downgrades = 0
+        self.upgrades = 0
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def reset(self, chat_id: int):
+        self._upgrade_delay.pop(chat_id, None)
+        self._upgraded_at.pop(chat_id, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for chat_id, profile, runtime, progress in list(self.candidates()):
+                try:
+                    target = self.decide(chat_id, profile, runtime, progress)
+                    if target != profile:
+                        await self.switch(chat_id, target)
+                except Exception as e:
+                    logger.error(f"Adaptive profile check failed for chat {chat_id}: {e}")
+
+    def decide(self, chat_id: int, profile: str, runtime: float, progress: ProgressStats) -> str:
+        samples = progress.samples
+        if not samples or samples[-1][0] - samples[0][0] < MIN_OBSERVED:
+            return profile
+        index = LADDER.index(profile)
+        speed = progress.avg_speed
+        if speed < SLOW_SPEED and runtime >= self.settle and index < LADDER.index(self.floor):
+            target = profile_step(profile, 1)
+            upgraded_at = self._upgraded_at.pop(chat_id, None)
+            if upgraded_at and time.monotonic() - upgraded_at < self.upgrade_after:
+                self._upgrade_delay[chat_id] = min(self._upgrade_delay.get(chat_id, self.upgrade_after) * 2, 1800)
+            self.downgrades += 1
+            logger.info(f"Chat {chat_id} encoding at {speed:.2f}x on {profile}, stepping down to {target}")
+            return target
+        delay = self._upgrade_delay.get(chat_id, self.upgrade_after)
+        if speed >= STEADY_SPEED and runtime >= delay and index > LADDER.index(self.ceiling):
+            target = profile_step(profile, -1)
+            if self.has_room(chat_id, target):
+                self._upgraded_at[chat_id] = time.monotonic()
+                self.upgrades += 1
+                logger.info(f"Chat {chat_id} steady at {speed:.2f}x on {profile}, stepping up to {target}")
+                return target
+        return profile
@@ -0,0 +1,423 @@
+# Offline streaming benchmark: `python bench.py --chats 4 --tracks 3 --out run.json`.
+#
+# Synthetic sources are generated with lavfi, streamed through the same command
+# builders, supervisor and publisher the bot uses, and received by a local
+# `ffmpeg -listen 1` RTMP sink per session. CPU and RSS are sampled from /proc,
+# so this only runs on Linux.
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from supervisor import FFmpegSupervisor, StreamJob, install_child_watcher
+from publisher import Publisher
+from telemetry import ProgressStats, with_progress, follow_progress
+from ffmpeg_cmd import (
+    build_ffmpeg_video, build_ffmpeg_audio, build_ffmpeg_copy,
+    build_feeder_video, build_feeder_audio,
+)
+
+logger = logging.getLogger("SatoruGojo")
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+SINK_STATS_PERIOD = 0.1
+
+# name: (frame size or None for audio-only, video codec args, audio codec args, extension)
+SOURCES = {
+    "1080p-h264": ("1920x1080", ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", "60"],
+                   ["-c:a", "aac", "-b:a", "128k"], "mp4"),
+    "720p-h264": ("1280x720", ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", "60"],
+                  ["-c:a", "aac", "-b:a", "128k"], "mp4"),
+    "480p-mpeg4": ("854x480", ["-c:v", "mpeg4", "-q:v", "4"], ["-c:a", "libmp3lame", "-b:a", "128k"], "mkv"),
+    "720p-vp9": ("1280x720", ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-b:v", "1500k"],
+                 ["-c:a", "libopus", "-b:a", "96k"], "webm"),
+    "audio-mp3": (None, [], ["-c:a", "libmp3lame", "-b:a", "192k"], "mp3"),
+}
+MODES = ("video", "audio", "copy", "gapless")
+
+
+def quiet(command: List[str]) -> List[str]:
+    return [command[0], "-hide_banner", "-loglevel", "error", *command[1:]]
+
+
+def compatible(mode: str, source: str) -> bool:
+    size = SOURCES[source][0]
+    if mode == "audio":
+        return True
+    if mode == "copy":
+        # The bot only takes the copy path for H.264 sources (see probe.py).
+        return "h264" in source
+    return size is not None
+
+
+def generate_source(name: str, duration: int, media_dir: str) -> str:
+    size, vcodec, acodec, ext = SOURCES[name]
+    path = os.path.join(media_dir, f"{name}-{duration}s.{ext}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(media_dir, exist_ok=True)
+    partial = os.path.join(media_dir, f"{name}-{duration}s.partial.{ext}")
+    command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+    if size:
+        command += ["-f", "lavfi", "-i", f"testsrc2=s={size}:r=30:d={duration}"]
+    command += ["-f", "lavfi", "-i", f"sine=frequency=440:beep_factor=4:sample_rate=48000:d={duration}"]
+    command += [*vcodec, *acodec, "-shortest", "-fflags", "+bitexact", partial]
+    subprocess.run(command, check=True)
+    os.replace(partial, path)
+    return path
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def is_listening(port: int) -> bool:
+    # Probing with connect() would use up the sink's single accepted session.
+    needle = f":{port:04X} "
+    try:
+        with open("/proc/net/tcp") as f:
+            return any(needle in line and line.split()[3] == "0A" for line in f)
+    except OSError:
+        return False
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 3)
+
+
+class ProcessSampler:
+    """Polls /proc for CPU time and RSS of the bot-side FFmpeg processes.
+
+    Sinks are deliberately not tracked; they stand in for the RTMP server.
+    """
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.pids = set()
+        self.cpu: Dict[int, float] = {}
+        self.peak_rss = 0
+        self.peak_process_rss = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, pid: int):
+        self.pids.add(pid)
+        self._sample()
+
+    @staticmethod
+    def _read(pid: int) -> Optional[Tuple[float, int]]:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+            rss = 0
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError, IndexError):
+            return None
+        return cpu, rss
+
+    def _sample(self):
+        total_rss = 0
+        for pid in list(self.pids):
+            sample = self._read(pid)
+            if sample is None:
+                self.pids.discard(pid)
+                continue
+            cpu, rss = sample
+            self.cpu[pid] = cpu
+            total_rss += rss
+            self.peak_process_rss = max(self.peak_process_rss, rss)
+        self.peak_rss = max(self.peak_rss, total_rss)
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._sample()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self.cpu.values())
+
+
+class SinkStats(ProgressStats):
+    """Records every moment the sink's media clock moved forward."""
+
+    def __init__(self):
+        super().__init__()
+        self.advances: List[float] = []
+
+    def _commit(self, block: Dict[str, str], ended: bool):
+        previous = self.out_time
+        super()._commit(block, ended)
+        if self.out_time > previous:
+            self.advances.append(self.updated_at)
+
+
+class Sink:
+    """A single-session local RTMP server standing in for Telegram's ingest."""
+
+    def __init__(self):
+        self.port = free_port()
+        self.url = f"rtmp://127.0.0.1:{self.port}/live/bench"
+        self.stats = SinkStats()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, timeout: float = 5.0):
+        command, read_fd, write_fd = with_progress([
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-stats_period", str(SINK_STATS_PERIOD),
+            "-listen", "1", "-i", self.url, "-map", "0", "-c", "copy", "-f", "null", "-",
+        ])
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.DEVNULL, pass_fds=(write_fd,)
+            )
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._task = asyncio.create_task(follow_progress(read_fd, self.stats))
+        deadline = time.monotonic() + timeout
+        while not is_listening(self.port):
+            if time.monotonic() > deadline or self.process.returncode is not None:
+                raise RuntimeError(f"RTMP sink on port {self.port} did not come up")
+            await asyncio.sleep(0.01)
+
+    async def wait(self, timeout: float = 15.0):
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class QuietPublisher(Publisher):
+    def command(self):
+        return quiet(super().command())
+
+
+async def run_track(supervisor: FFmpegSupervisor, sampler: ProcessSampler, chat_id: int,
+                    command: List[str], stdout: Optional[int] = None) -> StreamJob:
+    finished = asyncio.get_event_loop().create_future()
+
+    async def on_finish(job):
+        finished.set_result(job)
+
+    job = await supervisor.start(chat_id, quiet(command), on_finish=on_finish, stdout=stdout)
+    sampler.add(job.process.pid)
+    return await finished
+
+
+async def run_chat(supervisor: FFmpegSupervisor, sampler: ProcessSampler, chat_id: int,
+                   mode: str, source: str, tracks: int) -> dict:
+    # Mirrors the bot's handoff: the next track starts from the previous one's exit callback.
+    build = {"video": build_ffmpeg_video, "audio": build_ffmpeg_audio, "copy": build_ffmpeg_copy}[mode]
+    sinks = [Sink()]
+    await sinks[0].start()
+    starts, jobs = [], []
+    for index in range(tracks):
+        if index + 1 < tracks:
+            # Pre-start the next session's sink so its startup is not counted as gap.
+            sinks.append(Sink())
+            await sinks[-1].start()
+        starts.append(time.monotonic())
+        jobs.append(await run_track(supervisor, sampler, chat_id, build(source, sinks[index].url)))
+    for sink in sinks:
+        await sink.wait()
+    advances = [sink.stats.advances for sink in sinks]
+    return {
+        "ttff": [a[0] - start for a, start in zip(advances, starts) if a],
+        "gaps": [after[0] - before[-1] for before, after in zip(advances, advances[1:]) if before and after],
+        "media_s": sum(sink.stats.out_time for sink in sinks),
+        "speeds": [job.progress.avg_speed for job in jobs if job.progress.samples],
+        "failures": sum(1 for job in jobs if job.returncode != 0),
+    }
+
+
+async def run_gapless_chat(supervisor: FFmpegSupervisor, sampler: ProcessSampler, chat_id: int,
+                           source: str, tracks: int) -> dict:
+    build = build_feeder_audio if SOURCES[source][0] is None else build_feeder_video
+    sink = Sink()
+    await sink.start()
+    publisher = QuietPublisher(chat_id, sink.url)
+    started = time.monotonic()
+    await publisher.start()
+    sampler.add(publisher.process.pid)
+    handoffs, jobs = [], []
+    for _ in range(tracks):
+        command = build(source, publisher.elapsed())
+        jobs.append(await run_track(supervisor, sampler, chat_id, command, stdout=publisher.write_fd))
+        handoffs.append(time.monotonic())
+    await publisher.close()
+    await sink.wait()
+    advances = sink.stats.advances
+    gaps = []
+    for handoff in handoffs[:-1]:
+        before = [a for a in advances if a <= handoff]
+        after = [a for a in advances if a > handoff]
+        if before and after:
+            gaps.append(after[0] - before[-1])
+    return {
+        "ttff": [advances[0] - started] if advances else [],
+        "gaps": gaps,
+        "media_s": sink.stats.out_time,
+        "speeds": [publisher.progress.avg_speed] if publisher.progress.samples else [],
+        "failures": sum(1 for job in jobs if job.returncode != 0),
+    }
+
+
+async def run_scenario(mode: str, source: str, path: str, chats: int, tracks: int) -> dict:
+    supervisor = FFmpegSupervisor()
+    sampler = ProcessSampler()
+    sampler.start()
+    started = time.monotonic()
+    if mode == "gapless":
+        runs = [run_gapless_chat(supervisor, sampler, chat_id, path, tracks) for chat_id in range(chats)]
+    else:
+        runs = [run_chat(supervisor, sampler, chat_id, mode, path, tracks) for chat_id in range(chats)]
+    results = await asyncio.gather(*runs, return_exceptions=True)
+    await sampler.stop()
+    await supervisor.stop_all()
+    errors = [repr(r) for r in results if isinstance(r, Exception)]
+    results = [r for r in results if not isinstance(r, Exception)]
+    ttff = [v for r in results for v in r["ttff"]]
+    gaps = [v for r in results for v in r["gaps"]]
+    speeds = [v for r in results for v in r["speeds"]]
+    media_s = sum(r["media_s"] for r in results)
+    return {
+        "mode": mode,
+        "source": source,
+        "chats": chats,
+        "tracks": tracks,
+        "wall_s": round(time.monotonic() - started, 3),
+        "media_s": round(media_s, 3),
+        "ttff_s": {"p50": percentile(ttff, 0.5), "max": percentile(ttff, 1.0)},
+        "gap_s": {"p50": percentile(gaps, 0.5), "max": percentile(gaps, 1.0), "count": len(gaps)},
+        "cpu_s": round(sampler.cpu_seconds, 3),
+        "cpu_s_per_min": round(sampler.cpu_seconds / (media_s / 60), 3) if media_s else None,
+        "peak_rss_mb": round(sampler.peak_rss / 1048576, 1),
+        "peak_process_rss_mb": round(sampler.peak_process_rss / 1048576, 1),
+        "speed": {"mean": round(statistics.mean(speeds), 3) if speeds else None,
+                  "min": round(min(speeds), 3) if speeds else None},
+        "failures": sum(r["failures"] for r in results),
+        "errors": errors,
+    }
+
+
+def environment(args) -> dict:
+    def first_line(command):
+        try:
+            return subprocess.run(command, capture_output=True, text=True).stdout.splitlines()[0]
+        except (OSError, IndexError):
+            return None
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "ffmpeg": first_line(["ffmpeg", "-version"]),
+        "commit": first_line(["git", "rev-parse", "--short", "HEAD"]),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "sink_stats_period_s": SINK_STATS_PERIOD,
+        "args": vars(args),
+    }
+
+
+def compare(baseline: dict, current: dict):
+    # Print the headline deltas per scenario; the JSON itself stays the source of truth.
+    old = {(r["mode"], r["source"], r["chats"], r["tracks"]): r for r in baseline.get("results", [])}
+    for result in current["results"]:
+        before = old.get((result["mode"], result["source"], result["chats"], result["tracks"]))
+        if not before:
+            continue
+        fields = [
+            ("ttff p50", before["ttff_s"]["p50"], result["ttff_s"]["p50"]),
+            ("gap max", before["gap_s"]["max"], result["gap_s"]["max"]),
+            ("cpu/min", before["cpu_s_per_min"], result["cpu_s_per_min"]),
+            ("peak rss", before["peak_rss_mb"], result["peak_rss_mb"]),
+        ]
+        deltas = ", ".join(
+            f"{name} {old_value} -> {new_value}" for name, old_value, new_value in fields
+            if old_value is not None and new_value is not None
+        )
+        print(f"{result['mode']}/{result['source']}: {deltas}", file=sys.stderr)
+
+
+async def main_async(args) -> dict:
+    install_child_watcher()
+    sources = args.sources.split(",")
+    modes = args.modes.split(",")
+    for name in sources:
+        if name not in SOURCES:
+            raise SystemExit(f"unknown source {name!r}, choose from {', '.join(SOURCES)}")
+    for mode in modes:
+        if mode not in MODES:
+            raise SystemExit(f"unknown mode {mode!r}, choose from {', '.join(MODES)}")
+    paths = {name: generate_source(name, args.duration, args.media_dir) for name in sources}
+    report = {"environment": environment(args), "results": []}
+    for mode in modes:
+        for source in sources:
+            if not compatible(mode, source):
+                continue
+            print(f"Running {mode}/{source} with {args.chats} chats x {args.tracks} tracks...", file=sys.stderr)
+            report["results"].append(await run_scenario(mode, source, paths[source], args.chats, args.tracks))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RTMP streaming benchmark")
+    parser.add_argument("--chats", type=int, default=2, help="concurrent simulated chats")
+    parser.add_argument("--tracks", type=int, default=3, help="tracks queued per chat")
+    parser.add_argument("--duration", type=int, default=10, help="seconds per synthetic track")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--sources", default=",".join(SOURCES))
+    parser.add_argument("--media-dir", default="cache/bench")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON report to print deltas against")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
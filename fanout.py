@@ -0,0 +1,232 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable, Any
+
+from telemetry import ProgressStats, with_progress, follow_progress
+
+logger = logging.getLogger("SatoruGojo")
+
+TS_PACKET = 188
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class _Subscriber:
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    started: bool = False
+    lagged: bool = False
+
+
+class SharedEncode:
+    """One encoder whose MPEG-TS output is copied to any number of chat relays."""
+
+    def __init__(self, key: Tuple, command: List[str],
+                 feed: Optional[Callable[[asyncio.StreamWriter], Awaitable[Any]]] = None,
+                 rendition: Optional[Tuple[str, str]] = None, expected_duration: float = 0.0,
+                 max_lag: int = 64):
+        self.key = key
+        self.command = command
+        self.feed = feed
+        self.rendition = rendition
+        self.expected_duration = expected_duration
+        self.max_lag = max_lag
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.progress = ProgressStats()
+        self.subscribers: Dict[int, _Subscriber] = {}
+        self.started_at = time.monotonic()
+        self.offset = 0
+        self.returncode: Optional[int] = None
+        self.stopped = False
+        self.on_exit: Optional[Callable[["SharedEncode"], Awaitable[Any]]] = None
+        self._feed_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.process and self.process.returncode is None)
+
+    @property
+    def runtime(self) -> float:
+        return time.monotonic() - self.started_at
+
+    async def start(self):
+        command, progress_fd, progress_write_fd = with_progress(self.command)
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE if self.feed else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                pass_fds=(progress_write_fd,),
+            )
+        except Exception:
+            os.close(progress_fd)
+            raise
+        finally:
+            os.close(progress_write_fd)
+        self.started_at = time.monotonic()
+        asyncio.create_task(follow_progress(progress_fd, self.progress))
+        if self.feed:
+            self._feed_task = asyncio.create_task(self.feed(self.process.stdin))
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                chunk = await self.process.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._publish(chunk)
+        finally:
+            for subscriber in self.subscribers.values():
+                subscriber.queue.put_nowait(None)
+            self.returncode = await self.process.wait()
+            if self._feed_task:
+                self._feed_task.cancel()
+            logger.info(
+                f"Shared encode {self.key} exited with code {self.returncode} after {self.runtime:.1f}s"
+                f"{' (stopped)' if self.stopped else ''}"
+            )
+            if self.on_exit:
+                try:
+                    await self.on_exit(self)
+                except Exception as e:
+                    logger.error(f"Shared encode exit callback failed: {e}")
+
+    def _publish(self, chunk: bytes):
+        # Late joiners start on the next TS packet boundary; their relay then waits for a keyframe.
+        skip = (-self.offset) % TS_PACKET
+        self.offset += len(chunk)
+        for subscriber in self.subscribers.values():
+            if subscriber.lagged:
+                continue
+            if subscriber.queue.qsize() >= self.max_lag:
+                # Cut a stalled relay loose rather than buffering for it without bound.
+                subscriber.lagged = True
+                subscriber.queue.put_nowait(None)
+            elif subscriber.started:
+                subscriber.queue.put_nowait(chunk)
+            elif skip < len(chunk):
+                subscriber.started = True
+                subscriber.queue.put_nowait(chunk[skip:])
+
+    def subscribe(self, chat_id: int) -> _Subscriber:
+        subscriber = _Subscriber()
+        self.subscribers[chat_id] = subscriber
+        return subscriber
+
+    def unsubscribe(self, chat_id: int):
+        self.subscribers.pop(chat_id, None)
+        if not self.subscribers and self.alive and not self.stopped:
+            logger.info(f"Last chat left shared encode {self.key}, stopping it")
+            asyncio.create_task(self.stop())
+
+    async def stop(self, timeout: float = 10.0):
+        self.stopped = True
+        if not self.alive:
+            return
+        try:
+            self.process.terminate()
+            await asyncio.wait_for(self.process.wait(), timeout=timeout)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+
+
+class FanoutHub:
+    """Shares one encode per (source, profile) between every chat playing it.
+
+    A chat that starts a source already being encoded, within ``join_window``
+    seconds of that encode's start, gets a cheap ``-c copy`` relay instead of
+    its own libx264. Each relay reads from its own queue, so a chat joining,
+    skipping or stalling never touches the others: a relay that falls more
+    than ``max_lag`` chunks behind is cut loose and ends its track. The
+    encode stops when its last chat leaves.
+    """
+
+    def __init__(self, join_window: Optional[float] = 15.0, max_lag: int = 64,
+                 on_exit: Optional[Callable[[SharedEncode], Awaitable[Any]]] = None):
+        self.join_window = join_window
+        self.max_lag = max_lag
+        self.on_exit = on_exit
+        self.encodes: Dict[Tuple, SharedEncode] = {}
+        self._lock = asyncio.Lock()
+        self.joins = 0
+        self.created = 0
+        self.lagged = 0
+
+    def joinable(self, key: Tuple) -> Optional[SharedEncode]:
+        encode = self.encodes.get(key)
+        if not encode or not encode.alive or encode.stopped:
+            return None
+        if self.join_window is not None and encode.runtime > self.join_window:
+            return None
+        return encode
+
+    async def join_or_start(self, key: Tuple, chat_id: int,
+                            make: Callable[[], SharedEncode]) -> Tuple[SharedEncode, _Subscriber, bool]:
+        # Subscribing before the first await after start() means a new encode's creator
+        # sees its very first packet; callers must leave() once the chat is done.
+        async with self._lock:
+            encode = self.joinable(key)
+            if encode:
+                self.joins += 1
+                return encode, encode.subscribe(chat_id), False
+            encode = make()
+            encode.max_lag = self.max_lag
+            encode.on_exit = self._finished
+            await encode.start()
+            self.encodes[key] = encode
+            self.created += 1
+            return encode, encode.subscribe(chat_id), True
+
+    def leave(self, encode: SharedEncode, chat_id: int, subscriber: _Subscriber):
+        if encode.subscribers.get(chat_id) is subscriber:
+            encode.unsubscribe(chat_id)
+
+    async def _finished(self, encode: SharedEncode):
+        if self.encodes.get(encode.key) is encode:
+            del self.encodes[encode.key]
+        if self.on_exit:
+            await self.on_exit(encode)
+
+    def relay_feed(self, encode: SharedEncode, chat_id: int, subscriber: _Subscriber):
+        async def feed(writer):
+            try:
+                while True:
+                    chunk = await subscriber.queue.get()
+                    if chunk is None:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+                if subscriber.lagged:
+                    self.lagged += 1
+                    logger.warning(f"Relay for chat {chat_id} fell behind shared encode {encode.key}, dropped it")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self.leave(encode, chat_id, subscriber)
+                try:
+                    writer.close()
+                except Exception:
+                    pass
+        return feed
+
+    async def stop_all(self):
+        await asyncio.gather(*(encode.stop() for encode in list(self.encodes.values())), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "encodes": len(self.encodes),
+            "relays": sum(len(encode.subscribers) for encode in self.encodes.values()),
+            "created": self.created,
+            "joins": self.joins,
+            "lagged": self.lagged,
+        }
@@ -0,0 +1,294 @@
+import math
+from typing import List, Optional
+
+# Shared output settings so every feeder hands the publisher an identical stream layout.
+FEED_WIDTH, FEED_HEIGHT, FEED_FPS = 1280, 720, 30
+
+# Pre-encoded still loops for audio tracks: few frames, a keyframe every two seconds.
+STILL_FPS = 5
+STILL_GOP = 10
+STILL_SECONDS = 10
+
+# Encoding ladder, best first. "audio" drops the video track altogether.
+PROFILES = {
+    "1080p": {"preset": "veryfast", "size": (1920, 1080), "video_bitrate": 3500},
+    "720p": {"preset": "superfast", "size": (1280, 720), "video_bitrate": 1500},
+    "480p": {"preset": "ultrafast", "size": (854, 480), "video_bitrate": 800},
+    "audio": None,
+}
+LADDER = tuple(PROFILES)
+DEFAULT_PROFILE = "720p"
+
+# Fixed output GOP, so a restart can be lined up with the keyframe the viewer last got.
+OUTPUT_FPS = 30
+GOP_FRAMES = 50
+GOP_SECONDS = GOP_FRAMES / OUTPUT_FPS
+
+def profile_step(profile: str, steps: int) -> str:
+    # Positive steps move down the ladder (cheaper), negative steps move up.
+    index = min(max(LADDER.index(profile) + steps, 0), len(LADDER) - 1)
+    return LADDER[index]
+
+# (probesize bytes, analyzeduration microseconds) by container. Self-describing headers need
+# almost nothing; MPEG-TS, HLS and FLV only reveal their streams in the packets themselves.
+PROBE_SIZES = {
+    "mp4": ("32", "0"),
+    "webm": ("32", "0"),
+    "matroska": ("32", "0"),
+    "mp3": ("65536", "0"),
+    "aac": ("65536", "0"),
+    "ogg": ("65536", "0"),
+    "flv": ("262144", "500000"),
+    "mpegts": ("1000000", "1000000"),
+    "hls": ("1000000", "2000000"),
+}
+DEFAULT_PROBE_SIZE = ("262144", "500000")
+
+# Seconds FFmpeg waits on a silent connection, and the longest pause between its reconnect attempts.
+NET_RW_TIMEOUT = 15
+NET_RECONNECT_DELAY_MAX = 5
+
+def parse_timestamp(text: str) -> Optional[float]:
+    # Accepts "90", "1:30" or "1:02:30".
+    try:
+        parts = [float(part) for part in text.split(":")]
+    except ValueError:
+        return None
+    # float() also takes "nan" and "inf", which would reach FFmpeg as -ss nan.
+    if not parts or len(parts) > 3 or any(part < 0 or not math.isfinite(part) for part in parts):
+        return None
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+def _seek_args(seek) -> List[str]:
+    return ["-ss", f"{seek:.3f}"] if seek else []
+
+def _network_args(input_file) -> List[str]:
+    if not str(input_file).startswith(("http://", "https://")):
+        return []
+    return [
+        "-reconnect", "1",
+        "-reconnect_streamed", "1",
+        "-reconnect_on_network_error", "1",
+        "-reconnect_delay_max", str(NET_RECONNECT_DELAY_MAX),
+        "-rw_timeout", str(NET_RW_TIMEOUT * 1000000),
+    ]
+
+def _input_args(input_file, seek=None, container=None) -> List[str]:
+    probesize, analyzeduration = PROBE_SIZES.get(container, DEFAULT_PROBE_SIZE)
+    return [
+        "-fflags", "nobuffer",
+        "-flags", "low_delay",
+        "-probesize", probesize,
+        "-analyzeduration", analyzeduration,
+        *_network_args(input_file),
+        "-re",
+        *_seek_args(seek),
+        "-i", input_file,
+    ]
+
+def _tee_output(url, cache_file=None) -> List[str]:
+    if not cache_file:
+        return ["-f", "flv", url]
+    return ["-f", "tee", f"[f=flv:onfail=abort]{url}|[f=flv:onfail=ignore]{cache_file}"]
+
+def _flv_output(url, cache_file=None, audio_only=False) -> List[str]:
+    if not cache_file:
+        return ["-f", "flv", url]
+    # Tee the live encode into a rendition file so the next play is a plain remux.
+    # tee does not advertise global headers itself, which FLV needs for H.264/AAC.
+    maps = ["-map", "0:a:0"] if audio_only else ["-map", "0:v:0", "-map", "0:a:0?", "-flags:v", "+global_header"]
+    return [*maps, "-flags:a", "+global_header", *_tee_output(url, cache_file)]
+
+def _video_encode_args(preset, size, video_bitrate) -> List[str]:
+    width, height = size
+    return [
+        "-c:v", "libx264", "-preset", preset, "-tune", "zerolatency",
+        "-pix_fmt", "yuv420p", "-b:v", f"{video_bitrate}k", "-maxrate", f"{video_bitrate}k",
+        "-bufsize", f"{video_bitrate * 2}k",
+        "-g", str(GOP_FRAMES), "-keyint_min", str(GOP_FRAMES),
+        "-vf", f"scale={width}:{height},fps={OUTPUT_FPS}",
+        "-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100",
+    ]
+
+def build_ffmpeg_video(input_file, url, cache_file=None, seek=None, container=None,
+                       preset="superfast", size=(1280, 720), video_bitrate=1500):
+    # Ultra-low-latency flags added!
+    return [
+        "ffmpeg",
+        *_input_args(input_file, seek, container),
+        *_video_encode_args(preset, size, video_bitrate),
+        *_flv_output(url, cache_file)
+    ]
+
+def build_fanout_encoder(input_file, cache_file=None, container=None,
+                         preset="superfast", size=(1280, 720), video_bitrate=1500):
+    # One encode for every chat playing this source: MPEG-TS on stdout, which a
+    # relay can pick up at any packet boundary (x264 repeats SPS/PPS in-band).
+    if cache_file:
+        # Global headers for the FLV rendition take SPS/PPS out of the stream; put them back for TS.
+        output = [
+            "-map", "0:v:0", "-map", "0:a:0?", "-flags:v", "+global_header", "-flags:a", "+global_header",
+            "-f", "tee", f"[f=mpegts:bsfs/v=dump_extra:onfail=abort]pipe:1|[f=flv:onfail=ignore]{cache_file}"
+        ]
+    else:
+        output = ["-f", "mpegts", "pipe:1"]
+    return [
+        "ffmpeg",
+        *_input_args(input_file, container=container),
+        *_video_encode_args(preset, size, video_bitrate),
+        *output
+    ]
+
+def build_fanout_relay(url):
+    # Per-chat remux of the shared encode; starts at the first keyframe it sees.
+    return [
+        "ffmpeg",
+        "-fflags", "+genpts+discardcorrupt",
+        "-f", "mpegts",
+        "-i", "pipe:0",
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c", "copy", "-bsf:a", "aac_adtstoasc",
+        "-f", "flv", url
+    ]
+
+def build_ffmpeg_audio(input_file, url, cache_file=None, seek=None, container=None):
+    # Ultra-low-latency flags added!
+    return [
+        "ffmpeg",
+        *_input_args(input_file, seek, container),
+        "-vn", "-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100",
+        *_flv_output(url, cache_file, audio_only=True)
+    ]
+
+def build_still_loop(image, output_file):
+    # Encoded once per thumbnail; a black frame when the track has none.
+    if image:
+        source = ["-loop", "1", "-framerate", str(STILL_FPS), "-i", image]
+    else:
+        source = ["-f", "lavfi", "-i", f"color=c=black:s={FEED_WIDTH}x{FEED_HEIGHT}:r={STILL_FPS}"]
+    return [
+        "ffmpeg", "-y",
+        *source,
+        "-t", str(STILL_SECONDS),
+        "-vf", (
+            f"scale={FEED_WIDTH}:{FEED_HEIGHT}:force_original_aspect_ratio=decrease,"
+            f"pad={FEED_WIDTH}:{FEED_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p"
+        ),
+        "-c:v", "libx264", "-preset", "medium", "-tune", "stillimage", "-crf", "28",
+        "-r", str(STILL_FPS), "-g", str(STILL_GOP), "-keyint_min", str(STILL_GOP), "-sc_threshold", "0",
+        "-an", "-movflags", "+faststart",
+        "-f", "mp4", output_file
+    ]
+
+def build_ffmpeg_still(input_file, still_file, url, cache_file=None, seek=None, container=None, copy_audio=False):
+    # Audio plus a looped, already-encoded picture: the video is only remuxed, so this costs about
+    # what -vn does while giving ingests and players the video track many of them expect.
+    audio = ["-c:a", "copy"] if copy_audio else ["-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100"]
+    if cache_file:
+        # The rendition stays audio-only, so it is shared with plain audio playback.
+        output = [
+            "-flags:a", "+global_header",
+            "-f", "tee", f"[f=flv:onfail=abort]{url}|[f=flv:select=a:onfail=ignore]{cache_file}"
+        ]
+    else:
+        output = ["-f", "flv", url]
+    return [
+        "ffmpeg",
+        *_input_args(input_file, seek, container),
+        "-stream_loop", "-1", "-re", "-i", still_file,
+        "-map", "1:v:0", "-map", "0:a:0",
+        "-c:v", "copy",
+        *audio,
+        "-shortest",
+        *output
+    ]
+
+def build_ffmpeg_copy(input_file, url, transcode_audio=False, seek=None, cache_file=None):
+    # Source is already RTMP-ready H.264: no decode, no scale, just remux (and maybe fix audio).
+    # Copied streams keep the input's codec headers, so only a transcoded audio track needs global ones for tee.
+    audio = ["-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100"] if transcode_audio else ["-c:a", "copy"]
+    if transcode_audio and cache_file:
+        audio += ["-flags:a", "+global_header"]
+    return [
+        "ffmpeg",
+        *_network_args(input_file),
+        "-re",
+        *_seek_args(seek),
+        "-i", input_file,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c:v", "copy",
+        *audio,
+        *_tee_output(url, cache_file)
+    ]
+
+def build_ffmpeg_audio_copy(input_file, url, seek=None, cache_file=None):
+    return [
+        "ffmpeg",
+        *_network_args(input_file),
+        "-re",
+        *_seek_args(seek),
+        "-i", input_file,
+        "-vn", "-c:a", "copy",
+        *_tee_output(url, cache_file)
+    ]
+
+def build_publisher(url, profile=DEFAULT_PROFILE):
+    # Long-lived per-chat process: reads concatenated MPEG-TS from stdin and keeps
+    # one x264/AAC encoder and one RTMP session open across track changes.
+    settings = PROFILES[profile]
+    if settings:
+        width, height = settings["size"]
+        bitrate = settings["video_bitrate"]
+        video = [
+            "-map", "0:v:0",
+            "-vf", f"scale={width}:{height}",
+            "-c:v", "libx264", "-preset", settings["preset"], "-tune", "zerolatency",
+            "-pix_fmt", "yuv420p", "-b:v", f"{bitrate}k", "-maxrate", f"{bitrate}k", "-bufsize", f"{bitrate * 2}k",
+            "-g", "50", "-keyint_min", "50", "-r", str(FEED_FPS),
+        ]
+    else:
+        # Feeders always carry video; an audio-profile session simply leaves it out.
+        video = ["-vn"]
+    return [
+        "ffmpeg",
+        "-fflags", "+genpts+discardcorrupt",
+        "-f", "mpegts",
+        "-i", "pipe:0",
+        *video,
+        "-map", "0:a:0",
+        "-af", "aresample=async=1000",
+        "-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100",
+        "-f", "flv", url
+    ]
+
+def _feeder_output(ts_offset: float) -> List[str]:
+    # Near-lossless intra-friendly codecs: cheap to produce, and the publisher does the real encode.
+    return [
+        "-c:v", "mpeg2video", "-q:v", "3", "-g", "15",
+        "-c:a", "mp2", "-b:a", "256k", "-ac", "2", "-ar", "44100",
+        "-output_ts_offset", f"{ts_offset:.3f}",
+        "-f", "mpegts", "pipe:1"
+    ]
+
+def build_feeder_video(input_file, ts_offset: float, seek=None, container=None):
+    return [
+        "ffmpeg",
+        *_input_args(input_file, seek, container),
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale={FEED_WIDTH}:{FEED_HEIGHT},fps={FEED_FPS}",
+        *_feeder_output(ts_offset)
+    ]
+
+def build_feeder_audio(input_file, ts_offset: float, seek=None, container=None):
+    # The publisher expects a video stream on every track, so pad audio with black frames.
+    return [
+        "ffmpeg",
+        *_input_args(input_file, seek, container),
+        "-f", "lavfi", "-i", f"color=c=black:s={FEED_WIDTH}x{FEED_HEIGHT}:r={FEED_FPS}",
+        "-map", "1:v:0", "-map", "0:a:0",
+        "-shortest",
+        *_feeder_output(ts_offset)
+    ]
@@ -0,0 +1,234 @@
+import os
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional, Dict, Callable, Awaitable, Tuple, TypeVar
+
+from track import Track
+from ytcache import url_expiry, playlist_id
+
+logger = logging.getLogger("SatoruGojo")
+
+T = TypeVar("T")
+
+# Seconds each stage may take before the command gives up on it.
+DEFAULT_TIMEOUTS = {
+    "status": 10.0,     # "Processing..." reply
+    "thumbnail": 15.0,
+    "resolve": 120.0,   # includes yt-dlp's download fallback
+    "playlist": 120.0,
+    "edit": 10.0,       # "Added to queue" edit
+}
+
+
+def telegram_media(message):
+    return message.audio or message.voice or message.video
+
+
+class StageStats:
+    def __init__(self, window: int = 200):
+        self.latencies: deque = deque(maxlen=window)
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def quantile(self, q: float) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)] if latencies else 0.0
+
+
+class IngestPipeline:
+    """Times every stage of turning a play command into a queued track.
+
+    Each stage runs under its own timeout and records its latency and
+    outcome, so a slow Telegram edit or thumbnail shows up by name instead
+    of inflating one opaque command time. ``enqueue`` is not a stage of
+    its own: it records command-to-enqueue time for the whole command.
+    """
+
+    def __init__(self, timeouts: Optional[Dict[str, float]] = None):
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.stages: Dict[str, StageStats] = {}
+
+    def _stats(self, name: str) -> StageStats:
+        stats = self.stages.get(name)
+        if not stats:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    async def stage(self, name: str, awaitable: Awaitable[T]) -> T:
+        stats = self._stats(name)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=self.timeouts.get(name))
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise TimeoutError(f"{name} timed out after {self.timeouts.get(name):g}s")
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            stats.latencies.append(time.perf_counter() - started)
+        stats.completed += 1
+        return result
+
+    def background(self, name: str, awaitable: Awaitable[T]) -> "asyncio.Task[T]":
+        task = asyncio.create_task(self.stage(name, awaitable))
+        # Independent stages may fail on their own; their callers decide whether it matters.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def observe(self, name: str, seconds: float):
+        stats = self._stats(name)
+        stats.latencies.append(seconds)
+        stats.completed += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "p50": stats.quantile(0.5),
+                "p95": stats.quantile(0.95),
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "timeouts": stats.timeouts,
+            }
+            for name, stats in self.stages.items()
+        }
+
+
+class SourceResolver(ABC):
+    """Turns one kind of play command into a Track.
+
+    ``check`` rejects malformed commands before anything is sent,
+    ``resolve`` produces the track, and ``thumbnail`` runs beside it for
+    sources whose thumbnail is not part of the resolved metadata.
+    """
+
+    kind = ""
+    log_label = "QUEUED"
+
+    def check(self, m) -> Optional[str]:
+        return None
+
+    def status_text(self, mode: str) -> str:
+        return "Processing and queuing..."
+
+    def playlist(self, m) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    async def resolve(self, m, mode: str) -> Track:
+        ...
+
+    async def thumbnail(self, m) -> Optional[str]:
+        return None
+
+
+def _requester(m) -> str:
+    return f"@{m.from_user.username} (ID: {m.from_user.id})"
+
+
+class TelegramResolver(SourceResolver):
+    kind = "telegram"
+
+    def __init__(self, download: Callable[..., Awaitable[str]], thumb_dir: str):
+        self.download = download
+        self.thumb_dir = thumb_dir
+
+    def check(self, m) -> Optional[str]:
+        if not m.reply_to_message or not telegram_media(m.reply_to_message):
+            return "Reply with an audio, voice, or video file."
+        return None
+
+    async def resolve(self, m, mode: str) -> Track:
+        # Nothing is downloaded here: the prefetcher streams or fetches the file when it nears the front.
+        media = telegram_media(m.reply_to_message)
+        return Track(
+            chat_id=m.chat.id,
+            title=getattr(media, "file_name", None) or "Telegram Media",
+            kind=self.kind,
+            mode=mode,
+            duration_s=getattr(media, "duration", None),
+            requester=_requester(m),
+            cache_key=f"tg-{media.file_unique_id}",
+            media_ref=(m.chat.id, m.reply_to_message.id),
+            media_msg=m.reply_to_message,
+        )
+
+    async def thumbnail(self, m) -> Optional[str]:
+        # Thumbnail file ids cannot be sent as photos, so the still is fetched to disk once per file.
+        thumbs = getattr(telegram_media(m.reply_to_message), "thumbs", None)
+        if not thumbs:
+            return None
+        path = os.path.abspath(os.path.join(self.thumb_dir, f"{thumbs[0].file_unique_id}.jpg"))
+        if os.path.exists(path):
+            return path
+        return await self.download(thumbs[0].file_id, file_name=path)
+
+
+class UrlResolver(SourceResolver):
+    kind = "url"
+    log_label = "QUEUED URL"
+
+    def check(self, m) -> Optional[str]:
+        if len(m.command) < 2:
+            return "Usage: /uplay <direct_media_url>"
+        return None
+
+    async def resolve(self, m, mode: str) -> Track:
+        return Track(
+            chat_id=m.chat.id,
+            title="Direct URL",
+            kind=self.kind,
+            mode=mode,
+            requester=_requester(m),
+            source=m.text.split(maxsplit=1)[1],
+        )
+
+
+class YouTubeResolver(SourceResolver):
+    kind = "youtube"
+    log_label = "QUEUED YOUTUBE"
+
+    def __init__(self, extract: Callable[..., Awaitable[dict]], download: Callable[..., Awaitable[Tuple[str, dict]]]):
+        self.extract = extract
+        self.download = download
+
+    def check(self, m) -> Optional[str]:
+        if len(m.command) < 2:
+            return f"Usage: /{m.command[0]} <song or YouTube URL>"
+        return None
+
+    def status_text(self, mode: str) -> str:
+        return "🔍 Getting stream info (fast)..." if mode == "video" else "🔍 Getting audio stream info (fast)..."
+
+    def playlist(self, m) -> Optional[str]:
+        query = m.text.split(maxsplit=1)[1]
+        return query if playlist_id(query) else None
+
+    async def resolve(self, m, mode: str) -> Track:
+        query = m.text.split(maxsplit=1)[1]
+        video = mode == "video"
+        info = await self.extract(query, video=video)
+        stream_url = info.get("url") or info.get("formats", [{}])[-1].get("url")
+        input_file = None
+        if not stream_url:
+            # A downloaded file never expires, and is deleted with the track like a Telegram download.
+            stream_url, info = await self.download(query, video=video)
+            input_file = stream_url
+        return Track(
+            chat_id=m.chat.id,
+            title=info.get("title") or "Unknown",
+            kind=self.kind,
+            mode=mode,
+            duration_s=info.get("duration"),
+            thumbnail=info.get("thumbnail"),
+            requester=_requester(m),
+            query=query,
+            source=stream_url,
+            expires_at=None if input_file else url_expiry(stream_url),
+            cache_key=f"yt-{info['id']}" if info.get("id") else None,
+            input_file=input_file,
+        )
@@ -0,0 +1,145 @@
+import time
+import queue
+import asyncio
+import logging
+import logging.handlers
+from collections import deque
+from typing import Optional, List, Dict, Callable, Awaitable, Any, Iterable
+
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger("SatoruGojo")
+
+# Telegram rejects text messages longer than this.
+MESSAGE_LIMIT = 4096
+
+
+def start_file_logging(target: logging.Logger, path: str, formatter: logging.Formatter,
+                       level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Log to ``path`` from a background thread; the loop only enqueues records."""
+    file_handler = logging.FileHandler(path, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(level)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    target.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _chunks(events: List[str], header: str) -> List[str]:
+    messages, current = [], header
+    for event in events:
+        event = event[:MESSAGE_LIMIT - len(header) - 2]
+        if len(current) + len(event) + 2 > MESSAGE_LIMIT:
+            messages.append(current)
+            current = header
+        current = f"{current}\n\n{event}"
+    if current != header:
+        messages.append(current)
+    return messages
+
+
+class LogSink:
+    """Coalesces log events into periodic Telegram digests for the owner/log chats.
+
+    ``emit`` never awaits, so command handlers return without a Telegram
+    round-trip. A background task drains the buffer every ``interval``
+    seconds, keeps at least ``min_gap`` seconds between messages to one chat,
+    and sleeps through FloodWait instead of dropping the digest. When the
+    buffer is full the oldest events are discarded and counted.
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable[Any]], targets: Iterable[Optional[int]],
+                 interval: float = 10.0, min_gap: float = 3.0, max_events: int = 500):
+        self.send = send
+        self.targets = list(dict.fromkeys(t for t in targets if t))
+        self.interval = interval
+        self.min_gap = min_gap
+        self._events: deque = deque(maxlen=max_events)
+        self._last_sent: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.emitted = 0
+        self.dropped = 0
+        self.messages = 0
+        self.flood_waits = 0
+        self.failures = 0
+
+    def emit(self, text: str):
+        if not self.targets:
+            return
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append((time.time(), text))
+        self.emitted += 1
+
+    def start(self):
+        if not self._task and self.targets:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Best effort: deliver what is left without holding up shutdown.
+        try:
+            await asyncio.wait_for(self.flush(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropped {len(self._events)} log events on shutdown")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Log digest failed: {e}")
+
+    async def flush(self):
+        if not self._events:
+            return
+        events = list(self._events)
+        self._events.clear()
+        if len(events) == 1:
+            messages = [events[0][1][:MESSAGE_LIMIT]]
+        else:
+            first = time.strftime("%H:%M:%S", time.localtime(events[0][0]))
+            last = time.strftime("%H:%M:%S", time.localtime(events[-1][0]))
+            dropped = f", {self.dropped} dropped" if self.dropped else ""
+            messages = _chunks([text for _, text in events], f"🧾 {len(events)} events ({first}–{last}){dropped}")
+            self.dropped = 0
+        for target in self.targets:
+            for text in messages:
+                await self._deliver(target, text)
+
+    async def _deliver(self, target: int, text: str, attempts: int = 3):
+        for _ in range(attempts):
+            wait = self._last_sent.get(target, 0.0) + self.min_gap - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await self.send(target, text)
+                self.messages += 1
+                return
+            except FloodWait as e:
+                self.flood_waits += 1
+                logger.warning(f"FloodWait sending log digest to {target}, sleeping {e.value}s")
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Failed to send log to {target}: {e}")
+                return
+            finally:
+                self._last_sent[target] = time.monotonic()
+        self.failures += 1
+        logger.error(f"Gave up sending log digest to {target} after {attempts} FloodWaits")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self._events),
+            "emitted": self.emitted,
+            "messages": self.messages,
+            "flood_waits": self.flood_waits,
+            "failures": self.failures,
+        }
@@ -1,49 +1,137 @@
 import os
+import sys
+import math
 import time
-import threading
-import subprocess
 import logging
 import asyncio
-from collections import defaultdict, deque
-from dataclasses import dataclass, field
-from typing import Optional, List, Dict
+from collections import defaultdict
+from typing import Optional, List, Dict, Tuple, Set
 
-import yt_dlp
-from pyrogram import Client, filters
+import aiohttp
+from pyrogram import Client, filters, idle, StopPropagation
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 import config
+from supervisor import FFmpegSupervisor, StreamJob, install_child_watcher
+from ytcache import MetadataCache, url_expiry
+from prefetch import Prefetcher, warm_url
+from ffmpeg_cmd import (
+    build_ffmpeg_video, build_ffmpeg_audio, build_ffmpeg_copy, build_ffmpeg_audio_copy,
+    build_feeder_video, build_feeder_audio, build_fanout_encoder, build_fanout_relay, build_ffmpeg_still,
+    PROFILES, LADDER, DEFAULT_PROFILE, GOP_SECONDS, profile_step, parse_timestamp,
+)
+from adaptive import AdaptiveLadder
+from fanout import FanoutHub, SharedEncode
+from publisher import PublisherPool
+from streamfeed import pump, mp4_streamable
+from netinput import NetworkInput, guess_container, is_network
+from stills import StillCache
+from probe import ProbeCache, PATH_COPY, PATH_COPY_VIDEO, PATH_COPY_AUDIO, PATH_ENCODE, PATH_CACHED
+from transcode_cache import RenditionCache
+from resolver import ResolverPool
+from store import StateStore
+from track import Track, TrackQueue
+from ingest import IngestPipeline, SourceResolver, TelegramResolver, UrlResolver, YouTubeResolver
+from shard import Coordinator, WorkerLink, SHARD_ENV
+from logsink import LogSink, start_file_logging
+from telemetry import MetricsServer, MetricFamily, SLOW_SPEED
+from scheduler import (
+    EncodeScheduler, Ticket, KIND_ENCODE_HIGH, KIND_ENCODE, KIND_ENCODE_LOW, KIND_AUDIO, KIND_COPY, KIND_GAPLESS,
+)
 
 OWNER_ID = getattr(config, "OWNER_ID", None)
 LOGGER_ID = getattr(config, "LOGGER_ID", None)
+YT_CACHE_SIZE = getattr(config, "YT_CACHE_SIZE", 512)
+YT_CACHE_TTL = getattr(config, "YT_CACHE_TTL", 3 * 3600)
+YT_CACHE_DB = getattr(config, "YT_CACHE_DB", None)
+PREFETCH_AHEAD = getattr(config, "PREFETCH_AHEAD", 2)
+URL_REFRESH_MARGIN = getattr(config, "URL_REFRESH_MARGIN", 20 * 60)
+WARMUP_INTERVAL = getattr(config, "WARMUP_INTERVAL", 120)
+GAPLESS_PUBLISHER = getattr(config, "GAPLESS_PUBLISHER", False)
+STREAM_COPY = getattr(config, "STREAM_COPY", True)
+TG_STREAM_INGEST = getattr(config, "TG_STREAM_INGEST", True)
+STREAM_READ_AHEAD = getattr(config, "STREAM_READ_AHEAD", 8)
+STREAM_FALLBACK_WINDOW = getattr(config, "STREAM_FALLBACK_WINDOW", 15)
+NET_READ_AHEAD = getattr(config, "NET_READ_AHEAD", 32)  # 256 KiB chunks; 0 hands URLs straight to FFmpeg
+NET_RETRIES = getattr(config, "NET_RETRIES", 5)
+NET_READ_TIMEOUT = getattr(config, "NET_READ_TIMEOUT", 15)
+AUDIO_STILLS = getattr(config, "AUDIO_STILLS", True)  # show the thumbnail as video on audio tracks
+STILL_DIR = getattr(config, "STILL_DIR", "cache/stills")
+STILL_WAIT = getattr(config, "STILL_WAIT", 3)
+RENDITION_CACHE = getattr(config, "RENDITION_CACHE", True)
+RENDITION_CACHE_DIR = getattr(config, "RENDITION_CACHE_DIR", "cache/renditions")
+RENDITION_CACHE_BYTES = getattr(config, "RENDITION_CACHE_BYTES", 2 * 1024 ** 3)
+CPU_BUDGET = getattr(config, "CPU_BUDGET", float(os.cpu_count() or 1))
+ADMISSION_MAX_WAIT = getattr(config, "ADMISSION_MAX_WAIT", 60)
+RESOLVER_WORKERS = getattr(config, "RESOLVER_WORKERS", 2)
+RESOLVER_MAX_JOBS = getattr(config, "RESOLVER_MAX_JOBS", 100)
+RESOLVE_TIMEOUT = getattr(config, "RESOLVE_TIMEOUT", 45)
+DOWNLOAD_TIMEOUT = getattr(config, "DOWNLOAD_TIMEOUT", 300)  # yt-dlp download fallback
+STATE_DB = getattr(config, "STATE_DB", "state.db")
+RESTORE_CONCURRENCY = getattr(config, "RESTORE_CONCURRENCY", 8)
+RESTORE_TIMEOUT = getattr(config, "RESTORE_TIMEOUT", 30)
+METRICS_HOST = getattr(config, "METRICS_HOST", "127.0.0.1")
+METRICS_PORT = getattr(config, "METRICS_PORT", 9464)
+PLAYLIST_PAGE = getattr(config, "PLAYLIST_PAGE", 100)
+PLAYLIST_LIMIT = getattr(config, "PLAYLIST_LIMIT", 500)
+FANOUT = getattr(config, "FANOUT", True)
+FANOUT_JOIN_WINDOW = getattr(config, "FANOUT_JOIN_WINDOW", 15)
+ENCODE_PROFILE = getattr(config, "ENCODE_PROFILE", DEFAULT_PROFILE)  # a LADDER name or "auto"
+AUTO_PROFILE_CEILING = getattr(config, "AUTO_PROFILE_CEILING", DEFAULT_PROFILE)
+AUTO_PROFILE_FLOOR = getattr(config, "AUTO_PROFILE_FLOOR", "audio")
+LOG_DIGEST_INTERVAL = getattr(config, "LOG_DIGEST_INTERVAL", 10)
+LOG_BUFFER_SIZE = getattr(config, "LOG_BUFFER_SIZE", 500)
+RESUME_RETRIES = getattr(config, "RESUME_RETRIES", 5)
+RESUME_BACKOFF = getattr(config, "RESUME_BACKOFF", 1.0)
+RESUME_BACKOFF_MAX = getattr(config, "RESUME_BACKOFF_MAX", 30.0)
+RESUME_STABLE_AFTER = getattr(config, "RESUME_STABLE_AFTER", 60)
+RESUME_END_SLACK = getattr(config, "RESUME_END_SLACK", 10)
+QUEUE_DEDUPE = getattr(config, "QUEUE_DEDUPE", False)  # refuse a track already waiting in the queue
+QUEUE_PAGE_SIZE = getattr(config, "QUEUE_PAGE_SIZE", 10)
+SHARDS = getattr(config, "SHARDS", 1)  # >1 runs a coordinator plus this many worker processes
+SHARD_HEARTBEAT_TIMEOUT = getattr(config, "SHARD_HEARTBEAT_TIMEOUT", 30)
+SHARD_RESTART_DELAY = getattr(config, "SHARD_RESTART_DELAY", 5)
+INGEST_TIMEOUTS = getattr(config, "INGEST_TIMEOUTS", {})  # per-stage overrides, e.g. {"resolve": 60}
+THUMB_DIR = getattr(config, "THUMB_DIR", "cache/thumbs")
+SHARD_INDEX = int(os.environ[SHARD_ENV]) if os.environ.get(SHARD_ENV) else None
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+if SHARD_INDEX is not None:
+    LOG_FORMAT = f"%(asctime)s - shard{SHARD_INDEX} - %(levelname)s - %(message)s"
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
+    format=LOG_FORMAT
 )
 logger = logging.getLogger("SatoruGojo")
-file_handler = logging.FileHandler("actions.log", encoding="utf-8")
-file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-file_handler.setLevel(logging.INFO)
-logger.addHandler(file_handler)
+# File writes happen on the listener thread so handlers never block on disk I/O.
+file_log_listener = start_file_logging(logger, "actions.log", logging.Formatter(LOG_FORMAT))
 
+# Shard workers only send: the coordinator receives every update and routes it by chat.
 bot = Client(
-    "SatoruGojo",
+    "SatoruGojo" if SHARD_INDEX is None else f"SatoruGojo-shard{SHARD_INDEX}",
     api_id=config.API_ID,
     api_hash=config.API_HASH,
-    bot_token=config.BOT_TOKEN
+    bot_token=config.BOT_TOKEN,
+    no_updates=SHARD_INDEX is not None
 )
 
 rtmp_keys: Dict[int, str] = {}
-ffmpeg_processes: Dict[int, Optional[subprocess.Popen]] = {}
-queues = defaultdict(deque)
-
-@dataclass
-class Track:
-    title: str
-    source: str
-    duration: Optional[int] = None
-    thumbnail: Optional[str] = None
-    requester: Optional[str] = None
+supervisor = FFmpegSupervisor()
+publishers = PublisherPool()
+gapless_chats: Dict[int, bool] = {}
+chat_profiles: Dict[int, str] = {}
+stop_generation: Dict[int, int] = defaultdict(int)
+resume_stats: Dict[str, int] = {"resumed": 0, "gave_up": 0}
+queues: Dict[int, TrackQueue] = defaultdict(TrackQueue)
+yt_cache = MetadataCache(max_entries=YT_CACHE_SIZE, ttl=YT_CACHE_TTL, db_path=YT_CACHE_DB)
+http_session: Optional[aiohttp.ClientSession] = None
+net_input = NetworkInput(NET_READ_AHEAD, retries=NET_RETRIES, read_timeout=NET_READ_TIMEOUT) if NET_READ_AHEAD else None
+probes = ProbeCache()
+renditions = RenditionCache(RENDITION_CACHE_DIR, RENDITION_CACHE_BYTES) if RENDITION_CACHE else None
+stills = StillCache(STILL_DIR) if AUDIO_STILLS else None
+# The resolve stage may run an extraction and then the download fallback.
+ingest_pipeline = IngestPipeline(dict({"resolve": RESOLVE_TIMEOUT + DOWNLOAD_TIMEOUT}, **INGEST_TIMEOUTS))
 
 YTDL_OPTS = {
     "format": "bestaudio/best",
@@ -53,8 +141,6 @@ YTDL_OPTS = {
     "cookiefile": "cookies.txt",
 }
 
-ytdl = yt_dlp.YoutubeDL(YTDL_OPTS)
-
 ydl_opts = {
     "format": "bestaudio/best",
     "outtmpl": "%(title)s.%(ext)s",
@@ -64,6 +150,11 @@ ydl_opts = {
     "cookiefile": "cookies.txt"
 }
 
+resolver_pool = ResolverPool(
+    YTDL_OPTS, size=RESOLVER_WORKERS, max_jobs=RESOLVER_MAX_JOBS,
+    timeout=RESOLVE_TIMEOUT, download_timeout=DOWNLOAD_TIMEOUT,
+)
+
 def format_duration(seconds):
     try:
         seconds = int(seconds or 0)
@@ -77,108 +168,785 @@ def get_rtmp_url(chat_id):
     key = rtmp_keys.get(chat_id)
     return f"{config.DEFAULT_RTMP_URL.rstrip('/')}/{key}" if key else None
 
-def stop_ffmpeg(chat_id):
-    process = ffmpeg_processes.get(chat_id)
-    if process:
+def gapless_enabled(chat_id):
+    return gapless_chats.get(chat_id, GAPLESS_PUBLISHER)
+
+PROFILE_KINDS = {"1080p": KIND_ENCODE_HIGH, "720p": KIND_ENCODE, "480p": KIND_ENCODE_LOW, "audio": KIND_AUDIO}
+KIND_PROFILES = {kind: profile for profile, kind in PROFILE_KINDS.items()}
+
+def chat_profile(chat_id: int) -> Tuple[str, bool]:
+    # Returns the profile new tracks start on and whether the chat is in auto mode.
+    setting = chat_profiles.get(chat_id, ENCODE_PROFILE)
+    if setting == "auto":
+        return AUTO_PROFILE_CEILING, True
+    return setting, False
+
+def item_profile(item: Track) -> str:
+    return item.profile or chat_profile(item.chat_id)[0]
+
+def audio_only(item: Track) -> bool:
+    return item.mode == "audio" or item_profile(item) == "audio"
+
+def rendition_profile(item: Track) -> str:
+    return "audio" if audio_only(item) else item_profile(item)
+
+def path_limits(item: Track) -> dict:
+    # A source above the chosen profile is encoded down to it rather than copied.
+    profile = PROFILES.get(item_profile(item))
+    if not profile:
+        return {}
+    return {"max_size": profile["size"], "max_bitrate": profile["video_bitrate"] * 1000}
+
+def track_duration(item: Track) -> str:
+    return format_duration(item.duration_s) if item.duration_s else "Unknown"
+
+def track_caption(item: Track) -> str:
+    if item.kind == "url":
+        head = "🎬 Queued from URL"
+    else:
+        label = "🎬 Queued" if item.mode == "video" else "🎵 Queued (Audio)"
+        head = f"{label}: {item.title}\n⏱️ Duration: {track_duration(item)}"
+    return f"{head}\n👤 Requested by: {item.requester}"
+
+async def stop_ffmpeg(chat_id):
+    await supervisor.stop(chat_id)
+
+def cleanup_input(input_file):
+    if input_file and os.path.exists(input_file):
         try:
-            process.terminate()
-            process.wait(timeout=10)
-        except Exception:
-            process.kill()
-    ffmpeg_processes[chat_id] = None
+            os.remove(input_file)
+            logger.info(f"Deleted file {input_file}")
+        except Exception as e:
+            logger.warning(f"Failed to delete {input_file}: {e}")
 
-def run_ffmpeg_blocking(chat_id, command, input_file=None, on_finish=None):
-    try:
-        logger.info(f"Starting RTMP FFmpeg for chat {chat_id} (cmd len={len(command)})...")
-        ffmpeg_processes[chat_id] = subprocess.Popen(command)
-        ffmpeg_processes[chat_id].wait()
-    except Exception as e:
-        logger.error(f"FFmpeg error: {e}")
-    finally:
-        ffmpeg_processes[chat_id] = None
-        if input_file and os.path.exists(input_file):
-            try:
-                os.remove(input_file)
-                logger.info(f"Deleted file {input_file}")
-            except Exception as e:
-                logger.warning(f"Failed to delete {input_file}: {e}")
-        if on_finish:
-            try:
-                asyncio.run(on_finish(chat_id))
-            except Exception:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    loop.create_task(on_finish(chat_id))
-
-def enqueue_rt(item: dict):
-    chat_id = item["chat_id"]
+def discard_input(item: Track):
+    task = item.download_task
+    if task and not task.done():
+        task.cancel()
+    cleanup_input(item.input_file)
+
+def release_thumbnail(item: Track):
+    # Telegram thumbnails are fetched once per file, so queued duplicates of that file share one.
+    path = item.thumbnail
+    if not path or os.path.dirname(path) != os.path.abspath(THUMB_DIR):
+        return
+    others = [job.item for job in supervisor.jobs.values() if job.item]
+    others += [queued for q in queues.values() for queued in q]
+    if any(other is not item and other.thumbnail == path for other in others):
+        return
+    cleanup_input(path)
+
+def discard_item(item: Track):
+    discard_input(item)
+    release_thumbnail(item)
+
+def settle_rendition(pending, complete: bool):
+    tmp_path, final_path = pending
+    if complete:
+        asyncio.get_event_loop().run_in_executor(None, renditions.commit, tmp_path, final_path)
+    else:
+        renditions.abort(tmp_path)
+
+def finish_rendition(job: StreamJob):
+    pending = job.item.rendition_tmp if job.item else None
+    if not pending:
+        return
+    job.item.rendition_tmp = None
+    expected = job.item.duration_s or 0
+    settle_rendition(pending, not job.stopped and job.returncode == 0 and job.runtime >= expected * 0.9)
+
+async def finish_shared_encode(encode: SharedEncode):
+    # Relays may outlive the chat that started the encode, so its cost is held until the encode itself exits.
+    scheduler.release_shared(encode)
+    if encode.rendition:
+        complete = not encode.stopped and encode.returncode == 0 and encode.runtime >= encode.expected_duration * 0.9
+        settle_rendition(encode.rendition, complete)
+
+fanout = FanoutHub(join_window=FANOUT_JOIN_WINDOW, on_exit=finish_shared_encode) if FANOUT else None
+
+def playback_position(job: StreamJob) -> float:
+    # Track position this job reached, counting the seek it started from.
+    item = job.item
+    progress = item.fanout[0].progress if item.fanout else job.progress
+    if progress.samples and item.path != "gapless":
+        # Media time actually written beats wall time, which also counts FFmpeg's startup.
+        played = progress.out_time
+    else:
+        # Feeders shift their timestamps onto the publisher's clock, so wall time is the better guess there.
+        played = job.runtime
+    return (item.seek or 0) + played
+
+def ended_early(job: StreamJob, position: float) -> bool:
+    # A crash, a dropped RTMP session or a relay cut loose, as opposed to the track running out.
+    duration = job.item.duration_s
+    if duration and position >= duration - RESUME_END_SLACK:
+        return False
+    return job.returncode != 0 or bool(duration)
+
+def schedule_resume(job: StreamJob, position: float) -> bool:
+    chat_id, item = job.chat_id, job.item
+    attempts = 0 if job.runtime >= RESUME_STABLE_AFTER else item.resume_attempts
+    if attempts >= RESUME_RETRIES:
+        resume_stats["gave_up"] += 1
+        logger.error(f"Giving up on {item.title!r} in chat {chat_id} after {attempts} restarts")
+        send_log(
+            f"🔴 [STREAM FAILED]\n"
+            f"🎶 Song: {item.title}\n"
+            f"💬 Chat: {chat_id}\n"
+            f"🔁 Restarts: {attempts}, last exit code {job.returncode} at {format_duration(position)}\n"
+            f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        )
+        return False
+    item.resume_attempts = attempts + 1
+    if item.duration_s:
+        # Live sources have no position to return to; they simply reconnect.
+        item.seek = position
+    if item.stream_ingest:
+        # A pipe cannot be seeked, so resume from a download of the file instead.
+        item.stream_ingest = False
+        item.head_chunk = None
+    item.resuming = True
+    delay = min(RESUME_BACKOFF * 2 ** attempts, RESUME_BACKOFF_MAX)
+    logger.warning(
+        f"{item.title!r} in chat {chat_id} ended early (exit code {job.returncode} at {position:.1f}s), "
+        f"resuming in {delay:.0f}s (attempt {attempts + 1}/{RESUME_RETRIES})"
+    )
+    queues[chat_id].appendleft(item)
+    asyncio.create_task(resume_later(chat_id, item, delay))
+    return True
+
+async def resume_later(chat_id: int, item: Track, delay: float):
+    await asyncio.sleep(delay)
+    # /skip, /stop or a newly queued track may already have dealt with it.
+    if queues[chat_id].peek() is item:
+        await start_next_in_queue(chat_id, if_idle=True)
+
+async def on_stream_end(job: StreamJob):
+    item = job.item
+    finish_rendition(job)
+    position = playback_position(job) if item else 0.0
+    if item and item.fanout:
+        encode, subscriber = item.fanout
+        item.fanout = None
+        fanout.leave(encode, job.chat_id, subscriber)
+    if item and item.restarting:
+        # restart_current owns the input file and the admission ticket from here.
+        return
+    if item:
+        scheduler.release(item.ticket)
+        item.ticket = None
+    if (not job.stopped and item and item.stream_ingest and job.returncode
+            and job.runtime < STREAM_FALLBACK_WINDOW):
+        # FFmpeg could not demux the piped stream (e.g. a non-faststart MP4): download it instead.
+        logger.warning(f"Streamed ingest failed for {item.title!r} in chat {job.chat_id}, retrying with download")
+        item.stream_ingest = False
+        item.head_chunk = None
+        queues[job.chat_id].appendleft(item)
+    elif not job.stopped and item and ended_early(job, position) and schedule_resume(job, position):
+        # Keep the input file and the publisher; resume_later picks the track up again.
+        persist(job.chat_id)
+        return
+    else:
+        cleanup_input(job.input_file)
+        if item:
+            release_thumbnail(item)
+    persist(job.chat_id)
+    if not job.stopped:
+        await start_next_in_queue(job.chat_id)
+
+def enqueue_rt(item: Track) -> bool:
+    chat_id = item.chat_id
+    if QUEUE_DEDUPE and queues[chat_id].has(item.dedupe_key):
+        return False
+    item.generation = stop_generation[chat_id]
     queues[chat_id].append(item)
+    prefetcher.poke()
+    persist(chat_id)
+    return True
+
+def persist(chat_id: int):
+    if store:
+        store.mark(chat_id)
+
+def chat_settings(chat_id: int) -> dict:
+    # Only explicit choices are saved, so a changed config default still reaches every other chat.
+    settings = {}
+    if chat_id in chat_profiles:
+        settings["profile"] = chat_profiles[chat_id]
+    if chat_id in gapless_chats:
+        settings["gapless"] = gapless_chats[chat_id]
+    return settings
+
+def chat_snapshot(chat_id: int):
+    records = [item.to_record() for item in queues.get(chat_id, ())]
+    job = supervisor.jobs.get(chat_id)
+    if job and job.item and not job.stopped:
+        position = playback_position(job)
+        return rtmp_keys.get(chat_id), records, job.item.to_record(), position, chat_settings(chat_id)
+    return rtmp_keys.get(chat_id), records, None, 0.0, chat_settings(chat_id)
+
+def chat_position(chat_id: int) -> Optional[float]:
+    job = supervisor.jobs.get(chat_id)
+    if job and job.item and not job.stopped:
+        return playback_position(job)
+    return None
+
+def item_from_record(record: dict) -> Track:
+    item = Track.from_record(record)
+    if item.input_file and not os.path.exists(item.input_file):
+        # A YouTube download that is gone is resolved again, like a playlist placeholder.
+        item.input_file = None
+        item.source = None
+    if item.kind == "telegram" and not item.input_file:
+        # Streams restart from scratch; a finished download can be reused if it is still on disk.
+        item.source = None
+    return item
+
+store = StateStore(STATE_DB, chat_snapshot, lambda: supervisor.active_chats(), chat_position) if STATE_DB else None
+
+async def restore_state(chat_ids: Optional[Set[int]] = None):
+    # A shard worker restores only the chats the coordinator hands it.
+    if not store:
+        return
+    loop = asyncio.get_event_loop()
+    started = time.perf_counter()
+    keys, saved_queues, playing, settings = await loop.run_in_executor(None, store.load)
+    if chat_ids is not None:
+        keys = {chat_id: key for chat_id, key in keys.items() if chat_id in chat_ids}
+        saved_queues = {chat_id: records for chat_id, records in saved_queues.items() if chat_id in chat_ids}
+        playing = {chat_id: entry for chat_id, entry in playing.items() if chat_id in chat_ids}
+        settings = {chat_id: values for chat_id, values in settings.items() if chat_id in chat_ids}
+    rtmp_keys.update(keys)
+    for chat_id, values in settings.items():
+        if values.get("profile") in (*LADDER, "auto"):
+            chat_profiles[chat_id] = values["profile"]
+        if "gapless" in values:
+            gapless_chats[chat_id] = bool(values["gapless"])
+    for chat_id, records in saved_queues.items():
+        queues[chat_id].extend(item_from_record(record) for record in records)
+    for chat_id, (record, position) in playing.items():
+        item = item_from_record(record)
+        item.seek = position
+        queues[chat_id].appendleft(item)
+    restored = set(saved_queues) | set(playing)
+    chats = [chat_id for chat_id in restored if queues[chat_id] and get_rtmp_url(chat_id)]
+    logger.info(
+        f"Restored {len(keys)} RTMP keys and {sum(len(queues[chat_id]) for chat_id in restored)} queued tracks "
+        f"({len(playing)} were playing) in {(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    if not chats:
+        return
+    limit = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+    async def resume(chat_id):
+        async with limit:
+            await start_next_in_queue(chat_id, if_idle=True)
+
+    resume_task = asyncio.gather(*(resume(chat_id) for chat_id in chats), return_exceptions=True)
+    done, _ = await asyncio.wait({resume_task}, timeout=RESTORE_TIMEOUT)
+    if done:
+        logger.info(f"Resumed {len(chats)} chats in {time.perf_counter() - started:.1f}s")
+    else:
+        logger.warning(f"Resume still running after {RESTORE_TIMEOUT}s, continuing in background")
+
+async def prepare_item(item: Track, warm: bool = True):
+    kind = item.kind
+    if stills and audio_only(item) and not stills.lookup(item.thumbnail):
+        # Rendered while the track waits in the queue; start_item only has to pick it up.
+        stills.ensure(http_session, item.thumbnail)
+    if renditions and not item.rendition:
+        cached = renditions.lookup(item.cache_key, rendition_profile(item))
+        if cached:
+            # Already encoded once: no download, no resolve, no probe.
+            discard_input(item)
+            item.rendition = item.source = cached
+            item.input_file = None
+            item.stream_ingest = False
+            item.head_chunk = None
+            item.net_ingest = None
+            item.container = guess_container(cached)
+            item.path, item.path_reason = PATH_CACHED, "rendition cache hit"
+    if item.rendition:
+        return
+    if kind == "telegram" and not item.media_msg:
+        # After the rendition lookup: a cache hit needs no Telegram round trip at all.
+        item.media_msg = await bot.get_messages(*item.media_ref)
+    if kind == "telegram" and (TG_STREAM_INGEST if item.stream_ingest is None else item.stream_ingest) and not item.input_file:
+        if item.head_chunk is None:
+            head = b""
+            async for chunk in bot.stream_media(item.media_msg, limit=1):
+                head = chunk
+            if not head:
+                raise RuntimeError("Telegram stream returned no data")
+            item.head_chunk = head
+            if mp4_streamable(head) is False:
+                logger.info(f"{item.title!r} is not faststart, downloading instead of streaming")
+                item.stream_ingest = False
+        if (TG_STREAM_INGEST if item.stream_ingest is None else item.stream_ingest):
+            item.stream_ingest = True
+            item.source = "pipe:0"
+            item.container = "mp4" if mp4_streamable(item.head_chunk) is not None else None
+            if STREAM_COPY:
+                # The file only ever reaches FFmpeg as a pipe, so its first chunk decides copy or encode.
+                item.path, item.path_reason = await probes.choose_head_path(
+                    item.cache_key or f"track-{item.id}", item.head_chunk,
+                    audio_only=audio_only(item), **path_limits(item)
+                )
+            return
+        item.head_chunk = None
+    if kind == "telegram":
+        if not item.input_file:
+            task = item.download_task
+            if not task:
+                task = item.download_task = asyncio.create_task(item.media_msg.download())
+            media = await task
+            if not media:
+                raise RuntimeError("Telegram download failed")
+            item.input_file = item.source = media
+    if kind == "youtube" and not item.source:
+        # Playlist placeholder: resolve only when it is about to play, so URLs are fresh.
+        info = await resolve_youtube(item.query, video=item.mode == "video")
+        if not info.get("url"):
+            raise RuntimeError("No playable stream")
+        item.source = info["url"]
+        item.expires_at = url_expiry(info["url"])
+        item.net_ingest = None
+        item.thumbnail = item.thumbnail or info.get("thumbnail")
+        item.duration_s = item.duration_s or info.get("duration")
+    if kind == "youtube" and not item.input_file:
+        expires_at = item.expires_at
+        if expires_at and expires_at - time.time() < URL_REFRESH_MARGIN:
+            video = item.mode == "video"
+            yt_cache.invalidate(item.query, video)
+            info = await resolve_youtube(item.query, video=video)
+            if info.get("url"):
+                item.source = info["url"]
+                item.expires_at = url_expiry(info["url"])
+                item.net_ingest = None
+                item.warmed_at = 0.0
+                logger.info(f"Re-resolved expiring stream URL for {item.title!r}")
+    item.container = guess_container(item.source)
+    pipe_check = None
+    if net_input and http_session and item.net_ingest is None and is_network(item.source):
+        # Runs beside the probe, so deciding whether to pipe adds nothing to startup.
+        pipe_check = asyncio.create_task(net_input.pipeable(http_session, item.source, item.container))
+    if STREAM_COPY and item.source:
+        item.path, item.path_reason = await probes.choose_path(
+            item.source, audio_only=audio_only(item), **path_limits(item)
+        )
+    if pipe_check:
+        item.net_ingest = await pipe_check
+    if kind == "telegram":
+        return
+    if warm and http_session and time.time() - item.warmed_at > WARMUP_INTERVAL:
+        elapsed = await warm_url(http_session, item.source)
+        if elapsed is not None:
+            item.warmed_at = time.time()
+            logger.info(f"Warmed {item.title!r} in {elapsed * 1000:.0f}ms")
+
+prefetcher = Prefetcher(queues, prepare_item, lookahead=PREFETCH_AHEAD)
+
+def telegram_feed(item: Track):
+    async def chunks():
+        offset = 0
+        head = item.head_chunk
+        if head:
+            yield head
+            offset = 1
+        async for chunk in bot.stream_media(item.media_msg, offset=offset):
+            yield chunk
+
+    async def feed(writer):
+        written = await pump(chunks(), writer, read_ahead=STREAM_READ_AHEAD)
+        logger.info(f"Streamed {written / 1048576:.1f} MiB of {item.title!r} into FFmpeg")
+    return feed
+
+def net_piped(item: Track) -> bool:
+    # Seeking a pipe means reading up to the position at -re speed, so resumes and /seek connect directly.
+    return bool(net_input and http_session and item.net_ingest and not item.seek and is_network(item.source))
+
+def item_input(item: Track) -> str:
+    return "pipe:0" if net_piped(item) else item.source
+
+def item_feed(item: Track):
+    if item.stream_ingest:
+        return telegram_feed(item)
+    if net_piped(item):
+        return net_input.feed(http_session, item.source, item.title)
+    return None
+
+def build_item_command(item: Track, ts_offset: Optional[float] = None, cache_file: Optional[str] = None,
+                       still: Optional[str] = None):
+    source, container = item_input(item), item.container
+    if ts_offset is not None:
+        if audio_only(item):
+            return build_feeder_audio(source, ts_offset, seek=item.seek, container=container)
+        return build_feeder_video(source, ts_offset, seek=item.seek, container=container)
+    url = get_rtmp_url(item.chat_id)
+    if not url:
+        raise RuntimeError("No RTMP key set")
+    path = item.path or PATH_ENCODE
+    seek = item.seek
+    if still and audio_only(item):
+        return build_ffmpeg_still(
+            source, still, url, cache_file=cache_file, seek=seek, container=container,
+            copy_audio=path in (PATH_CACHED, PATH_COPY_AUDIO),
+        )
+    if path == PATH_CACHED:
+        if audio_only(item):
+            return build_ffmpeg_audio_copy(source, url, seek=seek)
+        return build_ffmpeg_copy(source, url, seek=seek)
+    if path == PATH_COPY_AUDIO:
+        return build_ffmpeg_audio_copy(source, url, seek=seek, cache_file=cache_file)
+    if path in (PATH_COPY, PATH_COPY_VIDEO):
+        return build_ffmpeg_copy(
+            source, url, transcode_audio=path == PATH_COPY_VIDEO, seek=seek, cache_file=cache_file
+        )
+    if audio_only(item):
+        return build_ffmpeg_audio(source, url, cache_file=cache_file, seek=seek, container=container)
+    return build_ffmpeg_video(source, url, cache_file=cache_file, seek=seek, container=container,
+                              **PROFILES[item_profile(item)])
 
-async def send_log(text):
-    for log_id in set(filter(None, [OWNER_ID, LOGGER_ID])):
+def item_kind(item: Track, gapless: bool) -> str:
+    if gapless:
+        return KIND_GAPLESS
+    path = item.path or PATH_ENCODE
+    if path != PATH_ENCODE:
+        return KIND_COPY
+    return PROFILE_KINDS[rendition_profile(item)]
+
+async def admit_item(chat_id: int, item: Track, gapless: bool, restart: bool = False,
+                     kind: Optional[str] = None) -> Ticket:
+    kind = kind or item_kind(item, gapless)
+    ticket = await scheduler.admit(chat_id, kind, force=restart)
+    if item.generation != stop_generation[chat_id]:
+        scheduler.release(ticket)
+        raise RuntimeError("Stopped while waiting for encoder capacity")
+    if ticket.kind != kind and ticket.kind in KIND_PROFILES:
+        item.profile = KIND_PROFILES[ticket.kind]
+        item.degraded = True
+    item.ticket = ticket
+    return ticket
+
+def request_downgrade(ticket: Ticket) -> bool:
+    job = supervisor.jobs.get(ticket.chat_id)
+    item = job.item if job else None
+    if (not item or item.ticket is not ticket or item.stream_ingest or item.restarting
+            or item.fanout):
+        return False
+    asyncio.create_task(restart_current(ticket.chat_id, profile=profile_step(item_profile(item), 1), degraded=True))
+    return True
+
+async def restart_current(chat_id: int, **changes):
+    # Restart the playing track at its current position with different settings.
+    async with supervisor.lock(chat_id):
+        job = supervisor.jobs.get(chat_id)
+        if not job or not job.item:
+            return False
+        item = job.item
+        item.seek = playback_position(job)
+        for name, value in changes.items():
+            setattr(item, name, value)
+        item.restarting = True
+        await supervisor.stop(chat_id)
+        item.restarting = False
         try:
-            await bot.send_message(log_id, text)
+            await start_item(chat_id, item, restart=True)
         except Exception as e:
-            logger.error(f"Failed to send log to {log_id}: {e}")
+            logger.error(f"Failed to restart {item.title!r} in chat {chat_id}: {e}")
+            scheduler.release(item.ticket)
+            item.ticket = None
+            discard_item(item)
+            return False
+    logger.info(f"Restarted {item.title!r} in chat {chat_id} at {item.seek:.1f}s with {changes}")
+    return True
 
-def build_ffmpeg_video(input_file, url):
-    # Ultra-low-latency flags added!
-    return [
-        "ffmpeg",
-        "-fflags", "nobuffer",
-        "-flags", "low_delay",
-        "-probesize", "32",
-        "-analyzeduration", "0",
-        "-re",
-        "-i", input_file,
-        "-c:v", "libx264", "-preset", "superfast", "-tune", "zerolatency",
-        "-pix_fmt", "yuv420p", "-b:v", "1500k", "-maxrate", "1500k", "-bufsize", "3000k",
-        "-g", "50", "-keyint_min", "50",
-        "-vf", "scale=1280:720,fps=30",
-        "-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100",
-        "-f", "flv", url
-    ]
+# Each shard worker gets its share of the host; the workers do not see each other's load.
+scheduler = EncodeScheduler(CPU_BUDGET / SHARDS if SHARD_INDEX is not None else CPU_BUDGET, max_wait=ADMISSION_MAX_WAIT, downgrade=request_downgrade)
+
+def profile_switchable(chat_id: int) -> bool:
+    job = supervisor.jobs.get(chat_id)
+    item = job.item if job else None
+    return bool(
+        item and not item.restarting and not item.stream_ingest and not item.fanout
+        and item.mode != "audio" and (item.path or PATH_ENCODE) == PATH_ENCODE
+        and not gapless_enabled(chat_id)
+    )
+
+async def switch_profile(chat_id: int, profile: str) -> bool:
+    job = supervisor.jobs.get(chat_id)
+    if not job or not job.item:
+        return False
+    if not job.progress.samples:
+        return await restart_current(chat_id, profile=profile)
+    # Let the old encoder finish its current GOP so the new one starts on the next keyframe.
+    position = job.progress.out_time
+    boundary = math.ceil(position / GOP_SECONDS) * GOP_SECONDS
+    await asyncio.sleep(boundary - position)
+    if supervisor.jobs.get(chat_id) is not job:
+        return False
+    return await restart_current(chat_id, seek=(job.item.seek or 0) + boundary, profile=profile)
+
+def adaptive_candidates():
+    for chat_id in supervisor.active_chats():
+        if chat_profiles.get(chat_id, ENCODE_PROFILE) != "auto" or not profile_switchable(chat_id):
+            continue
+        job = supervisor.jobs[chat_id]
+        yield chat_id, item_profile(job.item), job.runtime, job.progress
+
+def adaptive_has_room(chat_id: int, profile: str) -> bool:
+    job = supervisor.jobs.get(chat_id)
+    ticket = job.item.ticket if job and job.item else None
+    return bool(ticket) and scheduler.fits_instead(ticket, PROFILE_KINDS[profile])
+
+ladder = AdaptiveLadder(
+    adaptive_candidates, switch_profile, adaptive_has_room,
+    ceiling=AUTO_PROFILE_CEILING, floor=AUTO_PROFILE_FLOOR,
+)
+
+def fanout_eligible(item: Track, restart: bool) -> bool:
+    return bool(
+        fanout and not restart and item.cache_key and not item.seek
+        and (item.path or PATH_ENCODE) == PATH_ENCODE and not audio_only(item)
+    )
 
-def build_ffmpeg_audio(input_file, url):
-    # Ultra-low-latency flags added!
+async def start_fanout_item(chat_id: int, item: Track):
+    url = get_rtmp_url(chat_id)
+    if not url:
+        raise RuntimeError("No RTMP key set")
+    joining = fanout.joinable((item.cache_key, item_profile(item))) is not None
+    ticket = await admit_item(chat_id, item, gapless=False, kind=KIND_COPY if joining else None)
+    await publishers.stop(chat_id)
+    while True:
+        # Admission may have lowered the profile, which changes which encode this chat can share.
+        key = (item.cache_key, item_profile(item))
+        if ticket.kind != KIND_COPY or fanout.joinable(key):
+            break
+        # The encode this chat was admitted to join ended while it waited; starting one needs its own admission.
+        ticket = await admit_item(chat_id, item, gapless=False)
+
+    def make_encode():
+        rendition = None
+        if renditions and not item.degraded:
+            rendition = renditions.reserve(item.cache_key, rendition_profile(item))
+        command = build_fanout_encoder(
+            item_input(item), cache_file=rendition[0] if rendition else None, container=item.container,
+            **PROFILES[item_profile(item)]
+        )
+        return SharedEncode(
+            key, command, feed=item_feed(item),
+            rendition=rendition, expected_duration=item.duration_s or 0,
+        )
+
+    encode, subscriber, created = await fanout.join_or_start(key, chat_id, make_encode)
+    if created:
+        if ticket.kind == KIND_COPY:
+            ticket = await admit_item(chat_id, item, gapless=False, kind=PROFILE_KINDS[item_profile(item)])
+        item.ticket = scheduler.share(ticket, encode)
+    else:
+        scheduler.retag(ticket, KIND_COPY)
+    if renditions:
+        renditions.note_play(False)
+    item.fanout = (encode, subscriber)
+    item.path_reason = (
+        "shared encode, started here" if created else f"shared encode with {len(encode.subscribers) - 1} other chats"
+    )
+    logger.info(f"Stream path for chat {chat_id}: fanout ({item.path_reason}) - {item.title!r}")
+    try:
+        return await supervisor.start(
+            chat_id, build_fanout_relay(url), input_file=item.input_file, item=item,
+            on_finish=on_stream_end, feed=fanout.relay_feed(encode, chat_id, subscriber)
+        )
+    except Exception:
+        item.fanout = None
+        fanout.leave(encode, chat_id, subscriber)
+        raise
+
+async def start_item(chat_id: int, item: Track, restart: bool = False):
+    if not restart:
+        item.profile = item.profile or chat_profile(chat_id)[0]
+    if not gapless_enabled(chat_id):
+        if fanout_eligible(item, restart):
+            return await start_fanout_item(chat_id, item)
+        still = await stills.get(http_session, item.thumbnail, STILL_WAIT) if stills and audio_only(item) else None
+        await admit_item(chat_id, item, gapless=False, restart=restart)
+        await publishers.stop(chat_id)
+        cache_file = None
+        if renditions and item.cache_key and not restart:
+            renditions.note_play(item.path == PATH_CACHED)
+            # Copied tracks are recorded too: a replay then needs no download, probe or Telegram fetch.
+            if item.path != PATH_CACHED and not item.degraded and not item.seek:
+                item.rendition_tmp = renditions.reserve(item.cache_key, rendition_profile(item))
+                cache_file = item.rendition_tmp[0]
+        command = build_item_command(item, cache_file=cache_file, still=still)
+        logger.info(
+            f"Stream path for chat {chat_id}: {item.path or PATH_ENCODE} "
+            f"({item.path_reason or 'not probed'}) - {item.title!r}"
+        )
+        return await supervisor.start(
+            chat_id, command, input_file=item.input_file, item=item,
+            on_finish=on_stream_end, feed=item_feed(item)
+        )
+    url = get_rtmp_url(chat_id)
+    if not url:
+        raise RuntimeError("No RTMP key set")
+    await admit_item(chat_id, item, gapless=True, restart=restart)
+    # Stop the previous feeder first so the new one's timestamps continue after it.
+    await supervisor.stop(chat_id)
+    publisher = await publishers.ensure(chat_id, url, chat_profile(chat_id)[0])
+    command = build_item_command(item, ts_offset=publisher.elapsed())
+    item.path, item.path_reason = "gapless", "persistent publisher"
+    return await supervisor.start(
+        chat_id, command, input_file=item.input_file, item=item,
+        on_finish=on_stream_end, stdout=publisher.write_fd,
+        feed=item_feed(item)
+    )
+
+def chat_progress(chat_id: int):
+    # In gapless mode the feeder only decodes; the publisher is the encoder worth watching.
+    publisher = publishers.get(chat_id)
+    if publisher:
+        return publisher.progress
+    job = supervisor.jobs.get(chat_id)
+    if job and job.item and job.item.fanout:
+        # The relay only remuxes; the shared encoder is what can fall behind.
+        return job.item.fanout[0].progress
+    return job.progress if job else None
+
+def collect_metrics() -> List[MetricFamily]:
+    per_chat = {
+        "fps": [], "speed": [], "bitrate": [], "drop": [], "dup": [], "out_time": [],
+    }
+    paths: Dict[str, int] = defaultdict(int)
+    for chat_id in supervisor.active_chats():
+        job = supervisor.jobs[chat_id]
+        paths[(job.item.path if job.item else None) or PATH_ENCODE] += 1
+        progress = chat_progress(chat_id)
+        if not progress or not progress.samples:
+            continue
+        labels = {"chat_id": str(chat_id)}
+        per_chat["fps"].append((labels, progress.fps))
+        per_chat["speed"].append((labels, progress.speed))
+        per_chat["bitrate"].append((labels, progress.bitrate))
+        per_chat["drop"].append((labels, progress.drop_frames))
+        per_chat["dup"].append((labels, progress.dup_frames))
+        per_chat["out_time"].append((labels, progress.out_time))
+    rstats = resolver_pool.stats()
+    sstats = scheduler.stats()
+    istats = ingest_pipeline.stats()
+    nstats = net_input.stats() if net_input else {"feeds": 0, "resumes": 0, "failures": 0, "bytes": 0}
     return [
-        "ffmpeg",
-        "-fflags", "nobuffer",
-        "-flags", "low_delay",
-        "-probesize", "32",
-        "-analyzeduration", "0",
-        "-re",
-        "-i", input_file,
-        "-vn", "-c:a", "aac", "-b:a", "128k", "-ac", "2", "-ar", "44100",
-        "-f", "flv", url
+        ("satoru_stream_fps", "gauge", "Output frames per second reported by FFmpeg", per_chat["fps"]),
+        ("satoru_stream_speed", "gauge", "Encode speed as a multiple of realtime", per_chat["speed"]),
+        ("satoru_stream_bitrate_kbps", "gauge", "Output bitrate in kbit/s", per_chat["bitrate"]),
+        ("satoru_stream_dropped_frames", "gauge", "Frames dropped by the current FFmpeg", per_chat["drop"]),
+        ("satoru_stream_duplicated_frames", "gauge", "Frames duplicated by the current FFmpeg", per_chat["dup"]),
+        ("satoru_stream_out_time_seconds", "gauge", "Media time written by the current FFmpeg", per_chat["out_time"]),
+        ("satoru_active_streams", "gauge", "Running FFmpeg jobs by stream path",
+         [({"path": path}, count) for path, count in sorted(paths.items())]),
+        ("satoru_queue_depth", "gauge", "Tracks waiting per chat",
+         [({"chat_id": str(chat_id)}, len(q)) for chat_id, q in queues.items() if q]),
+        ("satoru_scheduler_load_cores", "gauge", "CPU cores claimed by admitted jobs", [({}, sstats["load"])]),
+        ("satoru_scheduler_budget_cores", "gauge", "CPU core budget for FFmpeg jobs", [({}, sstats["budget"])]),
+        ("satoru_scheduler_pending", "gauge", "Jobs waiting for admission", [({}, sstats["pending"])]),
+        ("satoru_resolver_workers", "gauge", "Live resolver worker processes", [({}, rstats["workers"])]),
+        ("satoru_resolver_queued", "gauge", "Resolver requests waiting for a worker", [({}, rstats["queued"])]),
+        ("satoru_resolver_latency_seconds", "gauge", "Recent resolver latency quantiles",
+         [({"quantile": "0.5"}, rstats["latency_p50"]), ({"quantile": "0.95"}, rstats["latency_p95"])]),
+        ("satoru_resolver_requests_total", "counter", "Resolver requests by outcome",
+         [({"outcome": outcome}, rstats[outcome]) for outcome in ("completed", "failed", "timeouts", "deduplicated")]),
+        ("satoru_ingest_stage_latency_seconds", "gauge", "Recent play command stage latency quantiles",
+         [({"stage": stage, "quantile": q}, stats[key]) for stage, stats in istats.items()
+          for q, key in (("0.5", "p50"), ("0.95", "p95"))]),
+        ("satoru_ingest_stage_total", "counter", "Play command stages by outcome",
+         [({"stage": stage, "outcome": outcome}, stats[outcome]) for stage, stats in istats.items()
+          for outcome in ("completed", "failed", "timeouts")]),
+        ("satoru_net_input_feeds_total", "counter", "Remote inputs piped through the read-ahead buffer",
+         [({}, nstats["feeds"])]),
+        ("satoru_net_input_resumes_total", "counter", "Dropped input connections resumed with a Range request",
+         [({}, nstats["resumes"])]),
+        ("satoru_net_input_failures_total", "counter", "Piped inputs that could not be resumed",
+         [({}, nstats["failures"])]),
+        ("satoru_net_input_bytes_total", "counter", "Bytes piped from remote inputs", [({}, nstats["bytes"])]),
+        ("satoru_still_renders_total", "counter", "Thumbnail loops pre-encoded for audio tracks, by outcome",
+         [({"outcome": outcome}, count) for outcome, count in (stills.stats() if stills else {}).items()]),
+        ("satoru_stream_resumes_total", "counter", "Tracks restarted after ending early, by outcome",
+         [({"outcome": outcome}, count) for outcome, count in resume_stats.items()]),
+        ("satoru_fanout_encodes", "gauge", "Shared encodes currently running",
+         [({}, fanout.stats()["encodes"] if fanout else 0)]),
+        ("satoru_fanout_relays", "gauge", "Chats relaying a shared encode",
+         [({}, fanout.stats()["relays"] if fanout else 0)]),
+        ("satoru_log_digest_buffered", "gauge", "Log events waiting for the next digest",
+         [({}, log_sink.stats()["buffered"])]),
+        ("satoru_log_digest_flood_waits_total", "counter", "FloodWaits hit while sending log digests",
+         [({}, log_sink.stats()["flood_waits"])]),
     ]
 
-async def start_next_in_queue(chat_id: int):
-    if queues[chat_id]:
-        item = queues[chat_id].popleft()
-        url = get_rtmp_url(chat_id)
-        msg = item.get("msg")
-        caption = item.get("caption")
-        thumb_url = item.get("thumbnail")
-        try:
-            if thumb_url:
-                await msg.reply_photo(thumb_url, caption=caption)
-            else:
-                await msg.edit(caption)
-        except Exception:
+metrics_server = MetricsServer(
+    collect_metrics, METRICS_HOST, METRICS_PORT + (SHARD_INDEX + 1 if SHARD_INDEX is not None else 0)
+) if METRICS_PORT else None
+
+log_sink = LogSink(bot.send_message, [OWNER_ID, LOGGER_ID], interval=LOG_DIGEST_INTERVAL, max_events=LOG_BUFFER_SIZE)
+
+def send_log(text):
+    log_sink.emit(text)
+
+async def start_next_in_queue(chat_id: int, if_idle: bool = False):
+    async with supervisor.lock(chat_id):
+        if if_idle and supervisor.is_running(chat_id):
+            return
+        while queues[chat_id]:
+            item = queues[chat_id].popleft()
+            prefetcher.poke()
             try:
-                await msg.edit(caption)
-            except Exception:
-                pass
+                await prefetcher.ensure(item)
+                await start_item(chat_id, item)
+                break
+            except Exception as e:
+                logger.error(f"Failed to start {item.title!r} in chat {chat_id}: {e}")
+                scheduler.release(item.ticket)
+                item.ticket = None
+                discard_item(item)
+                if not item.resuming:
+                    await edit_item_status(item, f"❌ Failed to start {item.title}: {e}")
+        else:
+            if not supervisor.is_running(chat_id):
+                # Nothing left to play, however we got here: close the gapless publisher's RTMP session.
+                await publishers.stop(chat_id)
+            return
 
-        stop_ffmpeg(chat_id)
+    persist(chat_id)
+    if item.resuming:
+        item.resuming = False
+        resume_stats["resumed"] += 1
+        logger.info(f"Resumed {item.title!r} in chat {chat_id} at {item.seek or 0:.1f}s")
+        return
+    # Only ids are queued; the status message is addressed by reference, even after a restart.
+    caption = f"{track_caption(item)}\n⚙️ Path: {item.path or PATH_ENCODE}"
+    reply_to = item.msg_ref[1] if item.msg_ref else None
+    try:
+        if item.thumbnail:
+            # The photo carries the caption; the status message it replies to must not stay at "Processing...".
+            await bot.send_photo(chat_id, item.thumbnail, caption=caption, reply_to_message_id=reply_to)
+            await edit_item_status(item, f"▶️ Now playing: {item.title}")
+            return
+    except Exception as e:
+        logger.warning(f"Failed to send thumbnail for {item.title!r} in chat {chat_id}: {e}")
+    try:
+        if item.msg_ref:
+            await bot.edit_message_text(*item.msg_ref, caption)
+        else:
+            await bot.send_message(chat_id, caption)
+    except Exception as e:
+        logger.warning(f"Failed to announce {item.title!r} in chat {chat_id}: {e}")
 
-        command = item.get("ffmpeg_cmd")
-        input_file = item.get("input_file")
-        if command:
-            threading.Thread(target=run_ffmpeg_blocking, args=(chat_id, command, input_file, start_next_in_queue), daemon=True).start()
-    else:
+async def edit_item_status(item: Track, text: str):
+    if not item.msg_ref:
         return
+    try:
+        await bot.edit_message_text(*item.msg_ref, text)
+    except Exception as e:
+        logger.warning(f"Failed to update status message for {item.title!r}: {e}")
 
 @bot.on_message(filters.command("start"))
 async def hello(_, m: Message):
@@ -204,7 +972,7 @@ async def hello(_, m: Message):
         f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
     logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
+    send_log(log_text)
 
     await m.reply_photo(
         photo="https://i.ibb.co/QFt3Z9bC/tmpg1y9wbs8.jpg",
@@ -218,13 +986,21 @@ def show_commands(_, query: CallbackQuery):
 
 • /setkey   - Bind your RTMP stream key
 • /play     - Reply with audio/video to stream (video+audio) [Queue Supported]
-• /playaudio - Reply with audio/video to stream (audio only) [Queue Supported]
+• /playaudio - Reply with audio/video to stream (audio + thumbnail) [Queue Supported]
 • /uplay    - Stream direct media file/link [Queue Supported]
-• /ytplay   - Stream YouTube (video+audio) [Queue Supported]
-• /ytaudio  - Stream YouTube (audio only) [Queue Supported]
+• /ytplay   - Stream YouTube (video+audio) [Queue + Playlists]
+• /ytaudio  - Stream YouTube (audio + thumbnail) [Queue + Playlists]
 • /stop     - Kill active stream
 • /skip     - Skip current stream (if queue)
+• /seek     - Jump within the current track (1:30, 90, +30, -15)
+• /replay   - Restart the current track from the beginning
 • /queue    - Show queue
+• /remove   - Remove a track by its /queue position
+• /move     - Play a queued track next
+• /gapless  - Keep one RTMP session across tracks (on/off)
+• /profile  - Encoding quality: 1080p/720p/480p/audio/auto
+• /cachestats - Show metadata and rendition cache stats
+• /stats    - Show live encoder health for every stream
 • /ping     - Check bot latency
 """
     back_button = InlineKeyboardMarkup(
@@ -262,8 +1038,48 @@ async def setkey(_, m: Message):
     if len(m.command) < 2:
         return await m.reply("Usage: /setkey <RTMP_KEY>")
     rtmp_keys[m.chat.id] = m.command[1]
+    persist(m.chat.id)
     await m.reply("✅ RTMP key set.")
 
+@bot.on_message(filters.command("gapless"))
+async def gapless(_, m: Message):
+    if len(m.command) < 2 or m.command[1].lower() not in ("on", "off"):
+        state = "on" if gapless_enabled(m.chat.id) else "off"
+        return await m.reply(f"Usage: /gapless <on|off>\nCurrently: {state}")
+    gapless_chats[m.chat.id] = m.command[1].lower() == "on"
+    persist(m.chat.id)
+    await m.reply(
+        "✅ Gapless mode enabled. Tracks will switch without reconnecting from the next track."
+        if gapless_chats[m.chat.id] else
+        "✅ Gapless mode disabled. Each track will open its own RTMP session."
+    )
+
+@bot.on_message(filters.command("profile"))
+async def profile(_, m: Message):
+    choices = (*LADDER, "auto")
+    if len(m.command) < 2 or m.command[1].lower() not in choices:
+        current = chat_profiles.get(m.chat.id, ENCODE_PROFILE)
+        return await m.reply(f"Usage: /profile <{'|'.join(choices)}>\nCurrently: {current}")
+    setting = m.command[1].lower()
+    chat_profiles[m.chat.id] = setting
+    persist(m.chat.id)
+    ladder.reset(m.chat.id)
+    target, auto = chat_profile(m.chat.id)
+    applied = False
+    job = supervisor.jobs.get(m.chat.id)
+    publisher = publishers.get(m.chat.id)
+    if publisher:
+        # Gapless chats encode once, in the publisher: it restarts with the new profile (a new RTMP session).
+        if publisher.profile != target and supervisor.is_running(m.chat.id):
+            applied = await restart_current(m.chat.id)
+    # Auto mode takes over from whatever is playing; an explicit choice applies right away.
+    elif not auto and profile_switchable(m.chat.id) and item_profile(job.item) != target:
+        applied = await switch_profile(m.chat.id, target)
+    await m.reply(
+        f"✅ Encoding profile set to {setting}."
+        + (" Switched the current track." if applied else " Applies from the next encoded track.")
+    )
+
 @bot.on_message(filters.command("ping"))
 async def ping(_, m: Message):
     start = time.perf_counter()
@@ -274,8 +1090,15 @@ async def ping(_, m: Message):
 
 @bot.on_message(filters.command("stop"))
 async def stop(_, m: Message):
-    stop_ffmpeg(m.chat.id)
+    stop_generation[m.chat.id] += 1
+    # Cleared first so tracks dropped together do not keep each other's shared thumbnails alive.
+    dropped = list(queues[m.chat.id])
     queues[m.chat.id].clear()
+    for item in dropped:
+        discard_item(item)
+    persist(m.chat.id)
+    await stop_ffmpeg(m.chat.id)
+    await publishers.stop(m.chat.id)
     await m.reply("🛑 Stream stopped and queue cleared.")
     log_text = (
         f"🛑 [STREAM STOPPED]\n"
@@ -284,11 +1107,15 @@ async def stop(_, m: Message):
         f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
     logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
+    send_log(log_text)
 
 @bot.on_message(filters.command("skip"))
 async def skip(_, m: Message):
-    stop_ffmpeg(m.chat.id)
+    await stop_ffmpeg(m.chat.id)
+    q = queues[m.chat.id]
+    if q and q.peek().resuming:
+        # The current track crashed and is waiting to resume: skipping means dropping it.
+        discard_item(q.popleft())
     await m.reply("⏭️ Skipped current stream.")
     log_text = (
         f"⏭️ [STREAM SKIPPED]\n"
@@ -297,256 +1124,483 @@ async def skip(_, m: Message):
         f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
     logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
+    send_log(log_text)
     await start_next_in_queue(m.chat.id)
 
-@bot.on_message(filters.command("queue"))
-async def show_queue(_, m: Message):
-    q = queues[m.chat.id]
+@bot.on_message(filters.command("seek"))
+async def seek(_, m: Message):
+    if len(m.command) < 2:
+        return await m.reply("Usage: /seek <mm:ss|seconds|+seconds|-seconds>")
+    job = supervisor.jobs.get(m.chat.id)
+    if not job or not job.item:
+        return await m.reply("Nothing is playing.")
+    item = job.item
+    if not item.duration_s or item.stream_ingest:
+        return await m.reply("❗ This stream can't be seeked (live source or still streaming from Telegram).")
+    arg = m.command[1]
+    offset = parse_timestamp(arg.lstrip("+-"))
+    if offset is None:
+        return await m.reply("Usage: /seek <mm:ss|seconds|+seconds|-seconds>")
+    if arg[0] in "+-":
+        target = playback_position(job) + (offset if arg[0] == "+" else -offset)
+    else:
+        target = offset
+    target = max(target, 0.0)
+    if target >= item.duration_s:
+        return await m.reply(f"❗ The track is only {format_duration(item.duration_s)} long.")
+    if await restart_current(m.chat.id, seek=target):
+        await m.reply(f"⏩ Seeked to {format_duration(target)}.")
+    else:
+        await m.reply("❗ Seek failed.")
+
+@bot.on_message(filters.command("replay"))
+async def replay(_, m: Message):
+    if not supervisor.jobs.get(m.chat.id):
+        return await m.reply("Nothing is playing.")
+    if await restart_current(m.chat.id, seek=0):
+        await m.reply("🔁 Restarted the current track.")
+    else:
+        await m.reply("❗ Replay failed.")
+
+@bot.on_message(filters.command("cachestats"))
+async def cachestats(_, m: Message):
+    stats = yt_cache.stats()
+    await m.reply(
+        f"🗂️ Metadata cache\n"
+        f"Entries: {stats['entries']}/{stats['max_entries']}\n"
+        f"Hits: {stats['hits']} (disk: {stats['disk_hits']})\n"
+        f"Misses: {stats['misses']}\n"
+        f"Evictions: {stats['evictions']}\n"
+        f"Hit ratio: {stats['hit_ratio']:.1%}"
+    )
+    if renditions:
+        rstats = renditions.stats()
+        await m.reply(
+            f"🎞️ Rendition cache\n"
+            f"Size: {rstats['bytes'] / 1048576:.0f}/{rstats['max_bytes'] / 1048576:.0f} MiB\n"
+            f"Hits: {rstats['hits']}\n"
+            f"Misses: {rstats['misses']}\n"
+            f"Stored: {rstats['stores']}\n"
+            f"Evictions: {rstats['evictions']}"
+        )
+
+def is_operator(m: Message) -> bool:
+    # The owner, or anyone in the owner's or log chat, may see every chat's streams.
+    operators = {OWNER_ID, LOGGER_ID} - {None}
+    return bool(operators) and (m.chat.id in operators or bool(m.from_user and m.from_user.id in operators))
+
+def stream_stats_line(chat_id: int) -> str:
+    job = supervisor.jobs[chat_id]
+    progress = chat_progress(chat_id)
+    path = (job.item.path if job.item else None) or PATH_ENCODE
+    if path == PATH_ENCODE and job.item:
+        path = f"{path} {rendition_profile(job.item)}{' shared' if job.item.fanout else ''}"
+    if not progress or not progress.samples:
+        return f"• {chat_id} [{path}] starting..."
+    flag = " ⚠️" if progress.avg_speed < SLOW_SPEED else ""
+    return (
+        f"• {chat_id} [{path}] {progress.avg_speed:.2f}x{flag}, {progress.avg_fps:.0f} fps, "
+        f"{progress.avg_bitrate:.0f} kbps, drop {progress.drop_frames}, dup {progress.dup_frames}, "
+        f"at {format_duration(int(progress.out_time))}"
+    )
+
+@bot.on_message(filters.command("stats"))
+async def show_stats(_, m: Message):
+    if not is_operator(m):
+        # Other chats' ids and stream health are not theirs to see.
+        if not supervisor.is_running(m.chat.id):
+            return await m.reply("Nothing is playing.")
+        return await m.reply(f"📈 This chat\n{stream_stats_line(m.chat.id)}\nQueued tracks: {len(queues[m.chat.id])}")
+    chats = supervisor.active_chats()
+    lines = [f"📈 Streams: {len(chats)} | Load: {scheduler.load():.2f}/{scheduler.core_budget:.0f} cores"]
+    if SHARD_INDEX is not None:
+        lines[0] += f" | Shard {SHARD_INDEX + 1}/{SHARDS}"
+    lines.extend(stream_stats_line(chat_id) for chat_id in chats)
+    rstats = resolver_pool.stats()
+    lines.append(
+        f"Queued tracks: {sum(len(q) for q in queues.values())} | "
+        f"Resolver p50/p95: {rstats['latency_p50']:.1f}s/{rstats['latency_p95']:.1f}s"
+    )
+    istats = ingest_pipeline.stats()
+    if istats:
+        lines.append("Ingest p50/p95: " + ", ".join(
+            f"{stage} {stats['p50']:.2f}s/{stats['p95']:.2f}s" for stage, stats in istats.items()
+        ))
+    await m.reply("\n".join(lines))
+
+def queue_page(chat_id: int, page: int):
+    q = queues[chat_id]
+    pages = max(1, math.ceil(len(q) / QUEUE_PAGE_SIZE))
+    page = min(max(page, 1), pages)
     lines = []
+    job = supervisor.jobs.get(chat_id)
+    if job and job.item:
+        lines.append(f"▶️ Now playing: {job.item.title} ({track_duration(job.item)})")
     if q:
-        lines.append("RTMP queue:")
-        for idx, item in enumerate(q, 1):
-            lines.append(f"{idx}. {item['title']} ({item['duration']})")
+        lines.append(f"RTMP queue ({len(q)} tracks, page {page}/{pages}):")
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        for idx, item in enumerate(q.page(start, QUEUE_PAGE_SIZE), start + 1):
+            lines.append(f"{idx}. {item.title} ({track_duration(item)})")
     if not lines:
-        return await m.reply("Queue is empty.")
-    await m.reply("\n".join(lines))
+        return "Queue is empty.", None
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"queue:{page - 1}"))
+    if page < pages:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"queue:{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+@bot.on_message(filters.command("queue"))
+async def show_queue(_, m: Message):
+    text, markup = queue_page(m.chat.id, 1)
+    await m.reply(text, reply_markup=markup)
+
+@bot.on_callback_query(filters.regex(r"^queue:(\d+)$"))
+async def queue_page_callback(_, query: CallbackQuery):
+    text, markup = queue_page(query.message.chat.id, int(query.matches[0].group(1)))
+    try:
+        await query.message.edit_text(text, reply_markup=markup)
+    except Exception:
+        pass
+    await query.answer()
 
-def ytdl_extract_info_direct(query: str, video: bool = False):
-    opts = YTDL_OPTS.copy()
-    opts["format"] = "bestaudio/best" if not video else "bestvideo+bestaudio/best"
-    with yt_dlp.YoutubeDL(opts) as ydl_local:
-        info = ydl_local.extract_info(query, download=False)
-    if "entries" in info and info["entries"]:
-        info = info["entries"][0]
+def queued_track(m: Message) -> Optional[Track]:
+    if len(m.command) < 2 or not m.command[1].isdigit():
+        return None
+    return queues[m.chat.id].nth(int(m.command[1]) - 1)
+
+@bot.on_message(filters.command("remove"))
+async def remove(_, m: Message):
+    item = queued_track(m)
+    if not item:
+        return await m.reply("Usage: /remove <position in /queue>")
+    queues[m.chat.id].remove(item)
+    discard_item(item)
+    persist(m.chat.id)
+    await m.reply(f"🗑️ Removed: {item.title}")
+
+@bot.on_message(filters.command("move"))
+async def move(_, m: Message):
+    item = queued_track(m)
+    if not item:
+        return await m.reply("Usage: /move <position in /queue>")
+    queues[m.chat.id].move_to_front(item)
+    prefetcher.poke()
+    persist(m.chat.id)
+    await m.reply(f"⏫ Playing next: {item.title}")
+
+async def resolve_youtube(query: str, video: bool = False):
+    info = await yt_cache.get(query, video)
+    if info:
+        logger.info(f"Metadata cache hit for {query!r} (video={video})")
+        return info
+    info = await resolver_pool.extract(query, video=video)
+    yt_cache.put(query, video, info)
     return info
 
-@bot.on_message(filters.command("play"))
-async def play(_, m: Message):
-    if not m.reply_to_message or not (m.reply_to_message.audio or m.reply_to_message.voice or m.reply_to_message.video):
-        return await m.reply("Reply with an audio, voice, or video file.")
-    url = get_rtmp_url(m.chat.id)
-    if not url:
-        return await m.reply("❗ Set an RTMP key first using /setkey.")
-    msg = await m.reply("Processing and queuing...")
-    media = await m.reply_to_message.download()
-    title = getattr(m.reply_to_message, "file_name", "Telegram Media")
-    duration = format_duration(getattr(m.reply_to_message, "duration", 0))
-    thumb_url = None
-    if getattr(m.reply_to_message, "video", None) and m.reply_to_message.video.thumbs:
-        try:
-            thumb_file = await m.reply_to_message.video.thumbs[0].get_file()
-            thumb_url = thumb_file.file_id
-        except Exception:
-            thumb_url = None
-    caption = f"🎬 Queued: {title}\n⏱️ Duration: {duration}\n👤 Requested by: {m.from_user.mention}"
-    item = {
-        "chat_id": m.chat.id,
-        "title": title,
-        "duration": duration,
-        "caption": caption,
-        "thumbnail": thumb_url,
-        "msg": msg,
-        "input_file": media,
-        "ffmpeg_cmd": build_ffmpeg_video(media, url),
-        "requester": f"@{m.from_user.username} (ID: {m.from_user.id})"
-    }
-    enqueue_rt(item)
-    await msg.edit(f"✅ Added to queue: {title}")
-    log_text = (
-        f"🟢 [QUEUED]\n"
-        f"👤 User: @{m.from_user.username} (ID: {m.from_user.id})\n"
-        f"🎶 Song: {title}\n"
-        f"⏱️ Duration: {duration}\n"
-        f"💬 Chat: {m.chat.id}\n"
-        f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-    )
-    logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
-    if not ffmpeg_processes.get(m.chat.id):
-        await start_next_in_queue(m.chat.id)
-
-@bot.on_message(filters.command("playaudio"))
-async def playaudio(_, m: Message):
-    if not m.reply_to_message or not (m.reply_to_message.audio or m.reply_to_message.voice or m.reply_to_message.video):
-        return await m.reply("Reply with an audio, voice, or video file.")
-    url = get_rtmp_url(m.chat.id)
-    if not url:
-        return await m.reply("❗ Set an RTMP key first using /setkey.")
-    msg = await m.reply("Processing and queuing...")
-    media = await m.reply_to_message.download()
-    title = getattr(m.reply_to_message, "file_name", "Telegram Media")
-    duration = format_duration(getattr(m.reply_to_message, "duration", 0))
-    thumb_url = None
-    if getattr(m.reply_to_message, "video", None) and m.reply_to_message.video.thumbs:
-        try:
-            thumb_file = await m.reply_to_message.video.thumbs[0].get_file()
-            thumb_url = thumb_file.file_id
-        except Exception:
-            thumb_url = None
-    caption = f"🎵 Queued (Audio): {title}\n⏱️ Duration: {duration}\n👤 Requested by: {m.from_user.mention}"
-    item = {
-        "chat_id": m.chat.id,
-        "title": title,
-        "duration": duration,
-        "caption": caption,
-        "thumbnail": thumb_url,
-        "msg": msg,
-        "input_file": media,
-        "ffmpeg_cmd": build_ffmpeg_audio(media, url),
-        "requester": f"@{m.from_user.username} (ID: {m.from_user.id})"
-    }
-    enqueue_rt(item)
-    await msg.edit(f"✅ Added to queue: {title}")
-    log_text = (
-        f"🟢 [QUEUED AUDIO]\n"
-        f"👤 User: @{m.from_user.username} (ID: {m.from_user.id})\n"
-        f"🎶 Song: {title}\n"
-        f"⏱️ Duration: {duration}\n"
-        f"💬 Chat: {m.chat.id}\n"
-        f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+async def download_media(query: str, video: bool = False):
+    opts = {k: ydl_opts[k] for k in ("outtmpl", "noplaylist", "default_search")}
+    return await resolver_pool.download(query, video=video, opts=opts)
+
+def playlist_item(m: Message, msg: Message, entry: dict, mode: str) -> Track:
+    return Track(
+        chat_id=m.chat.id,
+        title=entry.get("title") or "Unknown",
+        kind="youtube",
+        mode=mode,
+        duration_s=entry.get("duration"),
+        thumbnail=entry.get("thumbnail"),
+        requester=f"@{m.from_user.username} (ID: {m.from_user.id})",
+        query=entry.get("webpage_url") or f"https://www.youtube.com/watch?v={entry['id']}",
+        cache_key=f"yt-{entry['id']}",
+        msg_ref=(msg.chat.id, msg.id),
     )
-    logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
-    if not ffmpeg_processes.get(m.chat.id):
-        await start_next_in_queue(m.chat.id)
 
-@bot.on_message(filters.command("uplay"))
-async def uplay(_, m: Message):
-    if len(m.command) < 2:
-        return await m.reply("Usage: /uplay <direct_media_url>")
-    url = get_rtmp_url(m.chat.id)
-    if not url:
-        return await m.reply("❗ Set an RTMP key first using /setkey.")
-    media_url = m.text.split(maxsplit=1)[1]
-    title = "Direct URL"
-    duration = "Unknown"
-    caption = f"🎬 Queued from URL\n👤 Requested by: {m.from_user.mention}"
-    msg = await m.reply("✅ Added to queue: Direct URL")
-    item = {
-        "chat_id": m.chat.id,
-        "title": title,
-        "duration": duration,
-        "caption": caption,
-        "thumbnail": None,
-        "msg": msg,
-        "ffmpeg_cmd": build_ffmpeg_video(media_url, url),
-        "requester": f"@{m.from_user.username} (ID: {m.from_user.id})"
-    }
-    enqueue_rt(item)
+async def queue_playlist(m: Message, msg: Message, query: str, mode: str):
+    # Queue the first page of flat entries right away; the rest is paged in the background.
+    chat_id = m.chat.id
+    generation = stop_generation[chat_id]
+    first = await resolver_pool.playlist(query, 1, min(PLAYLIST_PAGE, PLAYLIST_LIMIT))
+    if not first["entries"]:
+        raise RuntimeError("Playlist is empty or unavailable")
+    queued = sum(enqueue_rt(playlist_item(m, msg, entry, mode)) for entry in first["entries"])
+    title = first.get("title") or "playlist"
+    more = first["fetched"] >= PLAYLIST_PAGE and PLAYLIST_LIMIT > PLAYLIST_PAGE
+    await msg.edit(
+        f"✅ Queued {queued} tracks from {title}" + (", loading the rest..." if more else "")
+    )
     log_text = (
-        f"🟢 [QUEUED URL]\n"
+        f"🟢 [QUEUED PLAYLIST]\n"
         f"👤 User: @{m.from_user.username} (ID: {m.from_user.id})\n"
-        f"💬 Chat: {m.chat.id}\n"
+        f"📃 Playlist: {title} ({first.get('count') or '?'} videos)\n"
+        f"💬 Chat: {chat_id}\n"
         f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
     logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
-    if not ffmpeg_processes.get(m.chat.id):
-        await start_next_in_queue(m.chat.id)
+    send_log(log_text)
+    if more:
+        asyncio.create_task(queue_playlist_pages(m, msg, query, mode, generation))
 
-@bot.on_message(filters.command("ytplay"))
-async def ytplay(_, m: Message):
-    if len(m.command) < 2:
-        return await m.reply("Usage: /ytplay <song or YouTube URL>")
-    url = get_rtmp_url(m.chat.id)
-    if not url:
-        return await m.reply("❗ Set an RTMP key first using /setkey.")
-    query = m.text.split(maxsplit=1)[1]
-    msg = await m.reply("🔍 Getting stream info (fast)...")
+async def queue_playlist_pages(m: Message, msg: Message, query: str, mode: str, generation: int):
+    chat_id = m.chat.id
+    start, queued = PLAYLIST_PAGE + 1, 0
+    while start <= PLAYLIST_LIMIT:
+        end = min(start + PLAYLIST_PAGE - 1, PLAYLIST_LIMIT)
+        try:
+            page = await resolver_pool.playlist(query, start, end)
+        except Exception as e:
+            logger.warning(f"Playlist paging stopped at {start} for chat {chat_id}: {e}")
+            break
+        if stop_generation[chat_id] != generation:
+            return
+        queued += sum(enqueue_rt(playlist_item(m, msg, entry, mode)) for entry in page["entries"])
+        if page["fetched"] < end - start + 1:
+            break
+        start = end + 1
+    logger.info(f"Queued {queued} more playlist tracks in chat {chat_id}")
+
+telegram_source = TelegramResolver(bot.download_media, THUMB_DIR)
+url_source = UrlResolver()
+youtube_source = YouTubeResolver(resolve_youtube, download_media)
+
+PLAY_COMMANDS: Dict[str, Tuple[SourceResolver, str]] = {
+    "play": (telegram_source, "video"),
+    "playaudio": (telegram_source, "audio"),
+    "uplay": (url_source, "video"),
+    "ytplay": (youtube_source, "video"),
+    "ytaudio": (youtube_source, "audio"),
+}
+
+async def edit_status(status: asyncio.Task, text: str):
     try:
-        info = await asyncio.get_event_loop().run_in_executor(None, lambda: ytdl_extract_info_direct(query, video=True))
-        stream_url = info.get("url") or info.get("formats", [{}])[-1].get("url")
-        if not stream_url:
-            filepath, info2 = await asyncio.get_event_loop().run_in_executor(None, lambda: download_media(query, video=True))
-            stream_url = filepath
-            info = info2
-        title = info.get("title", "Unknown")
-        duration = format_duration(info.get("duration", 0))
-        thumb_url = info.get("thumbnail")
+        msg = await status
+        await ingest_pipeline.stage("edit", msg.edit(text))
     except Exception as e:
-        return await msg.edit(f"❌ Failed: {e}")
-    caption = f"🎬 Queued: {title}\n⏱️ Duration: {duration}\n👤 Requested by: {m.from_user.mention}"
-    item = {
-        "chat_id": m.chat.id,
-        "title": title,
-        "duration": duration,
-        "caption": caption,
-        "thumbnail": thumb_url,
-        "msg": msg,
-        "ffmpeg_cmd": build_ffmpeg_video(stream_url, url),
-        "requester": f"@{m.from_user.username} (ID: {m.from_user.id})"
-    }
-    enqueue_rt(item)
-    await msg.edit(f"✅ Added to queue: {title}")
-    log_text = (
-        f"🟢 [QUEUED YOUTUBE]\n"
+        logger.warning(f"Failed to update status message: {e}")
+
+def queued_log(m: Message, source: SourceResolver, item: Track) -> str:
+    return (
+        f"🟢 [{source.log_label}{' AUDIO' if item.mode == 'audio' else ''}]\n"
         f"👤 User: @{m.from_user.username} (ID: {m.from_user.id})\n"
-        f"🎶 Song: {title}\n"
-        f"⏱️ Duration: {duration}\n"
+        f"🎶 Song: {item.title}\n"
+        f"⏱️ Duration: {track_duration(item)}\n"
         f"💬 Chat: {m.chat.id}\n"
         f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
-    logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
-    if not ffmpeg_processes.get(m.chat.id):
-        await start_next_in_queue(m.chat.id)
 
-@bot.on_message(filters.command("ytaudio"))
-async def ytaudio(_, m: Message):
-    if len(m.command) < 2:
-        return await m.reply("Usage: /ytaudio <song or YouTube URL>")
-    url = get_rtmp_url(m.chat.id)
-    if not url:
+async def ingest(m: Message, source: SourceResolver, mode: str):
+    started = time.perf_counter()
+    error = source.check(m)
+    if error:
+        return await m.reply(error)
+    if not get_rtmp_url(m.chat.id):
         return await m.reply("❗ Set an RTMP key first using /setkey.")
-    query = m.text.split(maxsplit=1)[1]
-    msg = await m.reply("🔍 Getting audio stream info (fast)...")
+    chat_id = m.chat.id
+    # The status reply, the thumbnail and the resolve each wait on a different server; none needs the others.
+    status = ingest_pipeline.background("status", m.reply(source.status_text(mode)))
+    playlist = source.playlist(m)
+    if playlist:
+        try:
+            await ingest_pipeline.stage("playlist", queue_playlist(m, await status, playlist, mode))
+        except Exception as e:
+            return await edit_status(status, f"❌ Failed: {e}")
+        return await start_next_in_queue(chat_id, if_idle=True)
+    thumbnail = ingest_pipeline.background("thumbnail", source.thumbnail(m))
     try:
-        info = await asyncio.get_event_loop().run_in_executor(None, lambda: ytdl_extract_info_direct(query, video=False))
-        stream_url = info.get("url") or info.get("formats", [{}])[-1].get("url")
-        if not stream_url:
-            filepath, info2 = await asyncio.get_event_loop().run_in_executor(None, lambda: download_media(query, video=False))
-            stream_url = filepath
-            info = info2
-        title = info.get("title", "Unknown")
-        duration = format_duration(info.get("duration", 0))
-        thumb_url = info.get("thumbnail")
+        item = await ingest_pipeline.stage("resolve", source.resolve(m, mode))
     except Exception as e:
-        return await msg.edit(f"❌ Failed: {e}")
-    caption = f"🎵 Queued (Audio): {title}\n⏱️ Duration: {duration}\n👤 Requested by: {m.from_user.mention}"
-    item = {
-        "chat_id": m.chat.id,
-        "title": title,
-        "duration": duration,
-        "caption": caption,
-        "thumbnail": thumb_url,
-        "msg": msg,
-        "ffmpeg_cmd": build_ffmpeg_audio(stream_url, url),
-        "requester": f"@{m.from_user.username} (ID: {m.from_user.id})"
-    }
-    enqueue_rt(item)
-    await msg.edit(f"✅ Added to queue: {title}")
-    log_text = (
-        f"🟢 [QUEUED YOUTUBE AUDIO]\n"
-        f"👤 User: @{m.from_user.username} (ID: {m.from_user.id})\n"
-        f"🎶 Song: {title}\n"
-        f"⏱️ Duration: {duration}\n"
-        f"💬 Chat: {m.chat.id}\n"
-        f"🕜 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-    )
+        thumbnail.cancel()
+        return await edit_status(status, f"❌ Failed: {e}")
+    if STREAM_COPY and item.source:
+        # prepare_item joins this through the probe cache instead of probing again.
+        probe = probes.choose_path(item.source, audio_only=audio_only(item), **path_limits(item))
+        ingest_pipeline.background("probe", probe)
+    def thumbnail_done(task: asyncio.Task):
+        if not task.cancelled() and not task.exception() and task.result():
+            item.thumbnail = item.thumbnail or task.result()
+    # Arrives well before the track is announced; enqueueing never waits for it.
+    thumbnail.add_done_callback(thumbnail_done)
+    try:
+        msg = await status
+        item.msg_ref = (msg.chat.id, msg.id)
+    except Exception as e:
+        logger.warning(f"Status reply failed in chat {chat_id}: {e}")
+    if item.media_msg and len(queues[chat_id]) >= PREFETCH_AHEAD:
+        # Only tracks the prefetcher reaches right away keep the live message; the rest re-fetch it.
+        item.media_msg = None
+    if not enqueue_rt(item):
+        return await edit_status(status, f"ℹ️ Already in queue: {item.title}")
+    ingest_pipeline.observe("enqueue", time.perf_counter() - started)
+    log_text = queued_log(m, source, item)
     logger.info(log_text.replace('\n', ' | '))
-    await send_log(log_text)
-    if not ffmpeg_processes.get(m.chat.id):
-        await start_next_in_queue(m.chat.id)
+    send_log(log_text)
+    # An idle chat starts this track right away; start_next_in_queue turns the status into now-playing or the error.
+    starts_now = not supervisor.is_running(chat_id) and queues[chat_id].peek() is item
+    await asyncio.gather(
+        start_next_in_queue(chat_id, if_idle=True),
+        *([] if starts_now else [edit_status(status, f"✅ Added to queue: {item.title}")]),
+    )
+    if starts_now and item in queues[chat_id]:
+        # Another track took the chat first; this one waits its turn after all.
+        await edit_status(status, f"✅ Added to queue: {item.title}")
 
-def main():
+@bot.on_message(filters.command(list(PLAY_COMMANDS)))
+async def play(_, m: Message):
+    source, mode = PLAY_COMMANDS[m.command[0]]
+    await ingest(m, source, mode)
+
+async def dispatch_message(m: Message):
+    # Shard workers receive no updates; routed commands run through the same handlers as a single bot.
+    for group in sorted(bot.dispatcher.groups):
+        for handler in bot.dispatcher.groups[group]:
+            if isinstance(handler, MessageHandler) and await handler.check(bot, m):
+                try:
+                    await handler.callback(bot, m)
+                except StopPropagation:
+                    return
+                break
+
+async def handle_shard_request(request: dict):
+    op = request["op"]
+    if op == "message":
+        await dispatch_message(await bot.get_messages(request["chat_id"], request["message_id"]))
+    elif op == "queue_page":
+        text, markup = queue_page(request["chat_id"], request["page"])
+        await bot.edit_message_text(request["chat_id"], request["message_id"], text, reply_markup=markup)
+    elif op == "adopt":
+        await restore_state(set(request["chats"]))
+    else:
+        raise ValueError(f"unknown op {op!r}")
+
+shard_link = WorkerLink(handle_shard_request) if SHARD_INDEX is not None else None
+coordinator = Coordinator(
+    SHARDS, [sys.executable, os.path.abspath(__file__)],
+    heartbeat_timeout=SHARD_HEARTBEAT_TIMEOUT, restart_delay=SHARD_RESTART_DELAY,
+) if SHARDS > 1 and SHARD_INDEX is None else None
+
+async def route_command(_, m: Message):
+    if not coordinator.route(m.chat.id, {"op": "message", "chat_id": m.chat.id, "message_id": m.id}):
+        await m.reply("⚠️ Streaming workers are restarting, try again in a few seconds.")
+    m.stop_propagation()
+
+async def route_queue_page(_, query: CallbackQuery):
+    chat_id = query.message.chat.id
+    coordinator.route(chat_id, {
+        "op": "queue_page", "chat_id": chat_id, "message_id": query.message.id,
+        "page": int(query.matches[0].group(1)),
+    })
+    await query.answer()
+    query.stop_propagation()
+
+def collect_coordinator_metrics() -> List[MetricFamily]:
+    stats = coordinator.stats()
+    return [
+        ("satoru_shard_workers", "gauge", "Shard workers in the hash ring", [({}, stats["workers"])]),
+        ("satoru_shard_chats", "gauge", "Chats assigned to each shard worker",
+         [({"shard": str(index)}, count) for index, count in stats["chats"].items()]),
+        ("satoru_shard_routed_total", "counter", "Updates routed to shard workers", [({}, stats["routed"])]),
+        ("satoru_shard_failovers_total", "counter", "Shard workers lost and replaced", [({}, stats["failovers"])]),
+        ("satoru_shard_rebalanced_chats_total", "counter", "Chats moved off failed shard workers",
+         [({}, stats["rebalanced"])]),
+    ]
+
+async def run_coordinator():
+    install_child_watcher()
     loop = asyncio.get_event_loop()
+    if renditions:
+        # Workers share the rendition directory, so only the coordinator may sweep it.
+        await loop.run_in_executor(None, renditions.cleanup_orphans)
+    await coordinator.start()
+    if store:
+        await loop.run_in_executor(None, store.open)
+        keys, saved_queues, playing, settings = await loop.run_in_executor(None, store.load)
+        placed = coordinator.assign(set(keys) | set(saved_queues) | set(playing) | set(settings))
+        logger.info(f"Handed {sum(len(chats) for chats in placed.values())} saved chats to {len(placed)} shard workers")
+    server = MetricsServer(collect_coordinator_metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    if server:
+        try:
+            await server.start()
+        except OSError as e:
+            logger.warning(f"Metrics endpoint disabled: {e}")
+            server = None
+    bot.add_handler(MessageHandler(route_command, filters.regex(r"^/")), group=-1)
+    bot.add_handler(CallbackQueryHandler(route_queue_page, filters.regex(r"^queue:(\d+)$")), group=-1)
+    await bot.start()
+    logger.info(f"Coordinator started with {SHARDS} shard workers.")
     try:
-        bot.run()
-    except KeyboardInterrupt:
+        await idle()
+    finally:
         logger.info("Stopping...")
+        await bot.stop()
+        await coordinator.stop()
+        if server:
+            await server.stop()
+        file_log_listener.stop()
+
+async def run_bot():
+    global http_session
+    install_child_watcher()
+    http_session = aiohttp.ClientSession()
+    await resolver_pool.start()
+    if renditions:
+        # Only a single bot may sweep partials (the coordinator does it for shards); workers just take the size.
+        sweep = renditions.cleanup_orphans if SHARD_INDEX is None else renditions.enforce_quota
+        await asyncio.get_event_loop().run_in_executor(None, sweep)
+    if metrics_server:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.warning(f"Metrics endpoint disabled: {e}")
+    await bot.start()
+    log_sink.start()
+    prefetcher.start()
+    ladder.start()
+    if store:
+        await asyncio.get_event_loop().run_in_executor(None, store.open)
+    if shard_link:
+        # Chats arrive through "adopt" requests instead of a full restore.
+        await shard_link.start()
+    else:
+        await restore_state()
+    if store:
+        store.start()
+    logger.info("Bot started." if SHARD_INDEX is None else f"Shard worker {SHARD_INDEX} started.")
+    try:
+        if shard_link:
+            # A worker also exits when its coordinator goes away.
+            waits = {asyncio.create_task(idle()), asyncio.create_task(shard_link.closed.wait())}
+            _, pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+        else:
+            await idle()
     finally:
-        pass
+        logger.info("Stopping...")
+        if shard_link:
+            await shard_link.stop()
+        if store:
+            # Flush before stopping streams so now-playing positions survive the redeploy.
+            await store.stop()
+        await ladder.stop()
+        await prefetcher.stop()
+        await supervisor.stop_all()
+        if fanout:
+            await fanout.stop_all()
+        await publishers.stop_all()
+        await resolver_pool.stop()
+        await asyncio.get_event_loop().run_in_executor(None, yt_cache.close)
+        if metrics_server:
+            await metrics_server.stop()
+        await http_session.close()
+        await log_sink.stop()
+        await bot.stop()
+        file_log_listener.stop()
+
+def main():
+    try:
+        bot.run(run_coordinator() if coordinator else run_bot())
+    except KeyboardInterrupt:
+        logger.info("Stopping...")
 
 if __name__ == "__main__":
     main()
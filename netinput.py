@@ -0,0 +1,150 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Optional, Dict
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
+
+from streamfeed import pump, mp4_streamable
+
+logger = logging.getLogger("SatoruGojo")
+
+CHUNK_SIZE = 256 * 1024
+HEAD_BYTES = 64 * 1024
+
+# googlevideo and most CDNs name the container in a mime= parameter; the rest go by extension.
+MIME_CONTAINERS = {
+    "mp4": "mp4", "quicktime": "mp4", "webm": "webm", "x-matroska": "matroska", "x-flv": "flv",
+    "mp2t": "mpegts", "mpeg": "mp3", "aac": "aac", "ogg": "ogg",
+    "mpegurl": "hls", "x-mpegurl": "hls", "vnd.apple.mpegurl": "hls",
+}
+EXT_CONTAINERS = {
+    ".mp4": "mp4", ".m4a": "mp4", ".m4v": "mp4", ".mov": "mp4", ".webm": "webm", ".mkv": "matroska",
+    ".flv": "flv", ".ts": "mpegts", ".m3u8": "hls", ".mp3": "mp3", ".aac": "aac",
+    ".ogg": "ogg", ".oga": "ogg", ".opus": "ogg",
+}
+
+
+def is_network(source: Optional[str]) -> bool:
+    return bool(source) and source.startswith(("http://", "https://"))
+
+
+def guess_container(source: Optional[str]) -> Optional[str]:
+    if not source or source.startswith("pipe:"):
+        return None
+    parsed = urlparse(source)
+    if parsed.scheme in ("http", "https"):
+        mime = parse_qs(parsed.query).get("mime")
+        if mime:
+            container = MIME_CONTAINERS.get(mime[0].rsplit("/", 1)[-1].lower())
+            if container:
+                return container
+        if "hls_playlist" in parsed.path or "/hls/" in parsed.path:
+            return "hls"
+        path = parsed.path
+    else:
+        path = source
+    return EXT_CONTAINERS.get(os.path.splitext(path)[1].lower())
+
+
+class NetworkInput:
+    """Feeds remote media to FFmpeg through a bounded local read-ahead buffer.
+
+    The download runs up to ``read_ahead`` chunks ahead of FFmpeg, so a
+    stall shorter than that buffer never reaches the encoder. A dropped
+    connection is resumed with a Range request from the last byte
+    delivered, up to ``retries`` times in a row. Only progressive files
+    are piped: HLS keeps FFmpeg's own demuxer, and MP4 must be faststart
+    because a pipe cannot seek to a trailing moov.
+    """
+
+    def __init__(self, read_ahead: int = 32, chunk_size: int = CHUNK_SIZE, retries: int = 5,
+                 read_timeout: float = 15.0, backoff: float = 0.5):
+        self.read_ahead = read_ahead
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.read_timeout = read_timeout
+        self.backoff = backoff
+        self.feeds = 0
+        self.resumes = 0
+        self.failures = 0
+        self.bytes = 0
+
+    async def pipeable(self, session: aiohttp.ClientSession, url: str, container: Optional[str]) -> bool:
+        if not is_network(url) or container == "hls":
+            return False
+        if container not in ("mp4", None):
+            return True
+        head = await self._head(session, url)
+        # Unknown containers only need to not be a non-faststart MP4; known MP4 must prove it.
+        streamable = mp4_streamable(head)
+        return streamable is True or (container is None and streamable is None and bool(head))
+
+    async def _head(self, session: aiohttp.ClientSession, url: str) -> bytes:
+        try:
+            async with session.get(
+                url,
+                headers={"Range": f"bytes=0-{HEAD_BYTES - 1}"},
+                timeout=aiohttp.ClientTimeout(total=self.read_timeout),
+            ) as resp:
+                if resp.status >= 400:
+                    return b""
+                return await resp.content.read(HEAD_BYTES)
+        except Exception as e:
+            logger.warning(f"Head fetch failed for {url[:80]}: {e}")
+            return b""
+
+    async def chunks(self, session: aiohttp.ClientSession, url: str) -> AsyncIterator[bytes]:
+        offset = 0
+        failures = 0
+        try:
+            while True:
+                headers = {"Range": f"bytes={offset}-"} if offset else {}
+                try:
+                    async with session.get(
+                        url,
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(sock_connect=self.read_timeout, sock_read=self.read_timeout),
+                    ) as resp:
+                        if offset and resp.status != 206:
+                            raise RuntimeError(f"cannot resume at byte {offset}: HTTP {resp.status}")
+                        resp.raise_for_status()
+                        async for chunk in resp.content.iter_chunked(self.chunk_size):
+                            offset += len(chunk)
+                            self.bytes += len(chunk)
+                            failures = 0
+                            yield chunk
+                    # A connection cut short of Content-Length raises above; getting here means the file ended.
+                    return
+                except aiohttp.ClientResponseError as e:
+                    if e.status < 500:
+                        raise
+                    error = e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                failures += 1
+                if failures > self.retries:
+                    raise RuntimeError(f"gave up after {self.retries} resumes at byte {offset}: {error!r}")
+                self.resumes += 1
+                delay = min(self.backoff * 2 ** (failures - 1), 10.0)
+                logger.warning(f"Input connection lost at byte {offset} ({error!r}), resuming in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        except Exception:
+            self.failures += 1
+            raise
+
+    def feed(self, session: aiohttp.ClientSession, url: str, title: str):
+        async def feed(writer):
+            self.feeds += 1
+            written = await pump(self.chunks(session, url), writer, read_ahead=self.read_ahead)
+            logger.info(f"Piped {written / 1048576:.1f} MiB of {title!r} into FFmpeg")
+        return feed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "feeds": self.feeds,
+            "resumes": self.resumes,
+            "failures": self.failures,
+            "bytes": self.bytes,
+        }
@@ -0,0 +1,119 @@
+import time
+import itertools
+import asyncio
+import logging
+from typing import Dict, Callable, Awaitable, Optional
+
+import aiohttp
+
+from track import Track
+
+logger = logging.getLogger("SatoruGojo")
+
+WARMUP_BYTES = 256 * 1024
+
+
+async def warm_url(session: aiohttp.ClientSession, url: str, timeout: float = 10.0) -> Optional[float]:
+    # Pull the first chunk so DNS, TCP/TLS and the CDN edge cache are hot before FFmpeg connects.
+    if not url or not url.startswith(("http://", "https://")):
+        return None
+    started = time.perf_counter()
+    try:
+        async with session.get(
+            url,
+            headers={"Range": f"bytes=0-{WARMUP_BYTES - 1}"},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            if resp.status >= 400:
+                logger.warning(f"Warm-up got HTTP {resp.status} for {url[:80]}")
+                return None
+            await resp.content.read(WARMUP_BYTES)
+    except Exception as e:
+        logger.warning(f"Warm-up failed for {url[:80]}: {e}")
+        return None
+    return time.perf_counter() - started
+
+
+class Prefetcher:
+    """Keeps the next few entries of every chat queue ready to play.
+
+    A failed prefetch is retried with exponential backoff, from ``backoff``
+    up to ``max_backoff`` seconds, instead of on every poke.
+    """
+
+    def __init__(self, queues, prepare: Callable[..., Awaitable], lookahead: int = 2, interval: float = 30.0,
+                 backoff: float = 15.0, max_backoff: float = 600.0):
+        self.queues = queues
+        self.prepare = prepare
+        self.lookahead = lookahead
+        self.interval = interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._inflight.values()):
+            task.cancel()
+
+    def poke(self):
+        self._wakeup.set()
+
+    async def ensure(self, item: Track):
+        # Join an in-flight prefetch for this item, or prepare it inline. Warming a
+        # connection FFmpeg is about to open anyway would only add latency here.
+        task = self._inflight.get(id(item))
+        if task and await task:
+            return
+        await self.prepare(item, warm=False)
+
+    async def _run(self):
+        while True:
+            try:
+                self._schedule()
+            except Exception as e:
+                logger.error(f"Prefetch scan failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _schedule(self):
+        now = time.monotonic()
+        for chat_id, queue in list(self.queues.items()):
+            for item in list(itertools.islice(queue, self.lookahead)):
+                key = id(item)
+                if key in self._inflight or item.prefetch_retry_at > now:
+                    continue
+                task = asyncio.create_task(self._prepare(item))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+
+    async def _prepare(self, item: Track) -> bool:
+        # Failures are recorded on the item, never raised: nobody else awaits this task.
+        try:
+            await self.prepare(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            item.prefetch_failures += 1
+            delay = min(self.backoff * 2 ** (item.prefetch_failures - 1), self.max_backoff)
+            item.prefetch_retry_at = time.monotonic() + delay
+            logger.warning(f"Prefetch failed for {item.title!r} ({e}), retrying in {delay:.0f}s")
+            return False
+        item.prefetch_failures = 0
+        item.prefetch_retry_at = 0.0
+        return True
@@ -0,0 +1,206 @@
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Callable, Awaitable
+
+logger = logging.getLogger("SatoruGojo")
+
+# Stream paths, cheapest first. Reported per track so the CPU savings are visible.
+PATH_COPY = "copy"                  # -c copy, no decode at all
+PATH_COPY_VIDEO = "copy_video"      # video copied, audio transcoded to AAC
+PATH_COPY_AUDIO = "copy_audio"      # audio-only stream, AAC copied
+PATH_ENCODE = "encode"              # full decode + libx264/aac
+PATH_CACHED = "cache"               # pre-encoded rendition from the transcode cache, remux only
+
+COPY_VIDEO_CODECS = ("h264",)
+COPY_PIX_FMTS = ("yuv420p", "yuvj420p")
+BAD_H264_PROFILES = ("High 10", "High 4:2:2", "High 4:4:4 Predictive")
+MAX_COPY_WIDTH, MAX_COPY_HEIGHT = 1920, 1080
+MAX_COPY_FPS = 60
+MAX_COPY_VIDEO_BITRATE = 6_000_000
+MAX_KEYFRAME_INTERVAL = 4.0
+KEYFRAME_PROBE_SECONDS = 12
+
+
+def _parse_rate(rate: Optional[str]) -> float:
+    try:
+        num, _, den = (rate or "0/1").partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+async def _run_ffprobe(args: List[str], timeout: float, data: Optional[bytes] = None) -> Optional[str]:
+    # With ``data`` the input is those bytes on pipe:0, usually the head of a file still being fetched.
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", *args,
+        stdin=asyncio.subprocess.DEVNULL if data is None else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(data), timeout=timeout)
+    except asyncio.TimeoutError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        return None
+    # A head is truncated by design, so running into its end is not a failure if something was read.
+    if process.returncode != 0 and (data is None or not stdout):
+        return None
+    return stdout.decode("utf-8", "replace")
+
+
+async def probe_streams(source: str, timeout: float = 8.0, data: Optional[bytes] = None) -> Optional[dict]:
+    output = await _run_ffprobe(
+        ["-print_format", "json", "-show_streams", "-show_format", source], timeout, data
+    )
+    if not output:
+        return None
+    try:
+        return json.loads(output)
+    except ValueError:
+        return None
+
+
+async def probe_keyframe_interval(source: str, timeout: float = 8.0, data: Optional[bytes] = None) -> Optional[float]:
+    output = await _run_ffprobe(
+        [
+            "-select_streams", "v:0", "-skip_frame", "nokey",
+            "-show_entries", "frame=pts_time", "-of", "csv=p=0",
+            "-read_intervals", f"%+{KEYFRAME_PROBE_SECONDS}",
+            source,
+        ],
+        timeout,
+        data,
+    )
+    if output is None:
+        return None
+    times = []
+    for line in output.splitlines():
+        try:
+            times.append(float(line.strip().strip(",")))
+        except ValueError:
+            continue
+    if len(times) < 2:
+        return float(KEYFRAME_PROBE_SECONDS)
+    times.sort()
+    return max(b - a for a, b in zip(times, times[1:]))
+
+
+def _first_stream(info: dict, codec_type: str) -> Optional[dict]:
+    for stream in info.get("streams", []):
+        if stream.get("codec_type") == codec_type and not stream.get("disposition", {}).get("attached_pic"):
+            return stream
+    return None
+
+
+def video_copyable(stream: Optional[dict], keyframe_interval: Optional[float],
+                   max_size: Tuple[int, int] = (MAX_COPY_WIDTH, MAX_COPY_HEIGHT),
+                   max_bitrate: int = MAX_COPY_VIDEO_BITRATE) -> Tuple[bool, str]:
+    # max_size and max_bitrate come from the chat's profile: copying must never send more than it asked for.
+    if not stream:
+        return False, "no video"
+    if stream.get("codec_name") not in COPY_VIDEO_CODECS:
+        return False, f"codec {stream.get('codec_name')}"
+    if stream.get("pix_fmt") not in COPY_PIX_FMTS:
+        return False, f"pix_fmt {stream.get('pix_fmt')}"
+    if stream.get("profile") in BAD_H264_PROFILES:
+        return False, f"profile {stream.get('profile')}"
+    width, height = int(stream.get("width") or 0), int(stream.get("height") or 0)
+    max_width, max_height = min(max_size[0], MAX_COPY_WIDTH), min(max_size[1], MAX_COPY_HEIGHT)
+    if not width or not height or width > max_width or height > max_height:
+        return False, f"resolution {width}x{height}"
+    fps = _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate"))
+    if fps > MAX_COPY_FPS:
+        return False, f"fps {fps:.0f}"
+    bitrate = int(stream.get("bit_rate") or 0)
+    if bitrate > min(max_bitrate, MAX_COPY_VIDEO_BITRATE):
+        return False, f"bitrate {bitrate // 1000}k"
+    if keyframe_interval is None or keyframe_interval > MAX_KEYFRAME_INTERVAL:
+        return False, f"gop {keyframe_interval}s"
+    return True, "ok"
+
+
+def audio_copyable(stream: Optional[dict]) -> bool:
+    if not stream or stream.get("codec_name") != "aac":
+        return False
+    if int(stream.get("channels") or 0) > 2:
+        return False
+    return int(stream.get("sample_rate") or 0) in (44100, 48000)
+
+
+class ProbeCache:
+    """Caches ffprobe results per file (keyed with size/mtime) or per URL."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Tuple[str, str]]" = OrderedDict()
+        self._inflight = {}
+
+    @staticmethod
+    def _key(source: str, *args) -> tuple:
+        try:
+            st = os.stat(source)
+            return (source, st.st_size, st.st_mtime) + args
+        except OSError:
+            return (source, None, None) + args
+
+    async def choose_path(self, source: str, audio_only: bool = False,
+                          max_size: Tuple[int, int] = (MAX_COPY_WIDTH, MAX_COPY_HEIGHT),
+                          max_bitrate: int = MAX_COPY_VIDEO_BITRATE) -> Tuple[str, str]:
+        key = self._key(source, audio_only, tuple(max_size), max_bitrate)
+        return await self._cached(key, lambda: _choose_path(source, audio_only, max_size, max_bitrate))
+
+    async def choose_head_path(self, name: str, head: bytes, audio_only: bool = False,
+                               max_size: Tuple[int, int] = (MAX_COPY_WIDTH, MAX_COPY_HEIGHT),
+                               max_bitrate: int = MAX_COPY_VIDEO_BITRATE) -> Tuple[str, str]:
+        # For inputs that only exist as a pipe: probes the first bytes, cached under ``name``.
+        key = ("head", name, audio_only, tuple(max_size), max_bitrate)
+        return await self._cached(key, lambda: _choose_path("pipe:0", audio_only, max_size, max_bitrate, head))
+
+    async def _cached(self, key: tuple, choose: Callable[[], Awaitable[Tuple[str, str]]]) -> Tuple[str, str]:
+        cached = self._entries.get(key)
+        if cached:
+            self._entries.move_to_end(key)
+            return cached
+        task = self._inflight.get(key)
+        if not task:
+            task = self._inflight[key] = asyncio.create_task(choose())
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        result = await asyncio.shield(task)
+        self._entries[key] = result
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+
+async def _choose_path(source: str, audio_only: bool, max_size: Tuple[int, int],
+                       max_bitrate: int, head: Optional[bytes] = None) -> Tuple[str, str]:
+    try:
+        info = await probe_streams(source, data=head)
+    except Exception as e:
+        logger.warning(f"ffprobe failed for {source[:80]}: {e}")
+        info = None
+    if not info:
+        return PATH_ENCODE, "probe failed"
+    audio = _first_stream(info, "audio")
+    if audio_only:
+        if audio_copyable(audio):
+            return PATH_COPY_AUDIO, "aac"
+        return PATH_ENCODE, f"audio {audio.get('codec_name') if audio else 'missing'}"
+    video = _first_stream(info, "video")
+    if not video or video.get("codec_name") not in COPY_VIDEO_CODECS:
+        _, reason = video_copyable(video, None)
+        return PATH_ENCODE, reason
+    keyframe_interval = await probe_keyframe_interval(source, data=head)
+    ok, reason = video_copyable(video, keyframe_interval, max_size, max_bitrate)
+    if not ok:
+        return PATH_ENCODE, reason
+    if audio_copyable(audio):
+        return PATH_COPY, "h264/aac"
+    return PATH_COPY_VIDEO, f"h264/{audio.get('codec_name') if audio else 'no audio'}"
@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict
+
+from ffmpeg_cmd import build_publisher, DEFAULT_PROFILE
+from telemetry import ProgressStats, with_progress, follow_progress
+
+logger = logging.getLogger("SatoruGojo")
+
+
+class Publisher:
+    """One long-lived FFmpeg per chat holding the encoder and the RTMP session.
+
+    Track feeders write MPEG-TS into ``write_fd``; the pipe stays open between
+    tracks so the publisher never sees EOF until the session is closed.
+    """
+
+    def __init__(self, chat_id: int, url: str, profile: str = DEFAULT_PROFILE):
+        self.chat_id = chat_id
+        self.url = url
+        self.profile = profile
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.write_fd: Optional[int] = None
+        self.started_at = time.monotonic()
+        self.progress = ProgressStats()
+        self._watcher: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.process and self.process.returncode is None)
+
+    def elapsed(self) -> float:
+        # Feeders offset their timestamps by wall time so the publisher sees one continuous timeline.
+        return time.monotonic() - self.started_at
+
+    def command(self):
+        return build_publisher(self.url, self.profile)
+
+    async def start(self):
+        read_fd, write_fd = os.pipe()
+        command, progress_fd, progress_write_fd = with_progress(self.command())
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *command, stdin=read_fd, pass_fds=(progress_write_fd,)
+            )
+        except Exception:
+            os.close(write_fd)
+            os.close(progress_fd)
+            raise
+        finally:
+            os.close(read_fd)
+            os.close(progress_write_fd)
+        self.write_fd = write_fd
+        asyncio.create_task(follow_progress(progress_fd, self.progress))
+        self.started_at = time.monotonic()
+        self._watcher = asyncio.create_task(self._watch())
+        logger.info(f"Started persistent publisher for chat {self.chat_id}")
+
+    async def _watch(self):
+        returncode = await self.process.wait()
+        logger.info(f"Publisher for chat {self.chat_id} exited with code {returncode}")
+        self._close_pipe()
+
+    def _close_pipe(self):
+        if self.write_fd is not None:
+            try:
+                os.close(self.write_fd)
+            except OSError:
+                pass
+            self.write_fd = None
+
+    async def close(self, timeout: float = 10.0):
+        # Closing the pipe lets FFmpeg flush and end the RTMP session cleanly.
+        self._close_pipe()
+        if not self.alive:
+            return
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+
+
+class PublisherPool:
+    def __init__(self):
+        self.publishers: Dict[int, Publisher] = {}
+
+    def get(self, chat_id: int) -> Optional[Publisher]:
+        publisher = self.publishers.get(chat_id)
+        return publisher if publisher and publisher.alive else None
+
+    async def ensure(self, chat_id: int, url: str, profile: str = DEFAULT_PROFILE) -> Publisher:
+        # A new key or profile needs a new encoder, and so a new RTMP session.
+        publisher = self.publishers.get(chat_id)
+        if publisher and publisher.alive and publisher.url == url and publisher.profile == profile:
+            return publisher
+        if publisher:
+            await publisher.close()
+        publisher = Publisher(chat_id, url, profile)
+        await publisher.start()
+        self.publishers[chat_id] = publisher
+        return publisher
+
+    async def stop(self, chat_id: int):
+        publisher = self.publishers.pop(chat_id, None)
+        if publisher:
+            await publisher.close()
+
+    async def stop_all(self):
+        await asyncio.gather(*(self.stop(chat_id) for chat_id in list(self.publishers)), return_exceptions=True)
@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Tuple, List, Set
+
+logger = logging.getLogger("SatoruGojo")
+
+# Only these fields cross the process boundary; full yt-dlp info dicts are huge.
+RESULT_FIELDS = ("id", "title", "duration", "thumbnail", "webpage_url", "url", "is_live")
+
+# Flat playlist entries YouTube keeps listing but will never play.
+UNAVAILABLE_TITLES = ("[Private video]", "[Deleted video]")
+
+
+class ResolveError(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Worker side: `python resolver.py '<ytdl opts json>'`, one JSON request per line.
+# ---------------------------------------------------------------------------
+
+def _pick_stream_url(info: dict) -> Optional[str]:
+    return info.get("url") or info.get("formats", [{}])[-1].get("url")
+
+
+def _trim(info: dict) -> dict:
+    result = {k: info.get(k) for k in RESULT_FIELDS if info.get(k) is not None}
+    result["url"] = _pick_stream_url(info)
+    return result
+
+
+def _flat_entry(entry: dict) -> dict:
+    thumbnails = entry.get("thumbnails") or [{}]
+    return {
+        "id": entry.get("id"),
+        "title": entry.get("title"),
+        "duration": entry.get("duration"),
+        "thumbnail": entry.get("thumbnail") or thumbnails[-1].get("url"),
+        "webpage_url": entry.get("url") or entry.get("webpage_url"),
+    }
+
+
+def _partial_reporter(protocol, request_id):
+    # Names every file a download writes, so the bot can remove them if it kills this worker.
+    seen = set()
+
+    def hook(progress: dict):
+        for name in (progress.get("filename"), progress.get("tmpfilename")):
+            if name and name not in seen:
+                seen.add(name)
+                protocol.write(json.dumps({"id": request_id, "partial": name}) + "\n")
+    return hook
+
+
+def worker_main(opts: dict):
+    import yt_dlp
+
+    # yt-dlp may print to stdout; keep the protocol channel clean.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    sys.stdout = sys.stderr
+
+    audio_opts = dict(opts, format="bestaudio/best")
+    video_opts = dict(opts, format="bestvideo+bestaudio/best")
+    # Warm instances: extractor registry, cookie jar and HTTP session are reused across jobs.
+    ydls = {False: yt_dlp.YoutubeDL(audio_opts), True: yt_dlp.YoutubeDL(video_opts)}
+    # Flat listing only touches the playlist pages, never the per-video player responses.
+    flat = yt_dlp.YoutubeDL(dict(opts, extract_flat="in_playlist", noplaylist=False))
+
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        response = {"id": request.get("id")}
+        try:
+            if request["op"] == "extract":
+                info = ydls[bool(request.get("video"))].extract_info(request["query"], download=False)
+                if "entries" in info and info["entries"]:
+                    info = info["entries"][0]
+                response["info"] = _trim(info)
+            elif request["op"] == "playlist":
+                flat.params["playlist_items"] = f"{request['start']}-{request['end']}"
+                info = flat.extract_info(request["query"], download=False)
+                entries = [
+                    _flat_entry(entry) for entry in info.get("entries") or []
+                    if entry and entry.get("id") and entry.get("title") not in UNAVAILABLE_TITLES
+                ]
+                response["playlist"] = {
+                    "id": info.get("id"),
+                    "title": info.get("title"),
+                    "count": info.get("playlist_count"),
+                    "fetched": len(info.get("entries") or []),
+                    "entries": entries,
+                }
+            elif request["op"] == "download":
+                download_opts = dict(opts, format=video_opts["format"] if request.get("video") else audio_opts["format"])
+                download_opts.update(request.get("opts") or {})
+                download_opts["progress_hooks"] = [_partial_reporter(protocol, request.get("id"))]
+                with yt_dlp.YoutubeDL(download_opts) as ydl:
+                    info = ydl.extract_info(request["query"], download=True)
+                    if "entries" in info and info["entries"]:
+                        info = info["entries"][0]
+                    response["path"] = ydl.prepare_filename(info)
+                response["info"] = _trim(info)
+            else:
+                raise ValueError(f"unknown op {request['op']!r}")
+        except Exception as e:
+            response["error"] = str(e) or e.__class__.__name__
+        protocol.write(json.dumps(response) + "\n")
+
+
+# ---------------------------------------------------------------------------
+# Bot side.
+# ---------------------------------------------------------------------------
+
+class _Worker:
+    def __init__(self, index: int, opts: dict):
+        self.index = index
+        self.opts = opts
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.jobs_done = 0
+        self.partials: Set[str] = set()
+        self._next_id = 0
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.process and self.process.returncode is None)
+
+    async def spawn(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), json.dumps(self.opts),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=1024 * 1024,
+        )
+        self.jobs_done = 0
+        logger.info(f"Resolver worker {self.index} started (pid {self.process.pid})")
+
+    async def call(self, request: dict, timeout: float) -> dict:
+        if not self.alive:
+            await self.spawn()
+        self._next_id += 1
+        self.partials.clear()
+        request = dict(request, id=self._next_id)
+        self.process.stdin.write((json.dumps(request) + "\n").encode())
+        await self.process.stdin.drain()
+        # One deadline for the whole call: progress lines must not keep extending it.
+        deadline = asyncio.get_event_loop().time() + timeout
+        while True:
+            remaining = deadline - asyncio.get_event_loop().time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout=remaining)
+            if not line:
+                raise ResolveError("resolver worker exited")
+            response = json.loads(line)
+            if response.get("id") != request["id"]:
+                continue
+            if "partial" in response:
+                self.partials.add(response["partial"])
+                continue
+            self.jobs_done += 1
+            return response
+
+    def remove_partials(self):
+        for name in self.partials:
+            for path in (name, f"{name}.part", f"{name}.ytdl"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                else:
+                    logger.info(f"Removed partial download {path}")
+        self.partials.clear()
+
+    async def retire(self, kill: bool = False):
+        process, self.process = self.process, None
+        if not process or process.returncode is not None:
+            return
+        try:
+            if kill:
+                process.kill()
+            else:
+                process.stdin.close()
+            await asyncio.wait_for(process.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+
+class ResolverPool:
+    """A few long-lived yt-dlp worker processes behind one request queue.
+
+    Extraction is CPU-heavy Python that holds the GIL; running it in worker
+    processes keeps the bot's event loop responsive under bursts. Identical
+    in-flight queries share one extraction, every request has a deadline
+    (a worker that misses it is killed and replaced), and workers are
+    recycled after ``max_jobs`` requests to cap memory growth. Downloads
+    get the longer ``download_timeout``, and whatever a killed download
+    had written is removed.
+    """
+
+    def __init__(self, opts: dict, size: int = 2, max_jobs: int = 100, timeout: float = 45.0,
+                 download_timeout: float = 300.0):
+        self.opts = opts
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.download_timeout = download_timeout
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._workers: List[_Worker] = []
+        self._tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.deduplicated = 0
+        self.latencies: List[float] = []
+
+    async def start(self):
+        for index in range(self.size):
+            worker = _Worker(index, self.opts)
+            self._workers.append(worker)
+            self._tasks.append(asyncio.create_task(self._serve(worker)))
+        await asyncio.gather(*(w.spawn() for w in self._workers), return_exceptions=True)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(w.retire() for w in self._workers), return_exceptions=True)
+        self._tasks.clear()
+        self._workers.clear()
+
+    async def _serve(self, worker: _Worker):
+        while True:
+            request, future, enqueued_at = await self._queue.get()
+            if future.done():
+                continue
+            timeout = self.download_timeout if request["op"] == "download" else self.timeout
+            try:
+                response = await worker.call(request, timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                future.set_exception(ResolveError(f"resolver timed out after {timeout:.0f}s"))
+                await self._replace(worker, kill=True)
+                continue
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(ResolveError(str(e)))
+                await self._replace(worker, kill=True)
+                continue
+            self.latencies = (self.latencies + [time.monotonic() - enqueued_at])[-200:]
+            if "error" in response:
+                self.failed += 1
+                future.set_exception(ResolveError(response["error"]))
+            else:
+                self.completed += 1
+                future.set_result(response)
+            if worker.jobs_done >= self.max_jobs:
+                logger.info(f"Recycling resolver worker {worker.index} after {worker.jobs_done} jobs")
+                await self._replace(worker)
+
+    async def _replace(self, worker: _Worker, kill: bool = False):
+        # Respawn right away so the next request finds a warm YoutubeDL.
+        await worker.retire(kill=kill)
+        if kill:
+            worker.remove_partials()
+        try:
+            await worker.spawn()
+        except Exception as e:
+            logger.error(f"Failed to respawn resolver worker {worker.index}: {e}")
+
+    async def _submit(self, key: Tuple, request: dict) -> dict:
+        future = self._inflight.get(key)
+        if future:
+            self.deduplicated += 1
+        else:
+            future = asyncio.get_event_loop().create_future()
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self._queue.put_nowait((request, future, time.monotonic()))
+        return await asyncio.shield(future)
+
+    async def extract(self, query: str, video: bool = False) -> dict:
+        response = await self._submit(("extract", query, video), {"op": "extract", "query": query, "video": video})
+        return dict(response["info"])
+
+    async def playlist(self, query: str, start: int = 1, end: int = 100) -> dict:
+        # Pages are 1-based and inclusive, matching yt-dlp's playlist_items.
+        request = {"op": "playlist", "query": query, "start": start, "end": end}
+        response = await self._submit(("playlist", query, start, end), request)
+        return response["playlist"]
+
+    async def download(self, query: str, video: bool = False, opts: Optional[dict] = None) -> Tuple[str, dict]:
+        request = {"op": "download", "query": query, "video": video, "opts": opts or {}}
+        response = await self._submit(("download", query, video), request)
+        return response["path"], dict(response["info"])
+
+    def stats(self) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "workers": sum(1 for w in self._workers if w.alive),
+            "queued": self._queue.qsize(),
+            "inflight": len(self._inflight),
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "deduplicated": self.deduplicated,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    worker_main(json.loads(sys.argv[1]) if len(sys.argv) > 1 else {})
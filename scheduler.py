@@ -0,0 +1,206 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Callable, List, Any
+
+logger = logging.getLogger("SatoruGojo")
+
+# Rough CPU cores per stream on a typical VPS core.
+KIND_ENCODE_HIGH = "encode_high"  # 1080p30 libx264 veryfast + aac
+KIND_ENCODE = "encode"          # 720p30 libx264 superfast + aac
+KIND_ENCODE_LOW = "encode_low"  # 480p libx264 ultrafast + aac
+KIND_AUDIO = "audio"            # aac only
+KIND_COPY = "copy"              # remux, at most an audio transcode
+KIND_GAPLESS = "gapless"        # feeder decode + publisher encode
+
+COSTS = {
+    KIND_ENCODE_HIGH: 2.4,
+    KIND_ENCODE: 1.0,
+    KIND_ENCODE_LOW: 0.45,
+    KIND_AUDIO: 0.1,
+    KIND_COPY: 0.05,
+    KIND_GAPLESS: 1.3,
+}
+
+# What each kind can fall back to under pressure.
+CHEAPER = {KIND_ENCODE_HIGH: KIND_ENCODE, KIND_ENCODE: KIND_ENCODE_LOW}
+
+FAIRNESS_WINDOW = 600
+
+
+@dataclass
+class Ticket:
+    chat_id: int
+    kind: str
+    cost: float
+    granted_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Waiter:
+    chat_id: int
+    kind: str
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class EncodeScheduler:
+    """Admits FFmpeg jobs against a CPU core budget, fairly across chats.
+
+    Pending starts are ordered by how many starts each chat was granted in
+    the last ``FAIRNESS_WINDOW`` seconds, then by arrival, so a chat spamming
+    /skip cannot keep jumping ahead of chats that are waiting for their
+    first track. When the budget is exhausted, new encodes are admitted at
+    the cheaper kind, and ``downgrade`` is asked to move a running encode
+    down a step to make room. An encode shared between chats holds its
+    ticket under its own key (``share``) rather than under any one chat,
+    since it keeps running as long as any chat relays it.
+    """
+
+    def __init__(self, core_budget: float, max_wait: float = 60.0,
+                 downgrade: Optional[Callable[[Ticket], bool]] = None):
+        self.core_budget = core_budget
+        self.max_wait = max_wait
+        self.downgrade = downgrade
+        self.active: Dict[int, Ticket] = {}
+        self.shared: Dict[Any, Ticket] = {}
+        self._waiters: List[_Waiter] = []
+        self._grants: Dict[int, deque] = defaultdict(deque)
+        self.degraded = 0
+        self.overcommitted = 0
+
+    def load(self) -> float:
+        return sum(ticket.cost for ticket in self.active.values()) + sum(t.cost for t in self.shared.values())
+
+    def _fits(self, kind: str) -> bool:
+        return self.load() + COSTS[kind] <= self.core_budget
+
+    def _recent_grants(self, chat_id: int) -> int:
+        grants = self._grants[chat_id]
+        cutoff = time.monotonic() - FAIRNESS_WINDOW
+        while grants and grants[0] < cutoff:
+            grants.popleft()
+        return len(grants)
+
+    def _grant(self, chat_id: int, kind: str) -> Ticket:
+        ticket = Ticket(chat_id, kind, COSTS[kind])
+        self.active[chat_id] = ticket
+        self._grants[chat_id].append(ticket.granted_at)
+        return ticket
+
+    def _try_admit(self, chat_id: int, kind: str) -> Optional[Ticket]:
+        if self._fits(kind):
+            return self._grant(chat_id, kind)
+        cheaper = CHEAPER.get(kind)
+        if cheaper and self._fits(cheaper):
+            self.degraded += 1
+            logger.info(f"Admitting chat {chat_id} as {cheaper} instead of {kind} (load {self.load():.2f}/{self.core_budget})")
+            return self._grant(chat_id, cheaper)
+        return None
+
+    async def admit(self, chat_id: int, kind: str, force: bool = False) -> Ticket:
+        # A chat only ever runs one job, so a new admission replaces its old ticket.
+        self.active.pop(chat_id, None)
+        if force:
+            return self._grant(chat_id, kind)
+        if not self._waiters:
+            ticket = self._try_admit(chat_id, kind)
+            if ticket:
+                return ticket
+        waiter = _Waiter(chat_id, kind, asyncio.get_event_loop().create_future())
+        self._waiters.append(waiter)
+        self._dispatch()
+        self._make_room(waiter)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return waiter.future.result()
+            # Never drop a track: start it on the cheapest variant even if that overcommits.
+            self._waiters.remove(waiter)
+            self.overcommitted += 1
+            kind = CHEAPER.get(kind, kind)
+            logger.warning(f"Admission wait timed out for chat {chat_id}, overcommitting as {kind}")
+            return self._grant(chat_id, kind)
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            raise
+
+    def retag(self, ticket: Ticket, kind: str):
+        if self.active.get(ticket.chat_id) is ticket:
+            ticket.kind = kind
+            ticket.cost = COSTS[kind]
+            self._dispatch()
+
+    def fits_instead(self, ticket: Ticket, kind: str) -> bool:
+        # Would swapping this ticket's kind stay within budget without starving anyone waiting?
+        current = ticket.cost if self.active.get(ticket.chat_id) is ticket else 0.0
+        return not self._waiters and self.load() - current + COSTS[kind] <= self.core_budget
+
+    def share(self, ticket: Ticket, key: Any) -> Ticket:
+        # The admitted cost moves to ``key`` until release_shared(key); the chat keeps a relay's copy ticket.
+        if self.active.get(ticket.chat_id) is ticket:
+            del self.active[ticket.chat_id]
+        self.shared[key] = ticket
+        relay = Ticket(ticket.chat_id, KIND_COPY, COSTS[KIND_COPY])
+        self.active[ticket.chat_id] = relay
+        return relay
+
+    def release_shared(self, key: Any):
+        if self.shared.pop(key, None):
+            self._dispatch()
+
+    def release(self, ticket: Optional[Ticket]):
+        if ticket and self.active.get(ticket.chat_id) is ticket:
+            del self.active[ticket.chat_id]
+            self._dispatch()
+
+    def _make_room(self, waiter: _Waiter):
+        if not self.downgrade:
+            return
+        candidates = sorted(
+            (t for t in self.active.values() if t.kind in CHEAPER),
+            key=lambda t: t.granted_at,
+        )
+        for ticket in candidates:
+            # retag() dispatches, so stop as soon as the waiter got its slot.
+            if waiter.future.done():
+                break
+            if self.downgrade(ticket):
+                logger.info(f"Downgrading running stream in chat {ticket.chat_id} to {CHEAPER[ticket.kind]}")
+                self.degraded += 1
+                self.retag(ticket, CHEAPER[ticket.kind])
+
+    def _dispatch(self):
+        if not self._waiters:
+            return
+        self._waiters.sort(key=lambda w: (self._recent_grants(w.chat_id), w.queued_at))
+        for waiter in list(self._waiters):
+            if waiter.future.done():
+                self._waiters.remove(waiter)
+                continue
+            ticket = self._try_admit(waiter.chat_id, waiter.kind)
+            if ticket:
+                self._waiters.remove(waiter)
+                waiter.future.set_result(ticket)
+
+    def stats(self) -> Dict[str, float]:
+        kinds: Dict[str, int] = defaultdict(int)
+        for ticket in self.active.values():
+            kinds[ticket.kind] += 1
+        for ticket in self.shared.values():
+            kinds[ticket.kind] += 1
+        return {
+            "load": self.load(),
+            "budget": self.core_budget,
+            "pending": len(self._waiters),
+            "shared": len(self.shared),
+            "degraded": self.degraded,
+            "overcommitted": self.overcommitted,
+            **{f"active_{kind}": count for kind, count in kinds.items()},
+        }
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import bisect
+import signal
+import asyncio
+import hashlib
+import logging
+from typing import Optional, Dict, List, Set, Iterable, Callable, Awaitable, Any
+
+logger = logging.getLogger("SatoruGojo")
+
+# Set on the worker processes the coordinator spawns; holds the worker's index.
+SHARD_ENV = "SATORU_SHARD"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring over worker indexes.
+
+    Each node owns ``replicas`` points, so chats spread evenly and removing
+    a node only moves the chats that node owned.
+    """
+
+    def __init__(self, nodes: Iterable[int] = (), replicas: int = 64):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: Dict[int, int] = {}
+        for node in nodes:
+            self.add(node)
+
+    def __contains__(self, node: int) -> bool:
+        return node in self._owners.values()
+
+    def add(self, node: int):
+        for replica in range(self.replicas):
+            point = _hash(f"{node}:{replica}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+
+    def remove(self, node: int):
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: self._owners[point] for point in self._points}
+
+    def node_for(self, key: Any) -> Optional[int]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+# ---------------------------------------------------------------------------
+# Worker side: requests arrive as JSON lines on stdin, replies leave on stdout.
+# ---------------------------------------------------------------------------
+
+class WorkerLink:
+    """A shard worker's pipe to its coordinator."""
+
+    def __init__(self, handle: Callable[[dict], Awaitable[Any]], heartbeat: float = 5.0):
+        self.handle = handle
+        self.heartbeat = heartbeat
+        self.closed = asyncio.Event()
+        self._transport = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        # FFmpeg and resolver children inherit fds 0 and 1; keep both out of the protocol.
+        in_fd, out_fd = os.dup(0), os.dup(1)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(2, 1)
+        reader = asyncio.StreamReader(limit=1024 * 1024)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(in_fd, "rb", 0))
+        self._transport, _ = await loop.connect_write_pipe(asyncio.Protocol, os.fdopen(out_fd, "wb", 0))
+        self._tasks = [asyncio.create_task(self._read(reader)), asyncio.create_task(self._beat())]
+        self.send({"op": "ready"})
+
+    def send(self, message: dict):
+        if self._transport and not self._transport.is_closing():
+            self._transport.write((json.dumps(message) + "\n").encode())
+
+    async def _read(self, reader: asyncio.StreamReader):
+        async for line in reader:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            asyncio.create_task(self._handle(request))
+        # EOF: the coordinator is gone, so nobody can route to this worker any more.
+        self.closed.set()
+
+    async def _handle(self, request: dict):
+        try:
+            await self.handle(request)
+        except Exception as e:
+            logger.error(f"Shard request {request.get('op')!r} failed: {e}")
+
+    async def _beat(self):
+        while True:
+            self.send({"op": "ping"})
+            await asyncio.sleep(self.heartbeat)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._transport:
+            self._transport.close()
+
+
+# ---------------------------------------------------------------------------
+# Coordinator side.
+# ---------------------------------------------------------------------------
+
+class _Shard:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.chats: Set[int] = set()
+        self.ready = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.process and self.process.returncode is None and self.ready.is_set())
+
+    def send(self, message: dict):
+        self.process.stdin.write((json.dumps(message) + "\n").encode())
+
+    def kill_group(self, sig: int = signal.SIGKILL):
+        # Workers lead their own session, so this also reaches FFmpeg children they leave behind.
+        try:
+            os.killpg(self.process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class Coordinator:
+    """Runs ``count`` worker processes and routes every chat to one of them.
+
+    A chat is placed on the consistent hash ring the first time it is seen,
+    then stays with that worker for as long as the worker lives. When a
+    worker exits or misses heartbeats for ``heartbeat_timeout`` seconds,
+    its process group is killed so no orphaned FFmpeg keeps publishing.
+    Its chats are re-placed on the ring without it, and each new owner is
+    told to ``adopt`` them from the shared state store. The worker is
+    respawned after ``restart_delay`` seconds and takes new chats again.
+    """
+
+    def __init__(self, count: int, command: List[str], heartbeat_timeout: float = 30.0,
+                 restart_delay: float = 5.0, ready_timeout: float = 60.0):
+        self.command = command
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_delay = restart_delay
+        self.ready_timeout = ready_timeout
+        self.shards = {index: _Shard(index) for index in range(count)}
+        self.ring = HashRing()
+        self.assignments: Dict[int, int] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self.routed = 0
+        self.failovers = 0
+        self.rebalanced = 0
+
+    async def start(self):
+        for shard in self.shards.values():
+            self._tasks.append(asyncio.create_task(self._supervise(shard)))
+        self._tasks.append(asyncio.create_task(self._monitor()))
+        waits = [asyncio.create_task(shard.ready.wait()) for shard in self.shards.values()]
+        done, pending = await asyncio.wait(waits, timeout=self.ready_timeout)
+        for task in pending:
+            task.cancel()
+        logger.info(f"{len(done)}/{len(self.shards)} shard workers ready")
+
+    async def stop(self, timeout: float = 20.0):
+        self._stopping = True
+        for shard in self.shards.values():
+            if shard.process and shard.process.returncode is None:
+                # SIGTERM lets the worker stop its streams and flush state before it exits.
+                shard.process.terminate()
+        await asyncio.gather(
+            *(asyncio.wait_for(s.process.wait(), timeout) for s in self.shards.values() if s.process),
+            return_exceptions=True,
+        )
+        for shard in self.shards.values():
+            if shard.process:
+                shard.kill_group()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def owner(self, chat_id: int) -> Optional[_Shard]:
+        index = self.assignments.get(chat_id)
+        if index is None or not self.shards[index].alive:
+            if index is not None:
+                self.shards[index].chats.discard(chat_id)
+            index = self.ring.node_for(chat_id)
+            if index is None:
+                return None
+            self.assignments[chat_id] = index
+            self.shards[index].chats.add(chat_id)
+        return self.shards[index]
+
+    def route(self, chat_id: int, request: dict) -> bool:
+        shard = self.owner(chat_id)
+        if not shard:
+            return False
+        shard.send(request)
+        self.routed += 1
+        return True
+
+    def assign(self, chat_ids: Iterable[int]):
+        placed: Dict[int, List[int]] = {}
+        for chat_id in chat_ids:
+            shard = self.owner(chat_id)
+            if shard:
+                placed.setdefault(shard.index, []).append(chat_id)
+        for index, chats in placed.items():
+            self.shards[index].send({"op": "adopt", "chats": chats})
+        return placed
+
+    async def _supervise(self, shard: _Shard):
+        while not self._stopping:
+            try:
+                shard.process = await asyncio.create_subprocess_exec(
+                    *self.command,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    env=dict(os.environ, **{SHARD_ENV: str(shard.index)}),
+                    start_new_session=True,
+                    limit=1024 * 1024,
+                )
+            except Exception as e:
+                logger.error(f"Failed to start shard worker {shard.index}: {e}")
+                await asyncio.sleep(self.restart_delay)
+                continue
+            shard.last_seen = time.monotonic()
+            logger.info(f"Shard worker {shard.index} started (pid {shard.process.pid})")
+            try:
+                await self._read(shard)
+            finally:
+                shard.kill_group()
+                await shard.process.wait()
+                self._failover(shard)
+            shard.restarts += 1
+            await asyncio.sleep(self.restart_delay)
+
+    async def _read(self, shard: _Shard):
+        async for line in shard.process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            shard.last_seen = time.monotonic()
+            if message.get("op") == "ready" and not shard.ready.is_set():
+                shard.ready.set()
+                self.ring.add(shard.index)
+                logger.info(f"Shard worker {shard.index} joined the ring")
+
+    def _failover(self, shard: _Shard):
+        shard.ready.clear()
+        self.ring.remove(shard.index)
+        # Chats routed elsewhere while this worker was dying already have a new owner.
+        moved = [chat_id for chat_id in shard.chats if self.assignments.get(chat_id) == shard.index]
+        shard.chats = set()
+        for chat_id in moved:
+            del self.assignments[chat_id]
+        if self._stopping:
+            return
+        logger.warning(
+            f"Shard worker {shard.index} exited with code {shard.process.returncode}, "
+            f"moving {len(moved)} chats to the remaining workers"
+        )
+        self.failovers += 1
+        if moved:
+            self.rebalanced += len(moved)
+            self.assign(moved)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_timeout / 3)
+            now = time.monotonic()
+            for shard in self.shards.values():
+                if shard.alive and now - shard.last_seen > self.heartbeat_timeout:
+                    logger.error(f"Shard worker {shard.index} missed heartbeats for {now - shard.last_seen:.0f}s, killing it")
+                    shard.kill_group()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": sum(1 for shard in self.shards.values() if shard.alive),
+            "chats": {index: len(shard.chats) for index, shard in self.shards.items()},
+            "restarts": sum(shard.restarts for shard in self.shards.values()),
+            "routed": self.routed,
+            "failovers": self.failovers,
+            "rebalanced": self.rebalanced,
+        }
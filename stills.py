@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict
+from urllib.parse import urlparse
+
+import aiohttp
+
+from ffmpeg_cmd import build_still_loop
+
+logger = logging.getLogger("SatoruGojo")
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+class StillCache:
+    """Pre-encoded H.264 loops of track thumbnails, one file per image.
+
+    Audio tracks stream their thumbnail by looping one of these with
+    ``-c:v copy`` instead of encoding a picture for the whole track.
+    Remote thumbnails are downloaded first, because FFmpeg only loops
+    images it reads from a file. Renders are shared by every track using
+    the same image. An image that fails to render is not retried for
+    ``retry_after`` seconds, and its tracks fall back to plain audio; at
+    most ``max_failures`` failures are remembered. The oldest loops are
+    removed once there are more than ``max_files``.
+    """
+
+    def __init__(self, root: str = "cache/stills", max_files: int = 512, timeout: float = 30.0,
+                 retry_after: float = 3600.0, max_failures: int = 1024):
+        self.root = root
+        self.max_files = max_files
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.max_failures = max_failures
+        self.rendered = 0
+        self.failed = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._failures: "OrderedDict[str, float]" = OrderedDict()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, image: Optional[str]) -> str:
+        key = hashlib.blake2b(image.encode(), digest_size=12).hexdigest() if image else "blank"
+        return os.path.join(self.root, f"{key}.mp4")
+
+    def lookup(self, image: Optional[str]) -> Optional[str]:
+        path = self.path_for(image)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def ensure(self, session: Optional[aiohttp.ClientSession], image: Optional[str]) -> Optional[asyncio.Task]:
+        path = self.path_for(image)
+        failed_at = self._failures.get(path)
+        if failed_at is not None:
+            if time.monotonic() - failed_at < self.retry_after:
+                return None
+            del self._failures[path]
+        task = self._inflight.get(path)
+        if not task:
+            task = self._inflight[path] = asyncio.create_task(self._render(session, image, path))
+            task.add_done_callback(lambda _: self._inflight.pop(path, None))
+        return task
+
+    async def get(self, session: Optional[aiohttp.ClientSession], image: Optional[str],
+                  wait: float = 3.0) -> Optional[str]:
+        path = self.lookup(image)
+        if path:
+            return path
+        task = self.ensure(session, image)
+        if not task:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=wait)
+        except asyncio.TimeoutError:
+            # Keeps rendering; the next track with this thumbnail gets it.
+            return None
+
+    async def _render(self, session: Optional[aiohttp.ClientSession], image: Optional[str], path: str) -> Optional[str]:
+        if os.path.exists(path):
+            return path
+        downloaded = None
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            if image and image.startswith(("http://", "https://")):
+                image = downloaded = await self._download(session, image, path)
+            elif image and not os.path.exists(image):
+                raise RuntimeError("thumbnail file is gone")
+            process = await asyncio.create_subprocess_exec(
+                *build_still_loop(image, tmp),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise RuntimeError(f"render took over {self.timeout:.0f}s")
+            if process.returncode != 0:
+                lines = stderr.decode(errors="replace").strip().splitlines()
+                raise RuntimeError(lines[-1] if lines else f"exit code {process.returncode}")
+            os.replace(tmp, path)
+        except Exception as e:
+            self.failed += 1
+            self._failures[path] = time.monotonic()
+            self._failures.move_to_end(path)
+            while len(self._failures) > self.max_failures:
+                self._failures.popitem(last=False)
+            logger.warning(f"Could not render still for {(image or 'blank')[:80]}: {e}")
+            return None
+        finally:
+            for leftover in (tmp, downloaded):
+                if leftover and os.path.exists(leftover):
+                    os.remove(leftover)
+        self.rendered += 1
+        self._enforce_limit()
+        return path
+
+    async def _download(self, session: Optional[aiohttp.ClientSession], url: str, path: str) -> str:
+        if not session:
+            raise RuntimeError("no HTTP session")
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        target = f"{path}.image{ext if ext in IMAGE_EXTS else '.jpg'}"
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+        with open(target, "wb") as f:
+            f.write(data)
+        return target
+
+    def _enforce_limit(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".mp4"):
+                full = os.path.join(self.root, name)
+                try:
+                    entries.append((os.path.getmtime(full), full))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, full in entries[:max(len(entries) - self.max_files, 0)]:
+            try:
+                os.remove(full)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rendered": self.rendered,
+            "failed": self.failed,
+        }
@@ -0,0 +1,175 @@
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, List, Tuple, Callable, Set, Any
+
+logger = logging.getLogger("SatoruGojo")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rtmp_keys (
+    chat_id INTEGER PRIMARY KEY,
+    rtmp_key TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queue_items (
+    chat_id INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (chat_id, pos)
+);
+CREATE TABLE IF NOT EXISTS now_playing (
+    chat_id INTEGER PRIMARY KEY,
+    record TEXT NOT NULL,
+    position REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_settings (
+    chat_id INTEGER PRIMARY KEY,
+    settings TEXT NOT NULL
+);
+"""
+
+# (rtmp key, queued records, now-playing record, playback position, per-chat settings)
+ChatSnapshot = Tuple[Optional[str], List[dict], Optional[dict], float, Dict[str, Any]]
+
+
+class StateStore:
+    """SQLite (WAL) persistence for RTMP keys, queues, playback positions and chat settings.
+
+    Callers only mark chats dirty; a background task snapshots those chats
+    on the loop and writes them in one transaction from a worker thread, so
+    a burst of /play commands costs one fsync rather than one per command.
+    Positions of playing chats are refreshed every ``position_interval``
+    with a single-row UPDATE; only dirty chats have their queue rewritten.
+    """
+
+    def __init__(self, path: str, snapshot: Callable[[int], ChatSnapshot],
+                 playing_chats: Callable[[], List[int]], position: Callable[[int], Optional[float]],
+                 flush_interval: float = 1.0, position_interval: float = 5.0):
+        self.path = path
+        self.snapshot = snapshot
+        self.playing_chats = playing_chats
+        self.position = position
+        self.flush_interval = flush_interval
+        self.position_interval = position_interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._last_positions = 0.0
+        self._write_lock = threading.Lock()
+        self.writes = 0
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(SCHEMA)
+
+    def load(self) -> Tuple[Dict[int, str], Dict[int, List[dict]], Dict[int, Tuple[dict, float]], Dict[int, dict]]:
+        keys = {chat_id: key for chat_id, key in self._db.execute("SELECT chat_id, rtmp_key FROM rtmp_keys")}
+        queues: Dict[int, List[dict]] = {}
+        for chat_id, record in self._db.execute("SELECT chat_id, record FROM queue_items ORDER BY chat_id, pos"):
+            queues.setdefault(chat_id, []).append(json.loads(record))
+        playing = {
+            chat_id: (json.loads(record), position)
+            for chat_id, record, position in self._db.execute("SELECT chat_id, record, position FROM now_playing")
+        }
+        settings = {
+            chat_id: json.loads(values)
+            for chat_id, values in self._db.execute("SELECT chat_id, settings FROM chat_settings")
+        }
+        return keys, queues, playing, settings
+
+    def mark(self, chat_id: int):
+        self._dirty.add(chat_id)
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"State flush failed: {e}")
+
+    async def flush(self):
+        if not self._db:
+            return
+        chats = set(self._dirty)
+        self._dirty.clear()
+        positions: Dict[int, float] = {}
+        now = time.monotonic()
+        if now - self._last_positions >= self.position_interval:
+            for chat_id in self.playing_chats():
+                position = None if chat_id in chats else self.position(chat_id)
+                if position is not None:
+                    positions[chat_id] = position
+            self._last_positions = now
+        if not chats and not positions:
+            return
+        snapshots = {chat_id: self.snapshot(chat_id) for chat_id in chats}
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, snapshots, positions)
+        except Exception:
+            self._dirty.update(chats)
+            raise
+
+    def _write(self, snapshots: Dict[int, ChatSnapshot], positions: Optional[Dict[int, float]] = None):
+        with self._write_lock:
+            self._write_locked(snapshots, positions or {})
+
+    def _write_locked(self, snapshots: Dict[int, ChatSnapshot], positions: Dict[int, float]):
+        now = time.time()
+        db = self._db
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "UPDATE now_playing SET position = ?, updated_at = ? WHERE chat_id = ?",
+                [(position, now, chat_id) for chat_id, position in positions.items()],
+            )
+            for chat_id, (key, records, playing, position, settings) in snapshots.items():
+                if key:
+                    db.execute("INSERT OR REPLACE INTO rtmp_keys (chat_id, rtmp_key) VALUES (?, ?)", (chat_id, key))
+                else:
+                    db.execute("DELETE FROM rtmp_keys WHERE chat_id = ?", (chat_id,))
+                db.execute("DELETE FROM queue_items WHERE chat_id = ?", (chat_id,))
+                db.executemany(
+                    "INSERT INTO queue_items (chat_id, pos, record) VALUES (?, ?, ?)",
+                    [(chat_id, pos, json.dumps(record)) for pos, record in enumerate(records)],
+                )
+                if playing:
+                    db.execute(
+                        "INSERT OR REPLACE INTO now_playing (chat_id, record, position, updated_at) VALUES (?, ?, ?, ?)",
+                        (chat_id, json.dumps(playing), position, now),
+                    )
+                else:
+                    db.execute("DELETE FROM now_playing WHERE chat_id = ?", (chat_id,))
+                if settings:
+                    db.execute(
+                        "INSERT OR REPLACE INTO chat_settings (chat_id, settings) VALUES (?, ?)",
+                        (chat_id, json.dumps(settings)),
+                    )
+                else:
+                    db.execute("DELETE FROM chat_settings WHERE chat_id = ?", (chat_id,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self.writes += 1
+
@@ -0,0 +1,75 @@
+import struct
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+logger = logging.getLogger("SatoruGojo")
+
+# pyrogram's stream_media yields 1 MiB chunks, so this is also the read-ahead in MiB.
+DEFAULT_READ_AHEAD = 8
+
+
+def mp4_streamable(head: bytes) -> Optional[bool]:
+    # A pipe is not seekable, so MP4/MOV only works when 'moov' precedes 'mdat' (faststart).
+    # Returns None when the head does not look like an ISO-BMFF file at all.
+    if len(head) < 8 or head[4:8] != b"ftyp":
+        return None
+    pos = 0
+    while pos + 8 <= len(head):
+        size, box = struct.unpack(">I4s", head[pos:pos + 8])
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1 and pos + 16 <= len(head):
+            size = struct.unpack(">Q", head[pos + 8:pos + 16])[0]
+        if size < 8:
+            return None
+        pos += size
+    return None
+
+
+async def pump(chunks: AsyncIterator[bytes], writer: asyncio.StreamWriter, read_ahead: int = DEFAULT_READ_AHEAD):
+    """Copy ``chunks`` into a child's stdin through a bounded buffer.
+
+    The buffer caps how far the download may run ahead of FFmpeg, and
+    ``drain()`` pushes back on the download when FFmpeg (paced by -re) is
+    not consuming, so memory stays at roughly ``read_ahead`` chunks.
+    """
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=read_ahead)
+    written = 0
+
+    async def fill():
+        try:
+            async for chunk in chunks:
+                await buffer.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Media stream source failed after {written} bytes: {e}")
+
+    filler = asyncio.create_task(fill())
+    try:
+        while True:
+            if filler.done() and buffer.empty():
+                break
+            getter = asyncio.ensure_future(buffer.get())
+            if not filler.done():
+                await asyncio.wait({getter, filler}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    continue
+            chunk = await getter
+            writer.write(chunk)
+            await writer.drain()
+            written += len(chunk)
+    except (BrokenPipeError, ConnectionResetError):
+        # FFmpeg closed its stdin: skipped, stopped or failed. Nothing left to feed.
+        pass
+    finally:
+        filler.cancel()
+        try:
+            writer.close()
+        except Exception:
+            pass
+    return written
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Callable, Awaitable, Any
+
+from telemetry import ProgressStats, with_progress, follow_progress
+from track import Track
+
+logger = logging.getLogger("SatoruGojo")
+
+
+def install_child_watcher():
+    # Python < 3.12 defaults to ThreadedChildWatcher, which parks one OS thread
+    # per child process. pidfd watching keeps every FFmpeg wait on the loop itself.
+    if sys.version_info >= (3, 12) or sys.platform != "linux":
+        return
+    watcher_cls = getattr(asyncio, "PidfdChildWatcher", None)
+    if watcher_cls is None:
+        return
+    try:
+        watcher = watcher_cls()
+        asyncio.set_child_watcher(watcher)
+        logger.info("Using pidfd child watcher for FFmpeg processes.")
+    except Exception as e:
+        logger.warning(f"pidfd child watcher unavailable, using default: {e}")
+
+
+@dataclass
+class StreamJob:
+    chat_id: int
+    command: List[str]
+    input_file: Optional[str] = None
+    item: Optional[Track] = None
+    process: Optional[asyncio.subprocess.Process] = None
+    started_at: float = field(default_factory=time.monotonic)
+    returncode: Optional[int] = None
+    stopped: bool = False
+    feed_task: Optional[asyncio.Task] = None
+    progress: ProgressStats = field(default_factory=ProgressStats)
+    progress_task: Optional[asyncio.Task] = None
+
+    @property
+    def runtime(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class FFmpegSupervisor:
+    """Owns every FFmpeg child on the bot's event loop, one job per chat."""
+
+    def __init__(self, stop_timeout: float = 10.0):
+        self.stop_timeout = stop_timeout
+        self.jobs: Dict[int, StreamJob] = {}
+        self._watchers: Dict[int, asyncio.Task] = {}
+        self._locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        return self._locks[chat_id]
+
+    def is_running(self, chat_id: int) -> bool:
+        job = self.jobs.get(chat_id)
+        return bool(job and job.process and job.process.returncode is None)
+
+    def active_chats(self) -> List[int]:
+        return [chat_id for chat_id in self.jobs if self.is_running(chat_id)]
+
+    async def start(
+        self,
+        chat_id: int,
+        command: List[str],
+        input_file: Optional[str] = None,
+        item: Optional[Track] = None,
+        on_finish: Optional[Callable[[StreamJob], Awaitable[Any]]] = None,
+        stdout: Optional[int] = None,
+        feed: Optional[Callable[[asyncio.StreamWriter], Awaitable[Any]]] = None,
+    ) -> StreamJob:
+        await self.stop(chat_id)
+        job = StreamJob(chat_id=chat_id, command=command, input_file=input_file, item=item)
+        logger.info(f"Starting RTMP FFmpeg for chat {chat_id} (cmd len={len(command)})...")
+        command, progress_fd, progress_write_fd = with_progress(command)
+        try:
+            job.process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE if feed else asyncio.subprocess.DEVNULL,
+                stdout=stdout,
+                pass_fds=(progress_write_fd,),
+            )
+        except Exception:
+            os.close(progress_fd)
+            raise
+        finally:
+            os.close(progress_write_fd)
+        job.progress_task = asyncio.create_task(follow_progress(progress_fd, job.progress))
+        if feed:
+            job.feed_task = asyncio.create_task(feed(job.process.stdin))
+        self.jobs[chat_id] = job
+        self._watchers[chat_id] = asyncio.create_task(self._watch(job, on_finish))
+        return job
+
+    async def _watch(self, job: StreamJob, on_finish):
+        try:
+            job.returncode = await job.process.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"FFmpeg error: {e}")
+        if job.feed_task:
+            job.feed_task.cancel()
+        if self.jobs.get(job.chat_id) is job:
+            del self.jobs[job.chat_id]
+            self._watchers.pop(job.chat_id, None)
+        logger.info(
+            f"FFmpeg for chat {job.chat_id} exited with code {job.returncode} "
+            f"after {job.runtime:.1f}s{' (stopped)' if job.stopped else ''}"
+        )
+        if on_finish:
+            try:
+                await on_finish(job)
+            except Exception as e:
+                logger.error(f"on_finish failed for chat {job.chat_id}: {e}")
+
+    async def stop(self, chat_id: int) -> Optional[StreamJob]:
+        job = self.jobs.pop(chat_id, None)
+        watcher = self._watchers.pop(chat_id, None)
+        if not job:
+            return None
+        job.stopped = True
+        if job.feed_task:
+            job.feed_task.cancel()
+        process = job.process
+        if process and process.returncode is None:
+            try:
+                process.terminate()
+                await asyncio.wait_for(process.wait(), timeout=self.stop_timeout)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                logger.warning(f"FFmpeg for chat {chat_id} ignored SIGTERM, killing.")
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+        if watcher:
+            # Let the watcher run its cleanup callback for the stopped job.
+            try:
+                await asyncio.shield(watcher)
+            except Exception:
+                pass
+        return job
+
+    async def stop_all(self):
+        await asyncio.gather(*(self.stop(chat_id) for chat_id in list(self.jobs)), return_exceptions=True)
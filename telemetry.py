@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, List, Tuple, Callable
+
+logger = logging.getLogger("SatoruGojo")
+
+# A chat is flagged when its encoder falls below this multiple of realtime.
+SLOW_SPEED = 0.95
+
+# (name, type, help, [(labels, value), ...])
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _number(value: str) -> Optional[float]:
+    # FFmpeg writes "N/A" until it has a value, and suffixes speed/bitrate with units.
+    value = value.strip().rstrip("x").replace("kbits/s", "")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ProgressStats:
+    """Rolling view of one FFmpeg's ``-progress`` key=value blocks."""
+
+    def __init__(self, window: float = 30.0):
+        self.window = window
+        self.samples: deque = deque()  # (monotonic, fps, speed, bitrate kbit/s)
+        self.fps = 0.0
+        self.speed = 0.0
+        self.bitrate = 0.0
+        self.drop_frames = 0
+        self.dup_frames = 0
+        self.out_time = 0.0
+        self.total_size = 0
+        self.updated_at: Optional[float] = None
+        self.ended = False
+        self._block: Dict[str, str] = {}
+
+    def feed_line(self, line: str):
+        key, sep, value = line.partition("=")
+        if not sep:
+            return
+        if key == "progress":
+            self._commit(self._block, ended=value == "end")
+            self._block = {}
+        else:
+            self._block[key] = value
+
+    def _commit(self, block: Dict[str, str], ended: bool):
+        now = time.monotonic()
+        fps = _number(block.get("fps", ""))
+        speed = _number(block.get("speed", ""))
+        bitrate = _number(block.get("bitrate", ""))
+        if fps is not None:
+            self.fps = fps
+        if speed is not None:
+            self.speed = speed
+        if bitrate is not None:
+            self.bitrate = bitrate
+        self.drop_frames = int(block.get("drop_frames") or self.drop_frames)
+        self.dup_frames = int(block.get("dup_frames") or self.dup_frames)
+        self.total_size = int(_number(block.get("total_size", "")) or self.total_size)
+        # out_time_ms is actually microseconds in every FFmpeg release; prefer the explicit key.
+        out_time_us = _number(block.get("out_time_us") or block.get("out_time_ms") or "")
+        if out_time_us is not None and out_time_us >= 0:
+            self.out_time = out_time_us / 1_000_000
+        self.updated_at = now
+        self.ended = ended
+        self.samples.append((now, self.fps, self.speed, self.bitrate))
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def _average(self, index: int) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(sample[index] for sample in self.samples) / len(self.samples)
+
+    @property
+    def avg_fps(self) -> float:
+        return self._average(1)
+
+    @property
+    def avg_speed(self) -> float:
+        return self._average(2)
+
+    @property
+    def avg_bitrate(self) -> float:
+        return self._average(3)
+
+    @property
+    def below_realtime(self) -> bool:
+        return bool(self.samples) and self.avg_speed < SLOW_SPEED
+
+
+def with_progress(command: List[str]) -> Tuple[List[str], int, int]:
+    """Point ``-progress`` at a dedicated pipe so stdout stays free for media.
+
+    Returns the new command plus the pipe's read and write fds; the write fd
+    must be passed to the child (``pass_fds``) and closed in the parent after
+    the spawn.
+    """
+    read_fd, write_fd = os.pipe()
+    return [command[0], "-progress", f"pipe:{write_fd}", *command[1:]], read_fd, write_fd
+
+
+async def follow_progress(read_fd: int, stats: ProgressStats):
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb", 0)
+    )
+    try:
+        async for raw in reader:
+            stats.feed_line(raw.decode(errors="replace").strip())
+    finally:
+        transport.close()
+
+
+def format_metrics(families: List[MetricFamily]) -> str:
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves ``collect()`` in Prometheus text format on ``/metrics``."""
+
+    def __init__(self, collect: Callable[[], List[MetricFamily]], host: str = "127.0.0.1", port: int = 9464):
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            body=format_metrics(self.collect()).encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
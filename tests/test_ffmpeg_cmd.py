@@ -0,0 +1,29 @@
+import pytest
+
+from ffmpeg_cmd import parse_timestamp, build_ffmpeg_copy
+
+
+@pytest.mark.parametrize("text, seconds", [
+    ("90", 90.0),
+    ("1:30", 90.0),
+    ("01:02:30", 3750.0),
+    ("0:05.5", 5.5),
+    ("0", 0.0),
+])
+def test_parse_timestamp(text, seconds):
+    assert parse_timestamp(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["", "abc", "1:2:3:4", "-5", "1:-30", "1::30", "nan", "inf", "-inf", "1:nan", "Infinity"])
+def test_parse_timestamp_rejects(text):
+    assert parse_timestamp(text) is None
+
+
+def test_seek_goes_before_the_input():
+    command = build_ffmpeg_copy("in.mp4", "rtmp://example/live", seek=75)
+    assert command[command.index("-ss") + 1] == "75.000"
+    assert command.index("-ss") < command.index("-i")
+
+
+def test_no_seek_from_the_start():
+    assert "-ss" not in build_ffmpeg_copy("in.mp4", "rtmp://example/live", seek=0)
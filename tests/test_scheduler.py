@@ -0,0 +1,111 @@
+import asyncio
+
+from scheduler import EncodeScheduler, COSTS, KIND_ENCODE, KIND_ENCODE_LOW, KIND_ENCODE_HIGH, KIND_COPY
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_within_budget():
+    async def main():
+        scheduler = EncodeScheduler(2.0)
+        ticket = await scheduler.admit(1, KIND_ENCODE)
+        assert ticket.kind == KIND_ENCODE
+        assert scheduler.load() == COSTS[KIND_ENCODE]
+    run(main())
+
+
+def test_readmission_replaces_the_chats_ticket():
+    async def main():
+        scheduler = EncodeScheduler(2.0)
+        await scheduler.admit(1, KIND_ENCODE)
+        await scheduler.admit(1, KIND_ENCODE)
+        assert scheduler.load() == COSTS[KIND_ENCODE]
+    run(main())
+
+
+def test_degrades_to_cheaper_kind_when_full():
+    async def main():
+        scheduler = EncodeScheduler(1.5)
+        await scheduler.admit(1, KIND_ENCODE)
+        ticket = await scheduler.admit(2, KIND_ENCODE)
+        assert ticket.kind == KIND_ENCODE_LOW
+        assert scheduler.degraded == 1
+    run(main())
+
+
+def test_waits_for_release_then_admits():
+    async def main():
+        scheduler = EncodeScheduler(1.0)
+        first = await scheduler.admit(1, KIND_ENCODE)
+        waiting = asyncio.create_task(scheduler.admit(2, KIND_ENCODE_HIGH))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        scheduler.release(first)
+        ticket = await asyncio.wait_for(waiting, 1)
+        assert ticket.chat_id == 2 and ticket.kind == KIND_ENCODE
+    run(main())
+
+
+def test_overcommits_after_max_wait():
+    async def main():
+        scheduler = EncodeScheduler(1.0, max_wait=0.01)
+        await scheduler.admit(1, KIND_ENCODE)
+        ticket = await scheduler.admit(2, KIND_ENCODE)
+        assert ticket.kind == KIND_ENCODE_LOW
+        assert scheduler.overcommitted == 1
+    run(main())
+
+
+def test_retag_frees_budget_for_waiters():
+    async def main():
+        scheduler = EncodeScheduler(1.1)
+        first = await scheduler.admit(1, KIND_ENCODE)
+        waiting = asyncio.create_task(scheduler.admit(2, KIND_ENCODE))
+        await asyncio.sleep(0)
+        scheduler.retag(first, KIND_COPY)
+        ticket = await asyncio.wait_for(waiting, 1)
+        assert first.cost == COSTS[KIND_COPY]
+        assert ticket.kind == KIND_ENCODE
+    run(main())
+
+
+def test_retag_ignores_replaced_ticket():
+    async def main():
+        scheduler = EncodeScheduler(4.0)
+        old = await scheduler.admit(1, KIND_ENCODE)
+        await scheduler.admit(1, KIND_ENCODE_HIGH)
+        scheduler.retag(old, KIND_COPY)
+        assert scheduler.load() == COSTS[KIND_ENCODE_HIGH]
+    run(main())
+
+
+def test_fair_order_prefers_chats_with_fewer_recent_starts():
+    async def main():
+        scheduler = EncodeScheduler(1.0)
+        for _ in range(3):
+            await scheduler.admit(1, KIND_ENCODE)
+        busy = await scheduler.admit(3, KIND_ENCODE, force=True)
+        spammer = asyncio.create_task(scheduler.admit(1, KIND_ENCODE))
+        await asyncio.sleep(0)
+        newcomer = asyncio.create_task(scheduler.admit(2, KIND_ENCODE))
+        await asyncio.sleep(0)
+        scheduler.release(busy)
+        done, _ = await asyncio.wait({spammer, newcomer}, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+        assert done == {newcomer}
+        spammer.cancel()
+    run(main())
+
+
+def test_shared_ticket_holds_cost_until_encode_exits():
+    async def main():
+        scheduler = EncodeScheduler(4.0)
+        ticket = await scheduler.admit(1, KIND_ENCODE)
+        relay = scheduler.share(ticket, "encode")
+        assert relay.kind == KIND_COPY
+        scheduler.release(relay)
+        assert scheduler.load() == COSTS[KIND_ENCODE]
+        scheduler.release_shared("encode")
+        assert scheduler.load() == 0
+    run(main())
@@ -0,0 +1,41 @@
+from collections import Counter
+
+from shard import HashRing
+
+CHATS = [-1001000000000 - n for n in range(2000)]
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().node_for(123) is None
+
+
+def test_placement_is_deterministic():
+    first, second = HashRing(range(4)), HashRing(range(4))
+    assert [first.node_for(c) for c in CHATS] == [second.node_for(c) for c in CHATS]
+
+
+def test_chats_spread_over_every_node():
+    ring = HashRing(range(4))
+    counts = Counter(ring.node_for(chat) for chat in CHATS)
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > len(CHATS) / 4 / 2
+
+
+def test_removing_a_node_only_moves_its_chats():
+    ring = HashRing(range(4))
+    before = {chat: ring.node_for(chat) for chat in CHATS}
+    ring.remove(2)
+    assert 2 not in ring and 1 in ring
+    for chat, node in before.items():
+        if node != 2:
+            assert ring.node_for(chat) == node
+        else:
+            assert ring.node_for(chat) != 2
+
+
+def test_re_adding_a_node_restores_its_chats():
+    ring = HashRing(range(3))
+    before = {chat: ring.node_for(chat) for chat in CHATS}
+    ring.remove(1)
+    ring.add(1)
+    assert {chat: ring.node_for(chat) for chat in CHATS} == before
@@ -0,0 +1,37 @@
+import struct
+
+from streamfeed import mp4_streamable
+
+
+def box(kind: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+FTYP = box(b"ftyp", b"isom\x00\x00\x02\x00isomiso2")
+
+
+def test_faststart_mp4_is_streamable():
+    assert mp4_streamable(FTYP + box(b"moov", b"\x00" * 32) + box(b"mdat")) is True
+
+
+def test_trailing_moov_is_not_streamable():
+    assert mp4_streamable(FTYP + box(b"free") + box(b"mdat", b"\x00" * 64) + box(b"moov")) is False
+
+
+def test_large_size_box_is_skipped():
+    # size == 1 means a 64-bit size follows the box type.
+    wide = struct.pack(">I4sQ", 1, b"free", 24) + b"\x00" * 8
+    assert mp4_streamable(FTYP + wide + box(b"moov")) is True
+
+
+def test_head_cut_before_either_box_is_unknown():
+    assert mp4_streamable(FTYP + struct.pack(">I4s", 4096, b"free")) is None
+
+
+def test_non_mp4_is_unknown():
+    assert mp4_streamable(b"\x1aE\xdf\xa3" + b"\x00" * 60) is None
+    assert mp4_streamable(b"") is None
+
+
+def test_corrupt_box_size_is_unknown():
+    assert mp4_streamable(FTYP + struct.pack(">I4s", 3, b"free") + box(b"moov")) is None
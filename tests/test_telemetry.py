@@ -0,0 +1,85 @@
+import os
+
+from telemetry import ProgressStats, format_metrics, with_progress
+
+
+def feed(stats: ProgressStats, block: str):
+    for line in block.strip().splitlines():
+        stats.feed_line(line.strip())
+
+
+BLOCK = """
+fps=29.97
+bitrate=1498.3kbits/s
+total_size=1048576
+out_time_us=12500000
+out_time_ms=12500000
+dup_frames=2
+drop_frames=1
+speed=1.02x
+progress=continue
+"""
+
+
+def test_parses_a_progress_block():
+    stats = ProgressStats()
+    feed(stats, BLOCK)
+    assert stats.fps == 29.97
+    assert stats.speed == 1.02
+    assert stats.bitrate == 1498.3
+    assert stats.out_time == 12.5
+    assert stats.total_size == 1048576
+    assert (stats.drop_frames, stats.dup_frames) == (1, 2)
+    assert len(stats.samples) == 1 and not stats.ended
+
+
+def test_nothing_counts_until_the_block_ends():
+    stats = ProgressStats()
+    feed(stats, "fps=30\nspeed=1.0x")
+    assert not stats.samples and stats.fps == 0.0
+
+
+def test_na_values_keep_the_last_reading():
+    stats = ProgressStats()
+    feed(stats, BLOCK)
+    feed(stats, "fps=N/A\nspeed=N/A\nbitrate=N/A\nout_time_us=N/A\nprogress=end")
+    assert stats.fps == 29.97 and stats.speed == 1.02 and stats.out_time == 12.5
+    assert stats.ended
+
+
+def test_averages_and_realtime_flag():
+    stats = ProgressStats()
+    feed(stats, "fps=30\nspeed=1.0x\nbitrate=1000kbits/s\nprogress=continue")
+    feed(stats, "fps=20\nspeed=0.8x\nbitrate=2000kbits/s\nprogress=continue")
+    assert stats.avg_fps == 25
+    assert stats.avg_bitrate == 1500
+    assert abs(stats.avg_speed - 0.9) < 1e-9
+    assert stats.below_realtime
+
+
+def test_old_samples_leave_the_window():
+    stats = ProgressStats(window=0)
+    feed(stats, "speed=0.5x\nprogress=continue")
+    stats.samples[0] = (stats.samples[0][0] - 1, *stats.samples[0][1:])
+    feed(stats, "speed=1.5x\nprogress=continue")
+    assert len(stats.samples) == 1 and stats.avg_speed == 1.5
+
+
+def test_with_progress_adds_a_pipe():
+    command, read_fd, write_fd = with_progress(["ffmpeg", "-i", "in.mp4", "out.flv"])
+    try:
+        assert command == ["ffmpeg", "-progress", f"pipe:{write_fd}", "-i", "in.mp4", "out.flv"]
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_format_metrics():
+    text = format_metrics([
+        ("rtmp_streams", "gauge", "Active streams", [({}, 2)]),
+        ("rtmp_speed", "gauge", "Encoder speed", [({"chat": "-100"}, 1.01)]),
+    ])
+    assert text == (
+        "# HELP rtmp_streams Active streams\n# TYPE rtmp_streams gauge\nrtmp_streams 2\n"
+        "# HELP rtmp_speed Encoder speed\n# TYPE rtmp_speed gauge\nrtmp_speed{chat=\"-100\"} 1.01\n"
+    )
@@ -0,0 +1,83 @@
+from track import Track, TrackQueue
+
+
+def track(title: str, source: str = None, mode: str = "video", **fields) -> Track:
+    return Track(chat_id=1, title=title, kind="url", mode=mode, source=source or f"https://cdn/{title}", **fields)
+
+
+def titles(queue: TrackQueue):
+    return [t.title for t in queue]
+
+
+def test_order_and_pop():
+    queue = TrackQueue()
+    a, b, c = track("a"), track("b"), track("c")
+    queue.extend([a, b])
+    queue.appendleft(c)
+    assert titles(queue) == ["c", "a", "b"]
+    assert queue.peek() is c
+    assert queue.popleft() is c
+    assert len(queue) == 2 and c not in queue
+
+
+def test_remove_and_move_to_front():
+    queue = TrackQueue()
+    a, b, c = track("a"), track("b"), track("c")
+    queue.extend([a, b, c])
+    assert queue.move_to_front(c)
+    assert queue.remove(a)
+    assert titles(queue) == ["c", "b"]
+    assert not queue.remove(a)
+    assert not queue.move_to_front(a)
+
+
+def test_nth_and_page():
+    queue = TrackQueue()
+    queue.extend(track(str(n)) for n in range(25))
+    assert queue.nth(0).title == "0"
+    assert queue.nth(24).title == "24"
+    assert queue.nth(25) is None and queue.nth(-1) is None
+    assert [t.title for t in queue.page(10, 10)] == [str(n) for n in range(10, 20)]
+    assert [t.title for t in queue.page(20, 10)] == [str(n) for n in range(20, 25)]
+
+
+def test_duplicate_keys_are_counted():
+    queue = TrackQueue()
+    first, second = track("a", "https://cdn/x"), track("b", "https://cdn/x")
+    queue.extend([first, second])
+    assert queue.has(first.dedupe_key)
+    queue.remove(first)
+    assert queue.has(first.dedupe_key)
+    queue.popleft()
+    assert not queue.has(first.dedupe_key)
+
+
+def test_same_source_in_another_mode_is_not_a_duplicate():
+    queue = TrackQueue()
+    queue.append(track("a", "https://cdn/x"))
+    assert not queue.has(track("a", "https://cdn/x", mode="audio").dedupe_key)
+
+
+def test_dedupe_key_prefers_cache_key():
+    assert track("a", cache_key="yt-abc").dedupe_key == "video:yt-abc"
+    assert Track(chat_id=1, title="a", kind="url").dedupe_key is None
+    assert not TrackQueue().has(None)
+
+
+def test_clear_returns_the_tracks():
+    queue = TrackQueue()
+    a = track("a")
+    queue.append(a)
+    assert queue.clear() == [a]
+    assert not queue and not queue.has(a.dedupe_key)
+
+
+def test_record_round_trip_keeps_only_persisted_fields():
+    original = track("a", cache_key="yt-abc", media_ref=(1, 2), seek=42.5)
+    original.degraded = True
+    record = original.to_record()
+    assert "degraded" not in record and "id" not in record
+    restored = Track.from_record(dict(record, caption="old field"))
+    assert restored.to_record() == record
+    assert restored.media_ref == (1, 2)
+    assert restored.id != original.id
@@ -0,0 +1,171 @@
+import asyncio
+import itertools
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, Any, Iterator, List
+
+_ids = itertools.count(1)
+
+# Fields that survive a restart; live objects (messages, tasks, tickets) are re-created.
+PERSISTED_FIELDS = (
+    "chat_id", "title", "kind", "mode", "duration_s", "thumbnail", "requester", "query",
+    "source", "expires_at", "cache_key", "input_file", "media_ref", "msg_ref", "profile", "seek",
+)
+
+
+@dataclass(slots=True, eq=False)
+class Track:
+    """One queued track: ids and source references only.
+
+    Captions, Telegram messages and FFmpeg commands are rebuilt from these
+    when the track is about to play, so a long queue costs a few hundred
+    bytes per entry and never holds a stale RTMP key.
+    """
+
+    chat_id: int
+    title: str
+    kind: str  # "telegram", "youtube" or "url"
+    mode: str = "video"  # "video" or "audio"
+    duration_s: Optional[int] = None
+    thumbnail: Optional[str] = None
+    requester: Optional[str] = None
+    query: Optional[str] = None
+    source: Optional[str] = None
+    expires_at: Optional[float] = None
+    cache_key: Optional[str] = None
+    input_file: Optional[str] = None
+    media_ref: Optional[Tuple[int, int]] = None
+    msg_ref: Optional[Tuple[int, int]] = None
+    profile: Optional[str] = None
+    seek: Optional[float] = None
+    # Runtime state below is never persisted.
+    id: int = field(default_factory=lambda: next(_ids))
+    generation: int = 0
+    media_msg: Any = None
+    download_task: Optional[asyncio.Task] = None
+    head_chunk: Optional[bytes] = None
+    stream_ingest: Optional[bool] = None
+    net_ingest: Optional[bool] = None  # None until checked for the current source
+    container: Optional[str] = None
+    path: Optional[str] = None
+    path_reason: Optional[str] = None
+    rendition: Optional[str] = None
+    rendition_tmp: Optional[Tuple[str, str]] = None
+    ticket: Any = None
+    fanout: Any = None
+    warmed_at: float = 0.0
+    prefetch_failures: int = 0
+    prefetch_retry_at: float = 0.0
+    degraded: bool = False
+    restarting: bool = False
+    resuming: bool = False
+    resume_attempts: int = 0
+
+    @property
+    def dedupe_key(self) -> Optional[str]:
+        # The same source as video and as audio are two different requests.
+        key = self.cache_key or self.source or self.query
+        return f"{self.mode}:{key}" if key else None
+
+    def to_record(self) -> dict:
+        record = {}
+        for name in PERSISTED_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                record[name] = value
+        return record
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Track":
+        # Older records carry extra keys (captions, formatted durations); only known fields are kept.
+        values = {name: record[name] for name in PERSISTED_FIELDS if record.get(name) is not None}
+        for name in ("media_ref", "msg_ref"):
+            if name in values:
+                values[name] = tuple(values[name])
+        values.setdefault("title", "Unknown")
+        values.setdefault("kind", "url")
+        return cls(**values)
+
+
+class TrackQueue:
+    """A chat's play queue with O(1) append, pop, remove, move-to-front and duplicate checks."""
+
+    __slots__ = ("_tracks", "_keys")
+
+    def __init__(self):
+        self._tracks: "OrderedDict[int, Track]" = OrderedDict()
+        self._keys: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __bool__(self) -> bool:
+        return bool(self._tracks)
+
+    def __iter__(self) -> Iterator[Track]:
+        return iter(self._tracks.values())
+
+    def __contains__(self, track: Track) -> bool:
+        return self._tracks.get(track.id) is track
+
+    def _add(self, track: Track):
+        self._tracks[track.id] = track
+        if track.dedupe_key:
+            self._keys[track.dedupe_key] += 1
+
+    def _forget(self, track: Track):
+        key = track.dedupe_key
+        if key and self._keys[key] > 1:
+            self._keys[key] -= 1
+        elif key:
+            del self._keys[key]
+
+    def append(self, track: Track):
+        self._add(track)
+
+    def appendleft(self, track: Track):
+        self._add(track)
+        self._tracks.move_to_end(track.id, last=False)
+
+    def extend(self, tracks):
+        for track in tracks:
+            self._add(track)
+
+    def popleft(self) -> Track:
+        _, track = self._tracks.popitem(last=False)
+        self._forget(track)
+        return track
+
+    def peek(self) -> Optional[Track]:
+        return next(iter(self._tracks.values()), None)
+
+    def remove(self, track: Track) -> bool:
+        if self._tracks.get(track.id) is not track:
+            return False
+        del self._tracks[track.id]
+        self._forget(track)
+        return True
+
+    def move_to_front(self, track: Track) -> bool:
+        if self._tracks.get(track.id) is not track:
+            return False
+        self._tracks.move_to_end(track.id, last=False)
+        return True
+
+    def has(self, key: Optional[str]) -> bool:
+        return bool(key) and self._keys[key] > 0
+
+    def nth(self, index: int) -> Optional[Track]:
+        # Positions come from /queue listings; finding one walks, acting on it does not.
+        if index < 0:
+            return None
+        return next(itertools.islice(self._tracks.values(), index, None), None)
+
+    def page(self, start: int, count: int) -> List[Track]:
+        return list(itertools.islice(self._tracks.values(), start, start + count))
+
+    def clear(self) -> List[Track]:
+        tracks = list(self._tracks.values())
+        self._tracks.clear()
+        self._keys.clear()
+        return tracks
@@ -0,0 +1,129 @@
+import os
+import re
+import uuid
+import logging
+import threading
+from typing import Optional, Tuple, Dict
+
+logger = logging.getLogger("SatoruGojo")
+
+PART_SUFFIX = ".part"
+SAFE_KEY_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class RenditionCache:
+    """Disk cache of RTMP-ready FLV renditions keyed by source id and profile.
+
+    Files are written to ``<final>.<random>.part`` while the live encode runs
+    (FFmpeg's tee muxer) and only renamed into place once the track finished
+    cleanly, so a reader never sees a half-written rendition. Recency is
+    tracked through the file mtime, which is bumped on every hit. ``bytes``
+    is the size on disk as of the last store or sweep, so stats never scan.
+    """
+
+    def __init__(self, root: str = "cache/renditions", max_bytes: int = 2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key: str, profile: str) -> str:
+        return os.path.join(self.root, f"{SAFE_KEY_RE.sub('_', key)}.{profile}.flv")
+
+    def lookup(self, key: Optional[str], profile: str) -> Optional[str]:
+        if not key:
+            return None
+        path = self.path_for(key, profile)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def note_play(self, hit: bool):
+        # Counted per played track rather than per lookup, since the prefetcher looks up repeatedly.
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def reserve(self, key: str, profile: str) -> Tuple[str, str]:
+        final = self.path_for(key, profile)
+        return f"{final}.{uuid.uuid4().hex[:8]}{PART_SUFFIX}", final
+
+    def commit(self, tmp_path: str, final_path: str) -> bool:
+        try:
+            if os.path.getsize(tmp_path) == 0:
+                raise OSError("empty rendition")
+            os.replace(tmp_path, final_path)
+        except OSError as e:
+            logger.warning(f"Could not store rendition {final_path}: {e}")
+            self.abort(tmp_path)
+            return False
+        self.stores += 1
+        logger.info(f"Stored rendition {final_path} ({os.path.getsize(final_path) / 1048576:.1f} MiB)")
+        self.enforce_quota()
+        return True
+
+    def abort(self, tmp_path: Optional[str]):
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def enforce_quota(self):
+        with self._lock:
+            entries = sorted(e for e in self._entries() if not e[2].endswith(PART_SUFFIX))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.evictions += 1
+                    logger.info(f"Evicted rendition {path}")
+                except OSError:
+                    pass
+            self.bytes = total
+
+    def cleanup_orphans(self):
+        # Anything still .part at startup belongs to an encode that died with the process.
+        removed = 0
+        for _, _, path in self._entries():
+            if path.endswith(PART_SUFFIX):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} orphaned partial renditions")
+        self.enforce_quota()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
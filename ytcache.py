@@ -0,0 +1,215 @@
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger("SatoruGojo")
+
+YT_ID_RE = re.compile(r"(?:v=|youtu\.be/|shorts/|embed/|live/)([A-Za-z0-9_-]{11})")
+YT_LIST_RE = re.compile(r"[?&]list=([A-Za-z0-9_-]+)")
+EXPIRE_PATH_RE = re.compile(r"/expire/(\d+)")
+
+# Only what the handlers read back; full yt-dlp info dicts are hundreds of KB.
+CACHED_FIELDS = ("id", "title", "duration", "thumbnail", "webpage_url", "url", "is_live")
+
+
+def normalize_query(query: str) -> str:
+    query = " ".join(query.split())
+    match = YT_ID_RE.search(query)
+    if match and ("youtube" in query or "youtu.be" in query):
+        return f"yt:{match.group(1)}"
+    return query.lower()
+
+
+def playlist_id(query: str) -> Optional[str]:
+    # A watch URL that merely carries &list= plays the one video, as before.
+    if "youtube" not in query and "youtu.be" not in query:
+        return None
+    match = YT_LIST_RE.search(query)
+    if not match or YT_ID_RE.search(query):
+        return None
+    return match.group(1)
+
+
+def url_expiry(url: Optional[str]) -> Optional[float]:
+    # googlevideo URLs carry their expiry either as ?expire= or /expire/<ts>/ (manifests).
+    if not url:
+        return None
+    try:
+        params = parse_qs(urlparse(url).query)
+        if "expire" in params:
+            return float(params["expire"][0])
+        match = EXPIRE_PATH_RE.search(url)
+        if match:
+            return float(match.group(1))
+    except Exception:
+        pass
+    return None
+
+
+def trim_info(info: dict) -> dict:
+    return {k: info.get(k) for k in CACHED_FIELDS if info.get(k) is not None}
+
+
+class MetadataCache:
+    """LRU + TTL cache for resolved yt-dlp metadata with an optional SQLite tier.
+
+    Memory lookups stay synchronous. The SQLite tier runs on one
+    background thread: misses read through it, and puts and invalidations
+    are written behind. Reads queue behind earlier writes on that thread,
+    so an invalidated entry never comes back from disk.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3 * 3600, expiry_margin: float = 600,
+                 db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.expiry_margin = expiry_margin
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_errors = 0
+        self._db = None
+        self._disk: Optional[ThreadPoolExecutor] = None
+        if db_path:
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ytcache")
+            self._disk.submit(self._open, db_path)
+
+    @staticmethod
+    def key(query: str, video: bool) -> str:
+        return f"{'v' if video else 'a'}:{normalize_query(query)}"
+
+    def _expires_at(self, info: dict) -> float:
+        expires_at = time.time() + self.ttl
+        url_expires = url_expiry(info.get("url"))
+        if url_expires:
+            expires_at = min(expires_at, url_expires - self.expiry_margin)
+        return expires_at
+
+    def lookup(self, query: str, video: bool) -> Optional[dict]:
+        # Memory only; never touches the disk tier.
+        key = self.key(query, video)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, info = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(info)
+                del self._entries[key]
+        return None
+
+    async def get(self, query: str, video: bool) -> Optional[dict]:
+        info = self.lookup(query, video)
+        if info:
+            return info
+        if self._disk:
+            key = self.key(query, video)
+            row = await asyncio.get_event_loop().run_in_executor(self._disk, self._read, key)
+            if row and row[1] > time.time():
+                info = json.loads(row[0])
+                with self._lock:
+                    self._store(key, row[1], info)
+                    self.disk_hits += 1
+                return dict(info)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, video: bool, info: dict):
+        if info.get("is_live") or not info.get("url"):
+            return
+        key = self.key(query, video)
+        info = trim_info(info)
+        expires_at = self._expires_at(info)
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._store(key, expires_at, info)
+        if self._disk:
+            self._disk.submit(
+                self._write, "INSERT OR REPLACE INTO ytmeta (key, info, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(info), expires_at),
+            )
+
+    def invalidate(self, query: str, video: bool):
+        key = self.key(query, video)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._disk:
+            self._disk.submit(self._write, "DELETE FROM ytmeta WHERE key = ?", (key,))
+
+    def close(self):
+        # Waits for pending writes, so call it from a thread at shutdown.
+        if self._disk:
+            self._disk.shutdown(wait=True)
+            self._disk = None
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    # Everything below runs on the disk thread.
+
+    def _open(self, db_path: str):
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ytmeta (key TEXT PRIMARY KEY, info TEXT, expires_at REAL)"
+            )
+            self._db.execute("DELETE FROM ytmeta WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+        except Exception as e:
+            logger.warning(f"Metadata cache disk tier disabled ({db_path}): {e}")
+            self._db = None
+
+    def _read(self, key: str) -> Optional[Tuple[str, float]]:
+        if not self._db:
+            return None
+        try:
+            return self._db.execute("SELECT info, expires_at FROM ytmeta WHERE key = ?", (key,)).fetchone()
+        except Exception as e:
+            self.disk_errors += 1
+            logger.warning(f"Metadata cache disk read failed: {e}")
+            return None
+
+    def _write(self, sql: str, params: tuple):
+        if not self._db:
+            return
+        try:
+            self._db.execute(sql, params)
+            self._db.commit()
+        except Exception as e:
+            self.disk_errors += 1
+            logger.warning(f"Metadata cache disk write failed: {e}")
+
+    def _store(self, key: str, expires_at: float, info: dict):
+        self._entries[key] = (expires_at, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_errors": self.disk_errors,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }